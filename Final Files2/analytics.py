@@ -1,71 +1,392 @@
 import datetime
-import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime, timedelta
-import matplotlib.dates as mdates
-from habit import Frequency, Checkpoint, Habit
+import os
+from collections import namedtuple
+from itertools import chain, groupby
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, text
+from habit import Frequency, Checkpoint, Habit, HabitRecord, HabitStats, ChangeCounter
+from cache import analytics_cache
+from instrumentation import instrumented, idle, fetch_raw
 
+# numpy and matplotlib are imported by the functions that use them,
+# so that starting the application does not pay for loading them
 
-def get_longest_streak_for_habit(habit):
-    """Calculate the longest streak of consecutive checkpoints for a habit.
 
-    Calculates and returns the longest streak of consecutive checkpoints for the given habit.
+# number of days between two consecutive checkpoints that keeps a streak alive
+FREQUENCY_STEPS = {Frequency.DAILY: 1, Frequency.WEEKLY: 7}
+
+# per-habit result of the streak engine
+StreakStats = namedtuple("StreakStats", ["longest", "current", "broken", "last_day"])
+
+
+def _habit_day_ordinals(habit):
+    """Convert the checkpoints of a habit into an array of day ordinals.
 
     Args:
-        habit (Habit): The Habit object for which to calculate the longest streak.
+        habit (Habit or HabitRecord): The habit whose checkpoints are converted.
 
     Returns:
-        int: The length of the longest streak of consecutive checkpoints.
+        numpy.ndarray: An int64 array with one proleptic Gregorian ordinal per checkpoint.
     """
-    checkpoints = sorted(habit.checkpoints, key=lambda x: (x.checkpoint_date.month, x.checkpoint_date.day))
-    streak = 0
-    max_streak = 0
-    previous_start_date = None
+    import numpy as np
+    if isinstance(habit, HabitRecord):
+        return np.asarray(habit.days, dtype=np.int64)
+    return np.fromiter((checkpoint.day for checkpoint in habit.checkpoints),
+                       dtype=np.int64, count=len(habit.checkpoints))
 
-    for checkpoint in checkpoints:
-        start_date = checkpoint.checkpoint_date.date()
-        # print(start_date)
-        if habit.frequency == Frequency.WEEKLY:
-            if previous_start_date is None or (start_date - previous_start_date).days == 7:
-                streak += 1
-            else:
-                max_streak = max(max_streak, streak)
-                streak = 1
-            previous_start_date = start_date
 
-        elif habit.frequency == Frequency.DAILY:
-            if previous_start_date is None or (start_date - previous_start_date).days == 1:
-                streak += 1
-            else:
-                max_streak = max(max_streak, streak)
-                streak = 1
-            previous_start_date = start_date
+def compute_runs_from_arrays(owners, days, steps):
+    """Split the checkpoints of many habits into runs.
 
-    max_streak = max(max_streak, streak)
-    return max_streak
+    A run is a sequence of checkpoints of one habit whose consecutive days differ by
+    exactly the step of that habit, several checkpoints on the same day count once.
+    The inputs do not have to be sorted.
 
+    Args:
+        owners (numpy.ndarray): Habit position (0..n-1) of every checkpoint.
+        days (numpy.ndarray): Day ordinal of every checkpoint.
+        steps (numpy.ndarray): Streak step in days for every habit, 0 if the habit has no known frequency.
 
-def get_longest_run_streak(habits):
-    """Calculate the longest run streak for habits with weekly and daily frequencies.
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The habit position, first day and
+        last day of every run, ordered by habit and first day. Habits without a known
+        frequency have no runs.
+    """
+    import numpy as np
+    steps = np.asarray(steps, dtype=np.int64)
+    owners = np.asarray(owners, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    # habits without a known frequency never have a streak
+    known = steps[owners] > 0
+    owners, days = owners[known], days[known]
+    if not len(days):
+        return owners, days, days
+
+    # sort by habit first and by the full date second
+    order = np.lexsort((days, owners))
+    owners, days = owners[order], days[order]
+    # several checkpoints on the same day count once
+    keep = np.ones(len(days), dtype=bool)
+    keep[1:] = (owners[1:] != owners[:-1]) | (days[1:] != days[:-1])
+    owners, days = owners[keep], days[keep]
+    step = steps[owners]
+
+    # a new run starts at every habit boundary and at every gap that is not one step
+    run_start = np.ones(len(days), dtype=bool)
+    run_start[1:] = (owners[1:] != owners[:-1]) | (np.diff(days) != step[1:])
+    starts = np.flatnonzero(run_start)
+    return owners[starts], days[starts], days[np.append(starts[1:], len(days)) - 1]
+
+
+def streaks_from_runs(run_owners, start_days, end_days, steps, today=None):
+    """Calculate the streak results of many habits from their runs.
 
-    Calculates and returns the longest run streak for habits with weekly frequency and daily frequency.
-    A run streak is defined as the longest consecutive streak of checkpoints for each frequency type.
+    Args:
+        run_owners (numpy.ndarray): Habit position (0..n-1) of every run, grouped by habit.
+        start_days (numpy.ndarray): The first day of every run, ascending within a habit.
+        end_days (numpy.ndarray): The last day of every run.
+        steps (numpy.ndarray): Streak step in days for every habit.
+        today (int): Day ordinal used to decide whether the last run is still current. Defaults to today.
+
+    Returns:
+        List[StreakStats]: One result per habit, in the order of ``steps``.
+    """
+    import numpy as np
+    steps = np.asarray(steps, dtype=np.int64)
+    n_habits = len(steps)
+    if today is None:
+        today = date.today().toordinal()
+    longest = np.zeros(n_habits, dtype=np.int64)
+    current = np.zeros(n_habits, dtype=np.int64)
+    broken = np.zeros(n_habits, dtype=bool)
+    last_day = np.full(n_habits, -1, dtype=np.int64)
+
+    run_owners = np.asarray(run_owners, dtype=np.int64)
+    if len(run_owners):
+        start_days = np.asarray(start_days, dtype=np.int64)
+        end_days = np.asarray(end_days, dtype=np.int64)
+        run_lengths = (end_days - start_days) // steps[run_owners] + 1
+
+        np.maximum.at(longest, run_owners, run_lengths)
+        broken = np.bincount(run_owners, minlength=n_habits) > 1
+
+        # the last run of every habit decides its current streak
+        last_run = np.flatnonzero(np.append(run_owners[1:] != run_owners[:-1], True))
+        last_owners = run_owners[last_run]
+        last_day[last_owners] = end_days[last_run]
+        alive = today - last_day[last_owners] <= steps[last_owners]
+        current[last_owners] = np.where(alive, run_lengths[last_run], 0)
+
+    return [StreakStats(int(longest[i]), int(current[i]), bool(broken[i]),
+                        int(last_day[i]) if last_day[i] >= 0 else None)
+            for i in range(n_habits)]
+
+
+def compute_streaks_from_arrays(owners, days, steps, today=None):
+    """Run the vectorized streak engine over the checkpoints of many habits at once.
+
+    The checkpoints of all habits are passed as two flat arrays: ``owners`` holds the
+    position of the habit each checkpoint belongs to and ``days`` its day ordinal.
+    They do not have to be sorted. A run is a sequence of checkpoints of one habit
+    whose consecutive days differ by exactly the step of that habit, several checkpoints
+    on the same day count once.
 
     Args:
-        habits: retrieved from the database.
+        owners (numpy.ndarray): Habit position (0..n-1) of every checkpoint.
+        days (numpy.ndarray): Day ordinal of every checkpoint.
+        steps (numpy.ndarray): Streak step in days for every habit, 0 if the habit has no known frequency.
+        today (int): Day ordinal used to decide whether the last run is still current. Defaults to today.
 
     Returns:
-        Tuple[int, List[Habit], int, List[Habit]]: A tuple containing the longest weekly streak,
-        the list of habits with the longest weekly streak, the longest daily streak, and the list
-        of habits with the longest daily streak.
+        List[StreakStats]: One result per habit, in the order of ``steps``.
+    """
+    return streaks_from_runs(*compute_runs_from_arrays(owners, days, steps), steps, today)
+
+
+@instrumented("analytics.compute_streaks")
+def compute_streaks(habits, today=None):
+    """Calculate longest, current and broken streak information for many habits in one pass.
+
+    Args:
+        habits (List[Habit or HabitRecord]): The habits to evaluate.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+
+    Returns:
+        List[StreakStats]: One result per habit, in the order of ``habits``.
+    """
+    import numpy as np
+    day_arrays = [_habit_day_ordinals(habit) for habit in habits]
+    owners = np.repeat(np.arange(len(habits), dtype=np.int64), [len(days) for days in day_arrays])
+    days = np.concatenate(day_arrays) if day_arrays else np.empty(0, dtype=np.int64)
+    steps = [FREQUENCY_STEPS.get(habit.frequency, 0) for habit in habits]
+    return compute_streaks_from_arrays(owners, days, steps, today)
+
+
+# julianday() of 0001-01-01 truncated to an integer, minus one: turns a julian day into a date ordinal
+JULIAN_DAY_ORDINAL_OFFSET = 1721424
+
+# gaps-and-islands over the checkpoints table: a new island starts whenever the distance to the
+# previous checkpoint of the same habit is not exactly one step, the running sum numbers the islands
+STREAKS_SQL = text("""
+WITH days AS (
+    SELECT DISTINCT c.habit_id AS habit_id,
+           CASE h.frequency WHEN 'DAILY' THEN 1 WHEN 'WEEKLY' THEN 7 END AS step,
+           c.day AS day
+    FROM checkpoints c JOIN habits h ON h.id = c.habit_id
+    WHERE h.frequency IN ('DAILY', 'WEEKLY')
+), flagged AS (
+    SELECT habit_id, step, day,
+           CASE WHEN day - LAG(day) OVER (PARTITION BY habit_id ORDER BY day) = step
+                THEN 0 ELSE 1 END AS new_run
+    FROM days
+), islands AS (
+    SELECT habit_id, step, day,
+           SUM(new_run) OVER (PARTITION BY habit_id ORDER BY day ROWS UNBOUNDED PRECEDING) AS island
+    FROM flagged
+), runs AS (
+    SELECT habit_id, step, island, COUNT(*) AS length, MAX(day) AS last_day,
+           island = MAX(island) OVER (PARTITION BY habit_id) AS is_last
+    FROM islands
+    GROUP BY habit_id, island
+)
+SELECT habit_id,
+       MAX(length) AS longest,
+       SUM(CASE WHEN is_last AND :today - last_day <= step THEN length ELSE 0 END) AS current,
+       COUNT(*) > 1 AS broken,
+       MAX(last_day) AS last_day
+FROM runs
+GROUP BY habit_id
+""")
+
+SEGMENTS_SQL = "SELECT habit_id, start_day, end_day FROM streak_segments WHERE start_day <= ?"
+
+# result for a habit without any checkpoints
+NO_STREAK = StreakStats(0, 0, False, None)
+
+# above this many habits queries read all rows instead of filtering by ID
+MAX_FILTER_IDS = 500
+
+
+@instrumented("analytics.query_streaks")
+def query_streaks(session, today=None):
+    """Calculate the streaks of every habit inside SQLite with window functions.
+
+    No checkpoint rows are loaded into Python, a single aggregate row per habit is returned.
+    Requires SQLite 3.25 or newer.
+
+    Args:
+        session (Session): The session used to run the query.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+
+    Returns:
+        Dict[int, StreakStats]: The streak results keyed by habit ID. Habits without
+        checkpoints are missing, use NO_STREAK for them.
+    """
+    if today is None:
+        today = date.today().toordinal()
+    rows = session.execute(STREAKS_SQL, {"today": today})
+    return {habit_id: StreakStats(longest, current, bool(broken), last_day)
+            for habit_id, longest, current, broken, last_day in rows}
+
+
+@instrumented("analytics.query_habit_stats")
+def query_habit_stats(session, habit_ids=None, today=None):
+    """Read the precomputed streaks from the habit_stats table.
+
+    Only one row per habit is read, regardless of the number of checkpoints.
+
+    Args:
+        session (Session): The session used to run the query.
+        habit_ids (Collection[int]): Only read these habits, all habits if not given.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+
+    Returns:
+        Dict[int, StreakStats]: The streak results keyed by habit ID. Habits without
+        checkpoints may be missing, use NO_STREAK for them.
+    """
+    if today is None:
+        today = date.today().toordinal()
+    query = session.query(HabitStats.habit_id, HabitStats.longest_streak, HabitStats.last_run,
+                          HabitStats.broken, HabitStats.last_day, Habit.frequency) \
+        .join(Habit, Habit.id == HabitStats.habit_id)
+    if habit_ids is not None:
+        query = query.filter(HabitStats.habit_id.in_(habit_ids))
+    stats = {}
+    for habit_id, longest, last_run, broken, last_day, frequency in query:
+        alive = last_day is not None and today - last_day <= FREQUENCY_STEPS.get(frequency, 0)
+        stats[habit_id] = StreakStats(longest, last_run if alive else 0, broken, last_day)
+    return stats
+
+
+def query_change_counter(session):
+    """Return the number of changes made to the habit statistics, by any connection or process.
+
+    Args:
+        session (Session): The session used to run the query.
+
+    Returns:
+        int: The value of the change_counter row, see ChangeCounter.
+    """
+    return session.execute(select([ChangeCounter.__table__.c.value])).scalar() or 0
+
+
+@instrumented("analytics.query_segment_streaks")
+def query_segment_streaks(session, habit_ids=None, today=None):
+    """Calculate the streaks of habits as of a day from the streak_segments table.
+
+    One row per run is read, regardless of the number of checkpoints. Runs starting after
+    ``today`` are ignored and runs reaching past it are cut at it, so the results describe
+    the habits as they were on that day.
+
+    Args:
+        session (Session): The session used to run the query.
+        habit_ids (Collection[int]): Only read these habits, all habits if not given.
+        today (int): Day ordinal the streaks are evaluated at. Defaults to today.
+
+    Returns:
+        Dict[int, StreakStats]: The streak results keyed by habit ID. Habits without
+        checkpoints until that day are missing, use NO_STREAK for them.
+    """
+    import numpy as np
+    if today is None:
+        today = date.today().toordinal()
+    habits = Habit.__table__
+    frequencies = select([habits.c.id, habits.c.frequency])
+    sql = SEGMENTS_SQL
+    if habit_ids is not None:
+        habit_ids = [int(habit_id) for habit_id in habit_ids]
+        frequencies = frequencies.where(habits.c.id.in_(habit_ids))
+        sql += f" AND habit_id IN ({', '.join(map(str, habit_ids)) or 'NULL'})"
+    # the segments are plain integers, read them on the raw cursor without building result rows
+    rows = fetch_raw(session.connection(), sql + " ORDER BY habit_id, start_day", (today,))
+    if not rows:
+        return {}
+    habit_steps = {habit_id: FREQUENCY_STEPS.get(frequency, 0) for habit_id, frequency in session.execute(frequencies)}
+    runs = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+    ids, run_owners = np.unique(runs[:, 0], return_inverse=True)
+    steps = np.array([habit_steps.get(habit_id, 0) for habit_id in ids.tolist()], dtype=np.int64)
+    start_days, end_days = runs[:, 1], runs[:, 2]
+    # the last day of a run on or before today
+    run_steps = np.maximum(steps[run_owners], 1)
+    end_days = np.minimum(end_days, start_days + (today - start_days) // run_steps * run_steps)
+    return dict(zip(ids.tolist(), streaks_from_runs(run_owners, start_days, end_days, steps, today)))
+
+
+@instrumented("analytics.get_habit_streaks")
+def get_habit_streaks(habits, session=None, snapshot=None, recompute=False):
+    """Get the streak results for habits, from the habit_stats table when a session is given.
+
+    Results read through a session are memoized in analytics_cache until the
+    checkpoints of the habit change, the habit statistics of the database are written
+    by any process or the day changes. Habits changed by the uncommitted transaction
+    of the session are read past the cache, so other sessions never see those results.
+
+    Args:
+        habits (List[Habit]): The habits to evaluate.
+        session (Session): Optional session used to read the streaks with query_habit_stats,
+            otherwise they are computed from the checkpoints of the habits.
+        snapshot (Snapshot): Optional memory-mapped snapshot the streaks are computed from
+            instead, see snapshot.py. Takes precedence over ``session``.
+        recompute (bool): Whether to compute the streaks from the checkpoints inside SQLite
+            with query_streaks instead of reading habit_stats, bypassing the cache.
+
+    Returns:
+        List[StreakStats]: One result per habit, in the order of ``habits``.
+    """
+    if snapshot is not None:
+        return snapshot.habit_streaks([habit.id for habit in habits])
+    if session is None:
+        return compute_streaks(habits)
+    today = date.today().toordinal()
+    if recompute:
+        stats = query_streaks(session, today)
+        return [stats.get(habit.id, NO_STREAK) for habit in habits]
+
+    def read(habit_ids):
+        stats = query_habit_stats(session, habit_ids if len(habit_ids) <= MAX_FILTER_IDS else None, today)
+        return {habit_id: stats.get(habit_id, NO_STREAK) for habit_id in habit_ids}
+
+    # read before the statistics, a change committed in between makes the results stale
+    generation = query_change_counter(session)
+    return analytics_cache.get_many("streaks", session.get_bind(), [habit.id for habit in habits], read, today,
+                                    uncached=session.info.get("changed_habit_ids", ()), generation=generation)
+
+
+@instrumented("analytics.get_longest_streak_for_habit")
+def get_longest_streak_for_habit(habit, session=None, snapshot=None):
+    """Calculate the longest streak of consecutive checkpoints for a habit.
+
+    Calculates and returns the longest streak of consecutive checkpoints for the given habit.
+
+    Args:
+        habit (Habit): The Habit object for which to calculate the longest streak.
+        session (Session): If given, the streak is read from the habit_stats table instead of
+            loading the checkpoints of the habit.
+        snapshot (Snapshot): If given, the streak is computed from the snapshot.
+
+    Returns:
+        int: The length of the longest streak of consecutive checkpoints.
+    """
+    return get_habit_streaks([habit], session, snapshot)[0].longest
+
+
+def longest_run_streak_from_stats(habits, stats):
+    """Pick the habits with the longest weekly and daily streaks from precomputed results.
+
+    Args:
+        habits (List[Habit]): The evaluated habits.
+        stats (List[StreakStats]): The streak results, in the order of ``habits``.
+
+    Returns:
+        Tuple[int, List[Habit], int, List[Habit]]: Same as get_longest_run_streak.
     """
     longest_weekly_streak = 0
     longest_weekly_streak_habits = []
     longest_daily_streak = 0
     longest_daily_streak_habits = []
 
-    for habit in habits:
-        max_streak = get_longest_streak_for_habit(habit)
+    for habit, habit_stats in zip(habits, stats):
+        max_streak = habit_stats.longest
 
         if habit.frequency == Frequency.WEEKLY:
             if max_streak > longest_weekly_streak:
@@ -84,46 +405,152 @@ def get_longest_run_streak(habits):
     return longest_weekly_streak, longest_weekly_streak_habits, longest_daily_streak, longest_daily_streak_habits
 
 
-def get_broken_streak_habits(habits):
+@instrumented("analytics.get_longest_run_streak")
+def get_longest_run_streak(habits, session=None, snapshot=None, recompute=False):
+    """Calculate the longest run streak for habits with weekly and daily frequencies.
+
+    Calculates and returns the longest run streak for habits with weekly frequency and daily frequency.
+    A run streak is defined as the longest consecutive streak of checkpoints for each frequency type.
+
+    Args:
+        habits: retrieved from the database.
+        session (Session): If given, the streaks are read from the habit_stats table instead of
+            loading the checkpoints of every habit.
+        snapshot (Snapshot): If given, the streaks are computed from the snapshot.
+        recompute (bool): Whether to compute the streaks from the checkpoints in SQLite, see get_habit_streaks.
+
+    Returns:
+        Tuple[int, List[Habit], int, List[Habit]]: A tuple containing the longest weekly streak,
+        the list of habits with the longest weekly streak, the longest daily streak, and the list
+        of habits with the longest daily streak.
+    """
+    habits = list(habits)
+    return longest_run_streak_from_stats(habits, get_habit_streaks(habits, session, snapshot, recompute))
+
+
+@instrumented("analytics.get_broken_streak_habits")
+def get_broken_streak_habits(habits, session=None, snapshot=None, recompute=False):
     """Retrieve habits with broken streaks.
 
         Retrieves habits from the database and identifies the habits with broken streaks,
         where a streak is considered broken if there is a gap between consecutive checkpoints
         for each frequency type (weekly or daily).
 
+        Args:
+            habits (List[Habit]): The habits to check.
+            session (Session): If given, the streaks are read from the habit_stats table instead of
+                loading the checkpoints of every habit.
+            snapshot (Snapshot): If given, the streaks are computed from the snapshot.
+            recompute (bool): Whether to compute the streaks from the checkpoints in SQLite, see get_habit_streaks.
+
         Returns:
             List[Habit]: A list of habits with broken streaks.
     """
-    broken_streak_habits = []
+    habits = list(habits)
+    return [habit for habit, habit_stats in zip(habits, get_habit_streaks(habits, session, snapshot, recompute))
+            if habit_stats.broken]
 
-    for habit in habits:
-        checkpoints = sorted(habit.checkpoints, key=lambda x: (x.checkpoint_date.month, x.checkpoint_date.day))
-        previous_end_date = None
-        streak_broken = False
 
-        for checkpoint in checkpoints:
-            start_date = checkpoint.checkpoint_date.date()
-            if habit.frequency == Frequency.WEEKLY:
-                if previous_end_date is not None and (
-                        start_date - previous_end_date != timedelta(weeks=1)
-                        or start_date.weekday() != previous_end_date.weekday()
-                ):
-                    streak_broken = True
-                    break
+def _scan_streak(days, step, today):
+    """Calculate the streaks of one habit from its day ordinals in a single pass.
 
-            elif habit.frequency == Frequency.DAILY:
-                if previous_end_date is not None and (start_date - previous_end_date != timedelta(days=1)):
-                    streak_broken = True
-                    break
+    Args:
+        days (Iterable[int]): The day ordinals of the checkpoints in ascending order.
+        step (int): The streak step in days, 0 if the habit has no known frequency.
+        today (int): Day ordinal used for the current streak.
+
+    Returns:
+        StreakStats: The streak result, the days are not kept.
+    """
+    if not step:
+        return NO_STREAK
+    longest = run = runs = 0
+    last_day = None
+    for day in days:
+        if day == last_day:
+            continue
+        if last_day is not None and day - last_day == step:
+            run += 1
+        else:
+            run = 1
+            runs += 1
+        longest = max(longest, run)
+        last_day = day
+    current = run if last_day is not None and today - last_day <= step else 0
+    return StreakStats(longest, current, runs > 1, last_day)
+
+
+def iter_habit_streaks(session, today=None, chunk_size=1000, frequency=None):
+    """Stream the streaks of every habit, one habit at a time.
+
+    The habits and their checkpoint days are read in one query ordered by (habit_id, day)
+    and fetched ``chunk_size`` rows at a time, so memory does not grow with the number of
+    habits or checkpoints and the first results are available before the scan is finished.
+
+    Args:
+        session (Session): The session used to run the query.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+        chunk_size (int): The number of rows fetched at a time.
+        frequency (Frequency): Only scan habits with this frequency, if given.
+
+    Yields:
+        Tuple[int, Frequency, StreakStats]: The ID, frequency and streaks of every habit, by ID.
+    """
+    if today is None:
+        today = date.today().toordinal()
+    query = session.query(Habit.id, Habit.frequency, Checkpoint.day) \
+        .outerjoin(Checkpoint, Checkpoint.habit_id == Habit.id) \
+        .order_by(Habit.id, Checkpoint.day) \
+        .yield_per(chunk_size)
+    if frequency is not None:
+        query = query.filter(Habit.frequency == frequency)
+    for (habit_id, habit_frequency), rows in groupby(query, key=lambda row: (row[0], row[1])):
+        days = (day for _, _, day in rows if day is not None)
+        yield habit_id, habit_frequency, _scan_streak(days, FREQUENCY_STEPS.get(habit_frequency, 0), today)
+
+
+def iter_broken_streak_habits(session, chunk_size=1000):
+    """Stream the IDs of the habits with broken streaks, see iter_habit_streaks.
+
+    Args:
+        session (Session): The session used to run the query.
+        chunk_size (int): The number of rows fetched at a time.
+
+    Yields:
+        int: The ID of every habit with a broken streak, in ascending order.
+    """
+    for habit_id, _, habit_stats in iter_habit_streaks(session, chunk_size=chunk_size):
+        if habit_stats.broken:
+            yield habit_id
 
-            previous_end_date = start_date
 
-        if streak_broken:
-            broken_streak_habits.append(habit)
+@instrumented("analytics.stream_longest_run_streak")
+def stream_longest_run_streak(session, chunk_size=1000):
+    """Find the habits with the longest weekly and daily streaks in one streaming pass.
 
-    return broken_streak_habits
+    Only the running maximums and the IDs of the habits reaching them are kept.
 
+    Args:
+        session (Session): The session used to run the query.
+        chunk_size (int): The number of rows fetched at a time.
 
+    Returns:
+        Tuple[int, List[int], int, List[int]]: Same as get_longest_run_streak, with habit IDs
+        instead of habits.
+    """
+    best = {Frequency.WEEKLY: (0, []), Frequency.DAILY: (0, [])}
+    for habit_id, frequency, habit_stats in iter_habit_streaks(session, chunk_size=chunk_size):
+        if frequency not in best:
+            continue
+        streak, habit_ids = best[frequency]
+        if habit_stats.longest > streak:
+            best[frequency] = (habit_stats.longest, [habit_id])
+        elif habit_stats.longest == streak:
+            habit_ids.append(habit_id)
+    return best[Frequency.WEEKLY] + best[Frequency.DAILY]
+
+
+@instrumented("analytics.plot_habits_with_checkpoints")
 def plot_habits_with_checkpoints(habits):
     """Create a graph showing each habit and its specific checkpoints.
 
@@ -133,6 +560,10 @@ def plot_habits_with_checkpoints(habits):
     Returns:
         None
     """
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     plt.figure(figsize=(10, 6))
 
     # Get the date range for the graph
@@ -153,7 +584,8 @@ def plot_habits_with_checkpoints(habits):
     for habit in habits:
         print(f"{habit.id}. {habit.task}")
     while True:
-        choice = input("Enter the habit numbers to display (separated by comma): ")
+        with idle():
+            choice = input("Enter the habit numbers to display (separated by comma): ")
         selected_ids = [int(h.strip()) for h in choice.split(",")]
         selected_habits = [habit for habit in habits if habit.id in selected_ids]
         if len(selected_habits) == len(selected_ids):
@@ -162,7 +594,7 @@ def plot_habits_with_checkpoints(habits):
             print("Invalid habit number(s). Please try again.")
 
     for i, habit in enumerate(selected_habits):
-        checkpoints = sorted(habit.checkpoints, key=lambda x: (x.checkpoint_date.month, x.checkpoint_date.day))
+        checkpoints = sorted(habit.checkpoints, key=lambda x: x.checkpoint_date)
         if checkpoints:
             dates = [checkpoint.checkpoint_date.date() for checkpoint in checkpoints]
             y_values = [i] * len(checkpoints)
@@ -185,4 +617,68 @@ def plot_habits_with_checkpoints(habits):
     plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%m-%d"))
     plt.gcf().autofmt_xdate()  # Rotate and align the x-axis labels for better visibility
     plt.tight_layout()
-    plt.show()
+    with idle():
+        plt.show()
+
+
+def _days_to_datetime64(days):
+    """Convert day ordinals into numpy dates that matplotlib can plot.
+
+    Args:
+        days (numpy.ndarray): Proleptic Gregorian day ordinals.
+
+    Returns:
+        numpy.ndarray: The days as datetime64[D] values.
+    """
+    import numpy as np
+    return np.datetime64('0001-01-01', 'D') + (np.asarray(days, dtype=np.int64) - 1)
+
+
+@instrumented("analytics.render_habits_with_checkpoints")
+def render_habits_with_checkpoints(habits, output_path):
+    """Draw habits and their checkpoints into a PNG or SVG file without a display.
+
+    Every habit is drawn with two scatter collections: its checkpoints and grey dots for
+    every day from its first checkpoint to the last checkpoint of all habits. The figure
+    is rendered by the Agg canvas, pyplot and its global state are not used.
+
+    Args:
+        habits (List[Habit or HabitRecord]): The habits to draw, from bottom to top.
+        output_path (str): The file to write, the format is chosen by its extension.
+
+    Raises:
+        ValueError: If the file extension is not .png or .svg.
+    """
+    import matplotlib.dates as mdates
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in ('.png', '.svg'):
+        raise ValueError(f"Unsupported image type '{extension}', expected .png or .svg")
+
+    day_arrays = [np.unique(_habit_day_ordinals(habit)) for habit in habits]
+    last_days = [days[-1] for days in day_arrays if len(days)]
+    end_day = max(last_days) if last_days else date.today().toordinal()
+
+    figure = Figure(figsize=(10, max(6, 0.4 * len(habits) + 2)))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    for i, (habit, days) in enumerate(zip(habits, day_arrays)):
+        if not len(days):
+            continue
+        background = np.arange(days[0], end_day + 1)
+        axes.scatter(_days_to_datetime64(background), np.full(len(background), i), color='grey', alpha=0.3, s=20)
+        axes.scatter(_days_to_datetime64(days), np.full(len(days), i), s=36, label=habit.task, zorder=2)
+
+    axes.set_yticks(np.arange(len(habits)))
+    axes.set_yticklabels([habit.task for habit in habits])
+    axes.set_xlabel('Date')
+    axes.set_ylabel('Habit')
+    axes.set_title('Habits with Checkpoints')
+    locator = mdates.AutoDateLocator()
+    axes.xaxis.set_major_locator(locator)
+    axes.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    figure.tight_layout()
+    figure.savefig(output_path)
@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from benchmark import time_call, bench_plot
+from generator import generate_dataset
+from analytics import get_longest_streak_for_habit, get_longest_run_streak, get_broken_streak_habits, \
+    compute_streaks, query_streaks, query_habit_stats, query_segment_streaks, iter_habit_streaks, iter_broken_streak_habits, \
+    stream_longest_run_streak
+from cache import analytics_cache
+from rolling import load_completion_matrix
+from snapshot import export_snapshot, open_snapshot
+from config import DatabaseConfig
+from db import configure_database, load_habit_records, session as main_session
+from habit import Habit, Frequency
+from main import create_habit, add_checkpoint
+
+# (habits, days of history) of the default scales
+DEFAULT_SCALES = [(100, 90), (1000, 365), (5000, 365)]
+
+# differences below this many seconds are treated as noise when comparing with a baseline
+NOISE_SECONDS = 0.002
+
+
+def parse_scales(text):
+    """Parse scales written as HABITSxDAYS separated by commas, e.g. "100x90,1000x365".
+
+    Args:
+        text (str): The scales.
+
+    Returns:
+        List[Tuple[int, int]]: The number of habits and days of every scale.
+
+    Raises:
+        ValueError: If a scale is not written as HABITSxDAYS.
+    """
+    scales = []
+    for scale in text.split(","):
+        habits, _, days = scale.strip().partition("x")
+        if not habits.isdigit() or not days.isdigit():
+            raise ValueError(f"Invalid scale '{scale}', expected HABITSxDAYS")
+        scales.append((int(habits), int(days)))
+    return scales
+
+
+def bench_analytics(engine, repeat=3):
+    """Time every analytics function on a populated database.
+
+    The checkpoints are loaded once up front for the functions that take habits, the
+    functions that take a session read the database themselves on every run. The analytics
+    cache is cleared before every run so that no results are reused.
+
+    Args:
+        engine (Engine): The engine of a populated database.
+        repeat (int): The number of runs per function.
+
+    Returns:
+        Dict[str, float]: The best time in seconds per function.
+    """
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    records = load_habit_records(session)
+    sample = records[:100]
+    session.close()
+    today = datetime.now().date().toordinal()
+
+    def with_session(func):
+        def run():
+            analytics_cache.clear()
+            db_session = Session()
+            func(db_session)
+            db_session.close()
+        return run
+
+    def habits_with_session(func):
+        return with_session(lambda db_session: func(db_session.query(Habit).all(), session=db_session))
+
+    return {
+        "load_habit_records": time_call(with_session(load_habit_records), repeat),
+        "get_longest_streak_for_habit_x100": time_call(
+            lambda: [get_longest_streak_for_habit(record) for record in sample], repeat),
+        "get_longest_run_streak": time_call(lambda: get_longest_run_streak(records), repeat),
+        "get_longest_run_streak_stats": time_call(habits_with_session(get_longest_run_streak), repeat),
+        "get_broken_streak_habits": time_call(lambda: get_broken_streak_habits(records), repeat),
+        "get_broken_streak_habits_stats": time_call(habits_with_session(get_broken_streak_habits), repeat),
+        "compute_streaks": time_call(lambda: compute_streaks(records), repeat),
+        "query_streaks": time_call(with_session(query_streaks), repeat),
+        "query_habit_stats": time_call(with_session(query_habit_stats), repeat),
+        "query_segment_streaks": time_call(with_session(query_segment_streaks), repeat),
+        "iter_habit_streaks": time_call(with_session(lambda db_session: list(iter_habit_streaks(db_session))), repeat),
+        "iter_broken_streak_habits": time_call(
+            with_session(lambda db_session: list(iter_broken_streak_habits(db_session))), repeat),
+        "stream_longest_run_streak": time_call(with_session(stream_longest_run_streak), repeat),
+        "completion_summary_90d": time_call(with_session(
+            lambda db_session: load_completion_matrix(db_session, today - 89, today).summary()), repeat),
+    }
+
+
+def bench_snapshot(engine, directory, repeat=3):
+    """Time exporting a columnar snapshot and computing the streaks from it.
+
+    Args:
+        engine (Engine): The engine of a populated database.
+        directory (str): The snapshot directory, replaced by every full export.
+        repeat (int): The number of runs per benchmark.
+
+    Returns:
+        Dict[str, float]: The best time in seconds per benchmark.
+    """
+    return {
+        "snapshot_export_full": time_call(lambda: export_snapshot(engine, directory, full=True), repeat),
+        "snapshot_refresh": time_call(lambda: export_snapshot(engine, directory), repeat),
+        "snapshot_streaks": time_call(lambda: open_snapshot(directory).streaks(), repeat),
+    }
+
+
+def bench_ingest(path, operations=100):
+    """Time creating habits and adding checkpoints through the functions of main.py.
+
+    Every habit and every checkpoint is committed on its own, like in the interactive menu.
+
+    Args:
+        path (str): The sqlite file the application database is pointed at.
+        operations (int): The number of habits created and of checkpoints added.
+
+    Returns:
+        Dict[str, float]: The total time in seconds for the habits and for the checkpoints.
+    """
+    configure_database(DatabaseConfig(path=path))
+    habits = []
+
+    def create():
+        for number in range(operations):
+            habit = create_habit(f"Ingested {number}", Frequency.DAILY)
+            main_session.add(habit)
+            main_session.commit()
+            habits.append(habit)
+
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+
+    def check_off():
+        for number, habit in enumerate(habits):
+            add_checkpoint(habit, today - timedelta(days=number))
+
+    results = {"ingest_create_habit": time_call(create, 1), "ingest_add_checkpoint": time_call(check_off, 1)}
+    main_session.remove()
+    return results
+
+
+def run_suite(scales, directory, repeat=3, plot_habits=10, ingest=100, seed=0):
+    """Run the benchmarks on a generated database for every scale.
+
+    Args:
+        scales (List[Tuple[int, int]]): The number of habits and days of history of every scale.
+        directory (str): The directory the databases and images are written to.
+        repeat (int): The number of runs per benchmark.
+        plot_habits (int): The number of habits to draw, 0 to skip the plot benchmarks.
+        ingest (int): The number of habits and checkpoints to ingest, 0 to skip the ingestion benchmarks.
+        seed (int): The seed of the data generator.
+
+    Returns:
+        dict: The machine-readable report, with the environment under "metadata" and one
+        row per scale and benchmark under "results".
+    """
+    report = {
+        "metadata": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    for num_habits, num_days in scales:
+        path = os.path.join(directory, f"suite-{num_habits}x{num_days}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        habits, checkpoints = generate_dataset(engine, num_habits, num_days, seed=seed)
+        results = bench_analytics(engine, repeat)
+        results.update(bench_snapshot(engine, os.path.join(directory, f"snapshot-{num_habits}x{num_days}"), repeat))
+        if plot_habits:
+            results.update(bench_plot(engine, plot_habits, directory))
+        engine.dispose()
+        if ingest:
+            results.update(bench_ingest(path, ingest))
+        for name, seconds in results.items():
+            report["results"].append({"scale": f"{num_habits}x{num_days}", "habits": habits,
+                                      "checkpoints": checkpoints, "benchmark": name, "seconds": seconds})
+    return report
+
+
+def compare_results(baseline, report, tolerance=1.25):
+    """Find the benchmarks that got slower than in a baseline report.
+
+    Args:
+        baseline (dict): An earlier report of run_suite.
+        report (dict): The current report.
+        tolerance (float): The allowed slowdown factor.
+
+    Returns:
+        List[Tuple[str, str, float, float]]: The scale, benchmark, baseline seconds and current
+        seconds of every regression.
+    """
+    before = {(row["scale"], row["benchmark"]): row["seconds"] for row in baseline["results"]}
+    regressions = []
+    for row in report["results"]:
+        old = before.get((row["scale"], row["benchmark"]))
+        if old is not None and row["seconds"] > old * tolerance and row["seconds"] - old > NOISE_SECONDS:
+            regressions.append((row["scale"], row["benchmark"], old, row["seconds"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, analytics and plotting at several scales.")
+    parser.add_argument("--scales", type=parse_scales, default=DEFAULT_SCALES,
+                        help="comma separated HABITSxDAYS, e.g. 100x90,1000x365")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--plot-habits", type=int, default=10, help="habits to draw, 0 to skip plotting")
+    parser.add_argument("--ingest", type=int, default=100, help="habits and checkpoints to ingest, 0 to skip")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the data generator")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file the results are written to")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = run_suite(args.scales, directory, args.repeat, args.plot_habits, args.ingest, args.seed)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for row in report["results"]:
+        print(f"{row['scale']:<12} {row['benchmark']:<36} {row['seconds'] * 1000:10.1f} ms")
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_results(json.load(file), report, args.tolerance)
+        for scale, name, old, new in regressions:
+            print(f"REGRESSION {scale} {name}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
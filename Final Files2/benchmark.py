@@ -0,0 +1,325 @@
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+import matplotlib
+
+# render without a display, plt.show() becomes a no-op
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from habit import Base, Habit, Frequency
+from analytics import get_longest_run_streak, get_broken_streak_habits, query_streaks, \
+    longest_run_streak_from_stats, NO_STREAK, FREQUENCY_STEPS, plot_habits_with_checkpoints, render_habits_with_checkpoints, \
+    stream_longest_run_streak, iter_broken_streak_habits
+from db import load_habits, load_habit_records, load_bitmaps, migrate_schema, \
+    insert_checkpoint
+from config import DatabaseConfig, PROFILES, create_configured_engine
+from parallel import parallel_analytics
+from generator import generate_dataset
+from shards import ShardRouter, create_tenant_habit
+
+
+def populate(engine, num_habits, num_days, probability=0.8, seed=0):
+    """Fill a database with random habits and checkpoints, see generator.generate_dataset.
+
+    Args:
+        engine (Engine): The engine of the database to fill.
+        num_habits (int): The number of habits to create.
+        num_days (int): The number of days of history per habit.
+        probability (float): The chance that a habit is checked off on a given day or week.
+        seed (int): The seed of the random generator.
+    """
+    generate_dataset(engine, num_habits, num_days, probability, seed=seed)
+
+
+def time_call(func, repeat=3):
+    """Run a function several times and return the best wall clock time.
+
+    Args:
+        func (Callable): The function to time, called without arguments.
+        repeat (int): The number of runs.
+
+    Returns:
+        float: The fastest run in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_streaks(engine, repeat=3):
+    """Compare the ORM, bulk loaded, record, SQL, habit_stats, bitmap and streaming streak paths.
+
+    Every run uses a fresh session so that no checkpoints are cached between runs.
+
+    Args:
+        engine (Engine): The engine of a populated database.
+        repeat (int): The number of runs per path.
+
+    Returns:
+        Dict[str, float]: The best time in seconds per benchmark.
+    """
+    Session = sessionmaker(bind=engine)
+
+    def run(load, use_stats=False):
+        session = Session()
+        habits = load(session)
+        get_longest_run_streak(habits, session=session if use_stats else None)
+        get_broken_streak_habits(habits, session=session if use_stats else None)
+        session.close()
+
+    def run_sql():
+        session = Session()
+        habits = session.query(Habit).all()
+        stats = query_streaks(session)
+        longest_run_streak_from_stats(habits, [stats.get(habit.id, NO_STREAK) for habit in habits])
+        session.close()
+
+    def run_streaming():
+        session = Session()
+        stream_longest_run_streak(session)
+        for _ in iter_broken_streak_habits(session):
+            pass
+        session.close()
+
+    def run_bitmaps():
+        session = Session()
+        habits = session.query(Habit).all()
+        bitmaps = load_bitmaps(session)
+        for habit in habits:
+            bitmap = bitmaps[habit.id]
+            step = FREQUENCY_STEPS[habit.frequency]
+            bitmap.longest_streak(step)
+            bitmap.is_broken(step)
+        session.close()
+
+    return {
+        "streaks_orm": time_call(lambda: run(lambda session: session.query(Habit).all()), repeat),
+        "streaks_bulk": time_call(lambda: run(load_habits), repeat),
+        "streaks_records": time_call(lambda: run(load_habit_records), repeat),
+        "streaks_sql": time_call(run_sql, repeat),
+        "streaks_stats": time_call(lambda: run(lambda session: session.query(Habit).all(), True), repeat),
+        "streaks_bitmaps": time_call(run_bitmaps, repeat),
+        "streaks_streaming": time_call(run_streaming, repeat),
+    }
+
+
+def bench_parallel(path, worker_counts, repeat=3):
+    """Time the process pool analytics with different numbers of worker processes.
+
+    Args:
+        path (str): The sqlite file of a populated database.
+        worker_counts (List[int]): The numbers of worker processes to compare.
+        repeat (int): The number of runs per worker count.
+
+    Returns:
+        Dict[str, float]: The best time in seconds per worker count.
+    """
+    return {f"parallel_{workers}_workers": time_call(lambda: parallel_analytics(path, workers), repeat)
+            for workers in worker_counts}
+
+
+def bench_plot(engine, num_habits, directory, repeat=1):
+    """Compare the interactive pyplot graph with the headless renderer.
+
+    The interactive function is fed the habit IDs through a patched input().
+
+    Args:
+        engine (Engine): The engine of a populated database.
+        num_habits (int): The number of habits to draw.
+        directory (str): The directory the images are written to.
+        repeat (int): The number of runs per renderer.
+
+    Returns:
+        Dict[str, float]: The best time in seconds per benchmark.
+    """
+    session = sessionmaker(bind=engine)()
+    habits = load_habits(session)[:num_habits]
+    records = load_habit_records(session, habit_ids=[habit.id for habit in habits])
+    session.close()
+
+    def run_pyplot():
+        original_input = builtins.input
+        builtins.input = lambda prompt="": ",".join(str(habit.id) for habit in habits)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                plot_habits_with_checkpoints(habits)
+            plt.savefig(os.path.join(directory, "pyplot.png"))
+        finally:
+            builtins.input = original_input
+            plt.close("all")
+
+    return {
+        "plot_pyplot": time_call(run_pyplot, repeat),
+        "plot_render_png": time_call(lambda: render_habits_with_checkpoints(
+            records, os.path.join(directory, "render.png")), repeat),
+        "plot_render_svg": time_call(lambda: render_habits_with_checkpoints(
+            records, os.path.join(directory, "render.svg")), repeat),
+    }
+
+
+def bench_profiles(num_habits, num_days, directory, commits=500, repeat=3):
+    """Compare ingestion and query speed of the storage profiles in config.py.
+
+    For every profile a new database is filled in bulk, then ``commits`` checkpoints
+    are added with one commit each, and finally all habits are read back.
+
+    Args:
+        num_habits (int): The number of habits to create.
+        num_days (int): The number of days of history per habit.
+        directory (str): The directory the databases are created in.
+        commits (int): The number of single checkpoint transactions.
+        repeat (int): The number of query runs.
+
+    Returns:
+        Dict[str, float]: The time in seconds per profile and benchmark.
+    """
+    results = {}
+    for profile in PROFILES:
+        engine = create_configured_engine(DatabaseConfig(path=os.path.join(directory, f"{profile}.db"),
+                                                         profile=profile))
+        migrate_schema(engine)
+        results[f"{profile}_ingest_bulk"] = time_call(lambda: populate(engine, num_habits, num_days), 1)
+
+        session = sessionmaker(bind=engine)()
+        tomorrow = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=1)
+
+        def ingest_commits():
+            for day in range(commits):
+                insert_checkpoint(session, 1, tomorrow + timedelta(days=day))
+                session.commit()
+
+        results[f"{profile}_ingest_commits"] = time_call(ingest_commits, 1)
+        results[f"{profile}_query"] = time_call(lambda: load_habit_records(session), repeat)
+        session.close()
+        engine.dispose()
+    return results
+
+
+def bench_shards(directory, shard_counts, tenants=16, commits=50, profile="durable"):
+    """Measure the write throughput of concurrent tenants with different numbers of shards.
+
+    Every tenant writes from its own thread, adding ``commits`` checkpoints with one commit each.
+
+    Args:
+        directory (str): The directory the shard databases are created in.
+        shard_counts (List[int]): The numbers of shards to compare.
+        tenants (int): The number of tenants writing at the same time.
+        commits (int): The number of single checkpoint transactions per tenant.
+        profile (str): The storage profile of the shards.
+
+    Returns:
+        Dict[str, float]: The committed checkpoints per second per number of shards.
+    """
+    results = {}
+    tomorrow = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=1)
+    for shards in shard_counts:
+        router = ShardRouter.from_directory(os.path.join(directory, f"shards-{shards}"), shards,
+                                            DatabaseConfig(profile=profile, pool="queue"))
+        os.makedirs(os.path.dirname(router.paths[0]), exist_ok=True)
+        habit_ids = {}
+        for tenant in range(tenants):
+            session = router.session(f"tenant-{tenant}")
+            habit = create_tenant_habit(session, "Benchmark", Frequency.DAILY)
+            session.commit()
+            habit_ids[tenant] = habit.id
+            session.close()
+
+        def write(tenant):
+            session = router.session(f"tenant-{tenant}")
+            for day in range(commits):
+                insert_checkpoint(session, habit_ids[tenant], tomorrow + timedelta(days=day))
+                session.commit()
+            session.close()
+
+        threads = [threading.Thread(target=write, args=(tenant,)) for tenant in range(tenants)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[f"shards_{shards}_writes_per_s"] = tenants * commits / (time.perf_counter() - start)
+        router.dispose()
+    return results
+
+
+def bench_import(module="main", repeat=3):
+    """Measure how long importing a module of the application takes in a fresh interpreter.
+
+    The time is read from the output of ``python -X importtime``.
+
+    Args:
+        module (str): The module to import.
+        repeat (int): The number of interpreters to start.
+
+    Returns:
+        Dict[str, float]: The best import time in seconds.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best = float("inf")
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=directory, capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] == module:
+                best = min(best, int(fields[1]) / 1e6)
+    return {f"import_{module}": best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the habit tracker analytics.")
+    parser.add_argument("--habits", type=int, default=1000, help="number of habits")
+    parser.add_argument("--days", type=int, default=365, help="days of history per habit")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--plot-habits", type=int, default=0, help="habits to draw in the plot benchmark")
+    parser.add_argument("--max-import-ms", type=float, help="fail if importing main takes longer")
+    parser.add_argument("--profiles", action="store_true", help="compare the storage profiles")
+    parser.add_argument("--shards", default="", help="comma separated shard counts for the tenant write benchmark")
+    parser.add_argument("--workers", default="", help="comma separated worker counts for the parallel analytics, e.g. 1,2,4,8")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.db')
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        populate(engine, args.habits, args.days)
+        results = bench_streaks(engine, args.repeat)
+        if args.workers:
+            results.update(bench_parallel(path, [int(workers) for workers in args.workers.split(",")], args.repeat))
+        if args.plot_habits:
+            results.update(bench_plot(engine, args.plot_habits, directory))
+        engine.dispose()
+        if args.profiles:
+            results.update(bench_profiles(args.habits, args.days, directory, repeat=args.repeat))
+        rates = {}
+        if args.shards:
+            rates = bench_shards(directory, [int(shards) for shards in args.shards.split(",")])
+
+    results.update(bench_import(repeat=args.repeat))
+
+    print(f"{args.habits} habits, {args.days} days of history")
+    for name, seconds in results.items():
+        print(f"{name:<28} {seconds * 1000:10.1f} ms")
+    for name, rate in rates.items():
+        print(f"{name:<28} {rate:10.1f}")
+    if args.max_import_ms is not None and results["import_main"] * 1000 > args.max_import_ms:
+        sys.exit(f"importing main took longer than {args.max_import_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
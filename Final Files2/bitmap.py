@@ -0,0 +1,217 @@
+class CompletionBitmap:
+    """The completed days of a habit as a bitset, one bit per day.
+
+    Bit ``i`` of ``bits`` is set when the habit was done on day ``first_day + i``.
+    A year of history fits in 46 bytes and all queries are bit operations on a
+    Python int.
+
+    Attributes:
+        first_day (int): The day ordinal of bit 0, None for an empty bitmap.
+        bits (int): The bitset.
+    """
+    __slots__ = ("first_day", "bits")
+
+    def __init__(self, first_day=None, bits=0):
+        self.first_day = first_day
+        self.bits = bits
+
+    @classmethod
+    def from_days(cls, days):
+        """Build a bitmap from day ordinals.
+
+        Args:
+            days (Iterable[int]): The completed days, in any order, duplicates allowed.
+
+        Returns:
+            CompletionBitmap: The bitmap anchored at the earliest day.
+        """
+        days = list(days)
+        if not days:
+            return cls()
+        first_day = min(days)
+        bits = 0
+        for day in days:
+            bits |= 1 << (day - first_day)
+        return cls(first_day, bits)
+
+    @classmethod
+    def from_bytes(cls, first_day, data):
+        """Restore a bitmap stored with to_bytes.
+
+        Args:
+            first_day (int): The day ordinal of bit 0.
+            data (bytes): The little endian bitset.
+
+        Returns:
+            CompletionBitmap: The restored bitmap.
+        """
+        return cls(first_day, int.from_bytes(data, "little"))
+
+    def to_bytes(self):
+        """Return the bitset as little endian bytes for storage."""
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+
+    def __eq__(self, other):
+        return isinstance(other, CompletionBitmap) and (self.first_day, self.bits) == (other.first_day, other.bits)
+
+    def __repr__(self):
+        return f"CompletionBitmap(first_day={self.first_day!r}, days={self.count()})"
+
+    @property
+    def last_day(self):
+        """int: The day ordinal of the last completed day, None for an empty bitmap."""
+        if not self.bits:
+            return None
+        return self.first_day + self.bits.bit_length() - 1
+
+    def add(self, day):
+        """Mark a day as completed, moving the anchor if the day is before the first day.
+
+        Args:
+            day (int): The day ordinal.
+        """
+        if self.first_day is None:
+            self.first_day = day
+        elif day < self.first_day:
+            self.bits <<= self.first_day - day
+            self.first_day = day
+        self.bits |= 1 << (day - self.first_day)
+
+    def discard(self, day):
+        """Mark a day as not completed, moving the anchor to the new first day if needed.
+
+        Args:
+            day (int): The day ordinal.
+        """
+        if not self.done_on(day):
+            return
+        self.bits &= ~(1 << (day - self.first_day))
+        if not self.bits:
+            self.first_day = None
+            return
+        # drop the trailing zero bits so that bit 0 is the first completed day again
+        shift = (self.bits & -self.bits).bit_length() - 1
+        self.bits >>= shift
+        self.first_day += shift
+
+    def done_on(self, day):
+        """Check whether the habit was done on a day.
+
+        Args:
+            day (int): The day ordinal.
+
+        Returns:
+            bool: True if the day is completed.
+        """
+        if self.first_day is None or day < self.first_day:
+            return False
+        return bool(self.bits >> (day - self.first_day) & 1)
+
+    def count(self, start_day=None, end_day=None):
+        """Count the completed days in a range.
+
+        Args:
+            start_day (int): The first day of the range, inclusive. Defaults to the first day.
+            end_day (int): The last day of the range, inclusive. Defaults to the last day.
+
+        Returns:
+            int: The number of completed days.
+        """
+        if not self.bits:
+            return 0
+        start = 0 if start_day is None else max(start_day - self.first_day, 0)
+        end = self.bits.bit_length() if end_day is None else end_day - self.first_day + 1
+        if end <= start:
+            return 0
+        return bin(self.bits >> start & ((1 << (end - start)) - 1)).count("1")
+
+    def days(self):
+        """Return the completed day ordinals in ascending order."""
+        bits = self.bits
+        days = []
+        while bits:
+            lowest = bits & -bits
+            days.append(self.first_day + lowest.bit_length() - 1)
+            bits ^= lowest
+        return days
+
+    def _continuing(self, step):
+        """Return the bits of the days whose previous completed day is exactly ``step`` days earlier."""
+        between = 0
+        for distance in range(1, step):
+            between |= self.bits << distance
+        return self.bits & (self.bits << step) & ~between
+
+    def longest_streak(self, step=1):
+        """Calculate the longest run of consecutive completed days that are ``step`` days apart.
+
+        Each iteration keeps the days that extend a run kept by the previous one,
+        so the loop runs once per day of the longest streak.
+
+        Args:
+            step (int): The streak step in days, 1 for daily and 7 for weekly habits.
+
+        Returns:
+            int: The length of the longest streak.
+        """
+        continuing = self._continuing(step)
+        bits = self.bits
+        longest = 0
+        while bits:
+            bits = (bits << step) & continuing
+            longest += 1
+        return longest
+
+    def is_broken(self, step=1):
+        """Check whether the completed days contain more than one run.
+
+        Args:
+            step (int): The streak step in days.
+
+        Returns:
+            bool: True if there is a gap between two completed days.
+        """
+        return bin(self.bits & ~self._continuing(step)).count("1") > 1
+
+    def current_streak(self, today, step=1):
+        """Calculate the length of the run ending at the last completed day.
+
+        Args:
+            today (int): The day ordinal the streak is evaluated at.
+            step (int): The streak step in days.
+
+        Returns:
+            int: The length of the last run, 0 if more than one step has passed since.
+        """
+        last_day = self.last_day
+        if last_day is None or today - last_day > step:
+            return 0
+        continuing = self._continuing(step)
+        position = last_day - self.first_day
+        streak = 1
+        while continuing >> position & 1:
+            streak += 1
+            position -= step
+        return streak
+
+    def gaps(self, step=1):
+        """Find the places where the streak was broken.
+
+        Args:
+            step (int): The streak step in days.
+
+        Returns:
+            List[Tuple[int, int]]: For every break, the day ordinals of the completed
+            days before and after it.
+        """
+        starts = self.bits & ~self._continuing(step)
+        # the first run does not follow a gap
+        starts ^= starts & -starts
+        gaps = []
+        while starts:
+            lowest = starts & -starts
+            position = lowest.bit_length() - 1
+            previous = (self.bits & (lowest - 1)).bit_length() - 1
+            gaps.append((self.first_day + previous, self.first_day + position))
+            starts ^= lowest
+        return gaps
@@ -0,0 +1,135 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class AnalyticsCache:
+    """A bounded LRU cache of per-habit analytics results stamped with data versions.
+
+    Every habit of every database has a version number that is bumped whenever its
+    checkpoints change. A cached result is only returned while the version it was
+    computed at is still current, so a stale result is never served. Versions only
+    track writes made by this process, writes of other processes are seen through the
+    generation passed by the caller, a change counter kept by the database itself.
+    The cache can be shared between threads.
+
+    Versions are stamps of a counter that grows with every bump. Only the most recently
+    bumped ``max_versions`` habits keep their own stamp, the others share the highest
+    stamp forgotten so far, which is never older than the one they had.
+
+    Attributes:
+        maxsize (int): The maximum number of cached results.
+        max_versions (int): The maximum number of habits whose version is tracked.
+        hits (int): The number of lookups served from the cache.
+        misses (int): The number of lookups that had to be computed.
+    """
+
+    def __init__(self, maxsize=4096, max_versions=65536):
+        self.maxsize = maxsize
+        self.max_versions = max_versions
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._clock = 0
+        # the version of every habit whose own stamp was forgotten
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def version(self, bind, habit_id):
+        """Return the current data version of a habit.
+
+        Args:
+            bind (Engine): The database the habit is stored in.
+            habit_id (int): The ID of the habit.
+
+        Returns:
+            int: The version, 0 if the habit has never been changed.
+        """
+        return self._versions.get((bind, habit_id), self._floor)
+
+    def bump(self, bind, habit_ids):
+        """Invalidate the cached results of habits by bumping their versions.
+
+        Args:
+            bind (Engine): The database the habits are stored in.
+            habit_ids (Iterable[int]): The IDs of the changed habits.
+        """
+        with self._lock:
+            for habit_id in habit_ids:
+                key = (bind, habit_id)
+                self._clock += 1
+                self._versions[key] = self._clock
+                self._versions.move_to_end(key)
+            while len(self._versions) > self.max_versions:
+                self._floor = self._versions.popitem(last=False)[1]
+
+    def get_many(self, name, bind, habit_ids, compute, *args, uncached=(), generation=None):
+        """Look up the results of many habits and compute the missing ones in one call.
+
+        Args:
+            name (str): The name of the cached analytics function.
+            bind (Engine): The database the habits are stored in.
+            habit_ids (List[int]): The IDs of the habits.
+            compute (Callable): Called with the list of missing habit IDs, returns
+                a dictionary with their results.
+            *args: Further values the results depend on, part of the cache key.
+            uncached (Collection[int]): Habits that are computed without reading or storing
+                cached results, such as the habits changed by the uncommitted transaction
+                of the computing session.
+            generation (int): The change counter of the database, read before computing.
+                Results stored at another generation are recomputed.
+
+        Returns:
+            List: One result per habit ID, in the order of ``habit_ids``.
+        """
+        results = {}
+        missing = []
+        with self._lock:
+            for habit_id in habit_ids:
+                key = (name, bind, habit_id) + args
+                entry = self._entries.get(key) if habit_id not in uncached else None
+                if entry is not None and entry[0] == (generation, self.version(bind, habit_id)):
+                    self._entries.move_to_end(key)
+                    results[habit_id] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(habit_id)
+            self.misses += len(missing)
+            # the versions are read before computing, a concurrent bump makes the entry stale
+            versions = [(generation, self.version(bind, habit_id)) for habit_id in missing]
+        if missing:
+            computed = compute(missing)
+            with self._lock:
+                for habit_id, version in zip(missing, versions):
+                    results[habit_id] = computed[habit_id]
+                    if habit_id not in uncached:
+                        self._store((name, bind, habit_id) + args, version, computed[habit_id])
+        return [results[habit_id] for habit_id in habit_ids]
+
+    def _store(self, key, version, value):
+        """Store a result and evict the least recently used ones above maxsize. Needs the lock."""
+        self._entries[key] = (version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached results and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hit and miss counters and the size of the cache.
+
+        Returns:
+            CacheInfo: The cache statistics.
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
+
+
+# the cache shared by the analytics functions
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,150 @@
+import json
+import os
+import re
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import NullPool, QueuePool, SingletonThreadPool, StaticPool
+
+# pragma presets. "default" keeps the sqlite defaults, "durable" survives power loss
+# while letting readers run next to the writer, "fast-ingest" trades durability of the
+# last transactions on power loss for much cheaper commits
+PROFILES = {
+    "default": {},
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -16000,
+        "busy_timeout": 5000,
+    },
+    "fast-ingest": {
+        "journal_mode": "wal",
+        "synchronous": "off",
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+        "busy_timeout": 5000,
+    },
+}
+
+POOLS = {"null": NullPool, "queue": QueuePool, "singleton": SingletonThreadPool, "static": StaticPool}
+
+# the settings that are sent to sqlite as pragmas on every new connection
+PRAGMAS = ["journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout"]
+
+# environment variables overriding the settings of the config file
+ENVIRONMENT = {
+    "HABITS_DB_PATH": "path",
+    "HABITS_DB_PROFILE": "profile",
+    "HABITS_DB_JOURNAL_MODE": "journal_mode",
+    "HABITS_DB_SYNCHRONOUS": "synchronous",
+    "HABITS_DB_CACHE_SIZE": "cache_size",
+    "HABITS_DB_MMAP_SIZE": "mmap_size",
+    "HABITS_DB_POOL": "pool",
+    "HABITS_DB_POOL_SIZE": "pool_size",
+}
+
+
+class DatabaseConfig:
+    """The storage settings of the application database.
+
+    Attributes:
+        path (str): The sqlite file, ":memory:" for an in-memory database.
+        profile (str): The name of the pragma preset in PROFILES the settings start from.
+        pragmas (Dict[str, object]): The pragmas run on every new connection.
+        pool (str): The connection pool, one of the keys of POOLS. Defaults to the pool
+            SQLAlchemy picks for sqlite.
+        pool_size (int): The number of pooled connections of the "queue" pool.
+        max_overflow (int): The connections the "queue" pool may open beyond pool_size.
+    """
+
+    def __init__(self, path=None, profile="default", pool=None, pool_size=5, max_overflow=10, **pragmas):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile '{profile}', expected one of {', '.join(PROFILES)}")
+        unknown = set(pragmas) - set(PRAGMAS)
+        if unknown:
+            raise ValueError(f"Unknown setting(s): {', '.join(sorted(unknown))}")
+        for name, value in pragmas.items():
+            # the values end up in PRAGMA statements, only allow numbers and keywords
+            if value is not None and not re.fullmatch(r"-?\w+", str(value)):
+                raise ValueError(f"Invalid value for {name}: {value!r}")
+        if pool is not None and pool not in POOLS:
+            raise ValueError(f"Unknown pool '{pool}', expected one of {', '.join(POOLS)}")
+        self.path = path or os.path.join(os.getcwd(), "habits.db")
+        self.profile = profile
+        self.pragmas = dict(PROFILES[profile])
+        self.pragmas.update({name: value for name, value in pragmas.items() if value is not None})
+        self.pool = pool
+        self.pool_size = int(pool_size)
+        self.max_overflow = int(max_overflow)
+
+    @property
+    def url(self):
+        """str: The SQLAlchemy URL of the database."""
+        if self.path == ":memory:":
+            return "sqlite://"
+        return f"sqlite:///{self.path}"
+
+    def __repr__(self):
+        return f"DatabaseConfig(path={self.path!r}, profile={self.profile!r}, pragmas={self.pragmas!r})"
+
+
+def load_config(path=None, environ=None):
+    """Read the database settings from a JSON config file and environment variables.
+
+    The config file is taken from ``path``, the HABITS_DB_CONFIG environment variable or
+    habits.json in the current directory, in that order, and is optional. Environment
+    variables listed in ENVIRONMENT override its settings.
+
+    Args:
+        path (str): The JSON config file.
+        environ (Mapping[str, str]): The environment, defaults to os.environ.
+
+    Returns:
+        DatabaseConfig: The settings.
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get("HABITS_DB_CONFIG") or os.path.join(os.getcwd(), "habits.json")
+    settings = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            settings.update(json.load(file))
+    for variable, name in ENVIRONMENT.items():
+        if environ.get(variable):
+            settings[name] = environ[variable]
+    return DatabaseConfig(**settings)
+
+
+def _apply_pragmas(pragmas):
+    """Return a connect event listener that runs the pragmas on a new sqlite connection.
+
+    Foreign keys are always enforced, deleting a habit cascades to its rows in other tables.
+    """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        for name in PRAGMAS:
+            if name in pragmas:
+                cursor.execute(f"PRAGMA {name} = {pragmas[name]}")
+        cursor.close()
+    return on_connect
+
+
+def create_configured_engine(config):
+    """Create an engine that applies the settings of a config.
+
+    Args:
+        config (DatabaseConfig): The settings.
+
+    Returns:
+        Engine: The engine, every connection it opens runs the configured pragmas.
+    """
+    options = {}
+    if config.pool is not None:
+        options["poolclass"] = POOLS[config.pool]
+        if config.pool == "queue":
+            options.update(pool_size=config.pool_size, max_overflow=config.max_overflow)
+        if config.pool != "null":
+            # pooled connections are handed to other threads
+            options["connect_args"] = {"check_same_thread": False}
+    engine = create_engine(config.url, **options)
+    event.listen(engine, "connect", _apply_pragmas(config.pragmas))
+    return engine
@@ -1,19 +1,933 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-import os
-from habit import Base
+from sqlalchemy import event, select, and_, tuple_, literal, inspect, func
+from sqlalchemy.orm import sessionmaker, scoped_session, subqueryload, Session as OrmSession
+from config import load_config, create_configured_engine
+from habit import Base, Habit, Checkpoint, HabitRecord, HabitStats, HabitBitmap, StreakSegment, ArchivedCheckpoint, \
+    DEFAULT_OWNER, CHANGE_COUNTER_DDL, seconds_of_day
+from bitmap import CompletionBitmap
+from analytics import JULIAN_DAY_ORDINAL_OFFSET, FREQUENCY_STEPS, MAX_FILTER_IDS, compute_streaks, \
+    compute_runs_from_arrays
+from cache import analytics_cache
 
-# Get the current directory
-current_directory = os.getcwd()
 
-# Construct the file path for the database
-database_file = "habits.db"
-database_path = os.path.join(current_directory, database_file)
+def _add_checkpoint_unique_index(connection):
+    """Remove duplicate checkpoints and add the unique (habit_id, checkpoint_date) index."""
+    connection.execute("DELETE FROM checkpoints WHERE id NOT IN "
+                       "(SELECT MIN(id) FROM checkpoints GROUP BY habit_id, checkpoint_date)")
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_checkpoints_habit_id_checkpoint_date "
+                       "ON checkpoints (habit_id, checkpoint_date)")
 
-# create the engine: sqlite
-engine = create_engine(f"sqlite:///{database_path}")
-Base.metadata.create_all(engine)
 
-# connect to the database to execute sql statements
-Session = sessionmaker(bind=engine)
-session = Session()
+def _build_habit_stats(connection):
+    """Fill the habit_stats table from the existing checkpoints."""
+    # the rebuild reads the day column, which older databases get in a later step
+    _add_checkpoint_days(connection)
+    rebuild_habit_stats(connection)
+
+
+def _build_habit_bitmaps(connection):
+    """Fill the habit_bitmaps table from the existing checkpoints."""
+    _add_checkpoint_days(connection)
+    rebuild_habit_bitmaps(connection)
+
+
+def _add_habit_owner(connection):
+    """Add the owner column and its index, existing habits belong to the default owner."""
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(habits)")]
+    if "owner" not in columns:
+        connection.execute(f"ALTER TABLE habits ADD COLUMN owner VARCHAR NOT NULL DEFAULT '{DEFAULT_OWNER}'")
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_habits_owner ON habits (owner)")
+
+
+# the checkpoint columns derived in SQL from the stored checkpoint_date text
+CHECKPOINT_DAY_SQL = f"CAST(julianday(date(checkpoint_date)) AS INTEGER) - {JULIAN_DAY_ORDINAL_OFFSET}"
+CHECKPOINT_TIME_OF_DAY_SQL = "CAST(strftime('%s', checkpoint_date) AS INTEGER) % 86400"
+
+
+def add_checkpoint_day_columns(connection):
+    """Add the day and time_of_day columns to a checkpoints table that does not have them yet.
+
+    Args:
+        connection (Connection): The connection of the database.
+
+    Returns:
+        bool: True if columns were added.
+    """
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(checkpoints)")]
+    missing = [column for column in ("day", "time_of_day") if column not in columns]
+    for column in missing:
+        connection.execute(f"ALTER TABLE checkpoints ADD COLUMN {column} INTEGER")
+    return bool(missing)
+
+
+def backfill_checkpoint_days(connection, first_id, batch_size):
+    """Fill the day and time_of_day columns of a range of checkpoints that have no day yet.
+
+    The range is selected by primary key, so every batch costs the same regardless of
+    how much of the table is already filled.
+
+    Args:
+        connection (Connection): The connection of the database.
+        first_id (int): The lowest checkpoint ID of the batch.
+        batch_size (int): The number of IDs in the batch.
+
+    Returns:
+        int: The number of updated checkpoints.
+    """
+    return connection.execute(
+        f"UPDATE checkpoints SET day = {CHECKPOINT_DAY_SQL}, time_of_day = {CHECKPOINT_TIME_OF_DAY_SQL} "
+        "WHERE id >= ? AND id < ? AND day IS NULL AND checkpoint_date IS NOT NULL",
+        first_id, first_id + batch_size).rowcount
+
+
+def fill_checkpoint_days(engine, batch_size=50000, progress=None):
+    """Add the integer day columns of the checkpoints and fill them in one transaction per batch.
+
+    A large database is never locked for long and an interrupted run continues where it
+    stopped, as only checkpoints without a day are updated.
+
+    Args:
+        engine (Engine): The engine of the database.
+        batch_size (int): The number of checkpoint IDs per transaction.
+        progress (Callable): Called with the number of filled rows after every batch.
+
+    Returns:
+        int: The number of filled rows.
+    """
+    with engine.begin() as connection:
+        if not engine.dialect.has_table(connection, "checkpoints"):
+            return 0
+        add_checkpoint_day_columns(connection)
+        first_id, last_id = connection.execute("SELECT MIN(id), MAX(id) FROM checkpoints WHERE day IS NULL").fetchone()
+    filled = 0
+    if first_id is not None:
+        for start in range(first_id, last_id + 1, batch_size):
+            with engine.begin() as connection:
+                filled += backfill_checkpoint_days(connection, start, batch_size)
+            if progress is not None:
+                progress(filled)
+    return filled
+
+
+def _add_checkpoint_days(connection, batch_size=50000):
+    """Add, fill and index the integer day columns of the checkpoints.
+
+    migrate_schema fills the columns in batches with fill_checkpoint_days first, this step
+    only fills what was written in between.
+    """
+    add_checkpoint_day_columns(connection)
+    first_id, last_id = connection.execute("SELECT MIN(id), MAX(id) FROM checkpoints WHERE day IS NULL").fetchone()
+    if first_id is not None:
+        for start in range(first_id, last_id + 1, batch_size):
+            backfill_checkpoint_days(connection, start, batch_size)
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_checkpoints_habit_id_day ON checkpoints (habit_id, day)")
+
+
+def _add_checkpoint_day_index(connection):
+    """Index the checkpoints by day first, so date ranges over all habits are range scans."""
+    connection.execute("CREATE INDEX IF NOT EXISTS ix_checkpoints_day_habit_id ON checkpoints (day, habit_id)")
+
+
+# the tables with rows per habit, removed by ON DELETE CASCADE together with the habit
+HABIT_CHILD_TABLES = [Checkpoint.__table__, HabitStats.__table__, HabitBitmap.__table__, StreakSegment.__table__,
+                      ArchivedCheckpoint.__table__]
+
+
+def _rebuild_table(connection, table):
+    """Recreate a table from its model and copy its rows into it.
+
+    sqlite cannot change the foreign keys of an existing table, so the rows are copied
+    into a new table and the old one is dropped. Rows of habits that no longer exist can
+    only be copied where foreign keys are not enforced, elsewhere they are dropped.
+    """
+    old = f"{table.name}_old"
+    connection.execute(f"ALTER TABLE {table.name} RENAME TO {old}")
+    for name, in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", old).fetchall():
+        connection.execute(f"DROP INDEX {name}")
+    table.create(connection)
+    old_columns = {row[1] for row in connection.execute(f"PRAGMA table_info({old})")}
+    columns = ", ".join(column.name for column in table.columns if column.name in old_columns)
+    condition = ""
+    if foreign_keys_enabled(connection):
+        condition = " WHERE habit_id IS NULL OR habit_id IN (SELECT id FROM habits)"
+    # checkpoints less than a second apart collapse into one under the unique index of the model
+    connection.execute(f"INSERT OR IGNORE INTO {table.name} ({columns}) SELECT {columns} FROM {old}{condition}")
+    connection.execute(f"DROP TABLE {old}")
+
+
+def _add_foreign_key_cascades(connection):
+    """Recreate the tables referencing habits whose foreign key does not cascade deletes yet."""
+    for table in HABIT_CHILD_TABLES:
+        keys = connection.execute(f"PRAGMA foreign_key_list({table.name})").fetchall()
+        # the columns are id, seq, table, from, to, on_update, on_delete and match
+        if not any(key[2] == "habits" and key[6] == "CASCADE" for key in keys):
+            _rebuild_table(connection, table)
+
+
+def _build_streak_segments(connection):
+    """Fill the streak_segments table from the existing checkpoints."""
+    rebuild_streak_segments(connection)
+
+
+def _add_checkpoint_time_index(connection):
+    """Make the checkpoints unique on their integer day and time instead of the checkpoint_date text."""
+    connection.execute("DELETE FROM checkpoints WHERE id NOT IN "
+                       "(SELECT MIN(id) FROM checkpoints GROUP BY habit_id, day, coalesce(time_of_day, 0))")
+    connection.execute("DROP INDEX IF EXISTS ix_checkpoints_habit_id_checkpoint_date")
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_checkpoints_habit_id_day_time "
+                       "ON checkpoints (habit_id, day, coalesce(time_of_day, 0))")
+
+
+def _add_change_counter(connection):
+    """Count the changes of the habit statistics of an existing database with triggers."""
+    for statement in CHANGE_COUNTER_DDL:
+        connection.execute(statement)
+
+
+# schema changes for databases created by older versions, applied in order.
+# the number of applied steps is stored in the user_version pragma of the database
+MIGRATIONS = [_add_checkpoint_unique_index, _build_habit_stats, _build_habit_bitmaps, _add_habit_owner,
+              _add_checkpoint_days, _add_checkpoint_day_index, _add_foreign_key_cascades, _build_streak_segments,
+              _add_checkpoint_time_index, _add_change_counter]
+
+
+def migrate_schema(engine):
+    """Create missing tables and apply the pending migrations to the database.
+
+    Every migration step must also work on a database freshly created from the models.
+
+    Args:
+        engine (Engine): The engine of the database to migrate.
+    """
+    Base.metadata.create_all(engine)
+    if engine.execute("PRAGMA user_version").scalar() < len(MIGRATIONS):
+        # the backfill of the day columns commits per batch, before the steps run in one transaction
+        fill_checkpoint_days(engine)
+    with engine.begin() as connection:
+        version = connection.execute("PRAGMA user_version").scalar()
+        for step in MIGRATIONS[version:]:
+            step(connection)
+        if version < len(MIGRATIONS):
+            connection.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+
+def insert_checkpoint(session, habit_id, checkpoint_date):
+    """Insert a checkpoint unless the habit already has one for that date.
+
+    The duplicate check is done by the unique index in a single INSERT OR IGNORE statement.
+    The caller is responsible for committing the session.
+
+    Args:
+        session (Session): The session used to insert the checkpoint.
+        habit_id (int): The ID of the habit.
+        checkpoint_date (datetime): The date of the checkpoint.
+
+    Returns:
+        bool: True if the checkpoint was inserted, False if it already existed.
+    """
+    statement = Checkpoint.__table__.insert().prefix_with("OR IGNORE")
+    result = session.execute(statement, {"habit_id": habit_id, "checkpoint_date": checkpoint_date})
+    if result.rowcount != 1:
+        return False
+    _touch_habits(session, [habit_id])
+    _add_streak_segment(session, habit_id, checkpoint_date.toordinal())
+    _append_habit_stats(session, habit_id, checkpoint_date.toordinal())
+    _append_habit_bitmap(session, habit_id, checkpoint_date.toordinal())
+    return True
+
+
+def delete_checkpoint(session, habit_id, checkpoint_date):
+    """Delete the checkpoint of a habit at a date and update the derived tables in place.
+
+    When no other checkpoint is left on that day the streak segment holding the day is
+    split, and the statistics are recomputed from the segments of the habit, without
+    reading its checkpoints. The caller is responsible for committing the session.
+
+    Args:
+        session (Session): The session used to delete the checkpoint.
+        habit_id (int): The ID of the habit.
+        checkpoint_date (datetime): The date of the checkpoint, as it was stored.
+
+    Returns:
+        bool: True if the checkpoint was deleted, False if it did not exist.
+    """
+    table = Checkpoint.__table__
+    day = checkpoint_date.toordinal()
+    # the columns of the unique index, a plain date is stored with the time of midnight
+    deleted = session.execute(table.delete().where(
+        and_(table.c.habit_id == habit_id, table.c.day == day,
+             func.coalesce(table.c.time_of_day, 0) == (seconds_of_day(checkpoint_date) or 0)))).rowcount
+    if not deleted:
+        return False
+    _touch_habits(session, [habit_id])
+    if session.execute(select([table.c.id]).where(and_(table.c.habit_id == habit_id, table.c.day == day))
+                       .limit(1)).first() is None:
+        _remove_streak_segment(session, habit_id, day)
+        _refresh_habit_stats(session, habit_id)
+        _discard_habit_bitmap(session, habit_id, day)
+    return True
+
+
+def insert_checkpoints(session, rows, chunk_size=1000):
+    """Insert many checkpoints with one executemany per chunk, ignoring duplicates.
+
+    All chunks run inside the transaction of the session, so the rows are written with a
+    single commit. The caller is responsible for committing the session.
+
+    Args:
+        session (Session): The session used to insert the checkpoints.
+        rows (Iterable[Tuple[int, datetime]]): The habit ID and date of every checkpoint.
+            Consumed lazily, at most ``chunk_size`` rows are held in memory.
+        chunk_size (int): The number of rows sent per executemany.
+
+    Returns:
+        Tuple[int, int]: The number of rows read and the number of rows inserted.
+
+    The statistics and bitmaps of the touched habits are rebuilt once at the end.
+    """
+    statement = Checkpoint.__table__.insert().prefix_with("OR IGNORE")
+    total = inserted = 0
+    habit_ids = set()
+    chunk = []
+    rows = iter(rows)
+    while True:
+        chunk.clear()
+        for habit_id, checkpoint_date in rows:
+            chunk.append({"habit_id": habit_id, "checkpoint_date": checkpoint_date})
+            habit_ids.add(habit_id)
+            if len(chunk) == chunk_size:
+                break
+        if not chunk:
+            break
+        total += len(chunk)
+        inserted += session.execute(statement, chunk).rowcount
+    if inserted:
+        _touch_habits(session, habit_ids)
+        rebuild_derived_tables(session, habit_ids)
+    return total, inserted
+
+
+def foreign_keys_enabled(connection):
+    """Return whether sqlite enforces foreign keys, and so cascades deletes, on a connection."""
+    return bool(connection.execute("PRAGMA foreign_keys").scalar())
+
+
+def _delete_habit_children(connection, habit_ids):
+    """Delete the rows of habits from the child tables, for connections without foreign keys."""
+    for table in HABIT_CHILD_TABLES:
+        connection.execute(table.delete().where(table.c.habit_id.in_(habit_ids)))
+
+
+def delete_habits(session, habit_ids, chunk_size=MAX_FILTER_IDS):
+    """Delete many habits and everything that belongs to them without loading any of it.
+
+    The habits are deleted with one DELETE per chunk of IDs, their checkpoints, statistics,
+    bitmaps and archived checkpoints are removed by ON DELETE CASCADE. On connections that
+    do not enforce foreign keys the child rows are deleted explicitly instead.
+    The caller is responsible for committing the session.
+
+    Args:
+        session (Session): The session used to delete the habits.
+        habit_ids (Iterable[int]): The IDs of the habits, unknown IDs are ignored.
+        chunk_size (int): The number of IDs per DELETE statement.
+
+    Returns:
+        int: The number of deleted habits.
+    """
+    habit_ids = sorted(set(habit_ids))
+    table = Habit.__table__
+    cascade = foreign_keys_enabled(session)
+    deleted = 0
+    for start in range(0, len(habit_ids), chunk_size):
+        chunk = habit_ids[start:start + chunk_size]
+        if not cascade:
+            _delete_habit_children(session, chunk)
+        deleted += session.execute(table.delete().where(table.c.id.in_(chunk))).rowcount
+    if deleted:
+        _touch_habits(session, habit_ids)
+    return deleted
+
+
+def load_habits(session, frequency=None, owner=None):
+    """Load habits together with all their checkpoints in two queries.
+
+    Accessing ``habit.checkpoints`` on the returned habits does not hit the database again.
+
+    Args:
+        session (Session): The session used to load the habits.
+        frequency (Frequency): Only load habits with this frequency, if given.
+        owner (str): Only load the habits of this owner, if given.
+
+    Returns:
+        List[Habit]: The habits ordered by their IDs.
+    """
+    query = session.query(Habit).options(subqueryload(Habit.checkpoints)).order_by(Habit.id)
+    if frequency is not None:
+        query = query.filter_by(frequency=frequency)
+    if owner is not None:
+        query = query.filter_by(owner=owner)
+    return query.all()
+
+
+# the default number of rows of a listing page
+PAGE_SIZE = 100
+
+
+def page_habits(session, after_id=None, limit=PAGE_SIZE, frequency=None, owner=None):
+    """Load one page of habits ordered by ID, continuing after the last habit of the previous page.
+
+    The page is found through the primary key, so its cost does not grow with the number
+    of habits before it.
+
+    Args:
+        session (Session): The session used to run the query.
+        after_id (int): The cursor returned with the previous page, None for the first page.
+        limit (int): The number of habits per page.
+        frequency (Frequency): Only list habits with this frequency, if given.
+        owner (str): Only list the habits of this owner, if given.
+
+    Returns:
+        Tuple[List[Tuple[int, str, Frequency]], int]: The ID, task and frequency of every habit
+        of the page, and the cursor of the next page, None after the last page.
+    """
+    table = Habit.__table__
+    query = select([table.c.id, table.c.task, table.c.frequency]).order_by(table.c.id).limit(limit + 1)
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+    if frequency is not None:
+        query = query.where(table.c.frequency == frequency)
+    if owner is not None:
+        query = query.where(table.c.owner == owner)
+    rows = session.execute(query).fetchall()
+    return rows[:limit], rows[limit - 1].id if len(rows) > limit else None
+
+
+def page_checkpoints(session, after=None, limit=PAGE_SIZE, habit_ids=None, frequency=None, start_date=None,
+                     end_date=None, owner=None):
+    """Load one page of checkpoints ordered by habit and date, continuing after the previous page.
+
+    The page is a range scan over the unique (habit_id, day, time) index starting at the cursor.
+
+    Args:
+        session (Session): The session used to run the query.
+        after (Tuple[int, datetime]): The cursor returned with the previous page, None for the first page.
+        limit (int): The number of checkpoints per page.
+        habit_ids (Collection[int]): Only list the checkpoints of these habits, if given.
+        frequency (Frequency): Only list the checkpoints of habits with this frequency, if given.
+        start_date (date or datetime): Only list checkpoints on or after this day, if given.
+        end_date (date or datetime): Only list checkpoints on or before this day, if given.
+        owner (str): Only list the checkpoints of habits of this owner, if given.
+
+    Returns:
+        Tuple[List[Tuple[int, str, Frequency, datetime]], Tuple[int, datetime]]: The habit ID, task,
+        frequency and date of every checkpoint of the page, and the cursor of the next page,
+        None after the last page.
+    """
+    checkpoints = Checkpoint.__table__
+    habits = Habit.__table__
+    time_of_day = func.coalesce(checkpoints.c.time_of_day, 0)
+    query = select([checkpoints.c.habit_id, habits.c.task, habits.c.frequency, checkpoints.c.checkpoint_date]) \
+        .select_from(checkpoints.join(habits, habits.c.id == checkpoints.c.habit_id)) \
+        .order_by(checkpoints.c.habit_id, checkpoints.c.day, time_of_day).limit(limit + 1)
+    if after is not None:
+        habit_id, checkpoint_date = after
+        query = query.where(tuple_(checkpoints.c.habit_id, checkpoints.c.day, time_of_day)
+                            > tuple_(literal(habit_id), literal(checkpoint_date.toordinal()),
+                                     literal(seconds_of_day(checkpoint_date) or 0)))
+    if habit_ids is not None:
+        query = query.where(checkpoints.c.habit_id.in_(habit_ids))
+    if frequency is not None:
+        query = query.where(habits.c.frequency == frequency)
+    if start_date is not None:
+        query = query.where(checkpoints.c.day >= start_date.toordinal())
+    if end_date is not None:
+        query = query.where(checkpoints.c.day <= end_date.toordinal())
+    if owner is not None:
+        query = query.where(habits.c.owner == owner)
+    rows = session.execute(query).fetchall()
+    last = rows[limit - 1] if len(rows) > limit else None
+    return rows[:limit], (last.habit_id, last.checkpoint_date) if last is not None else None
+
+
+def load_habit_records(session, frequency=None, habit_ids=None, owner=None):
+    """Load habits and their checkpoint days as lightweight records in two queries.
+
+    The day ordinals are read from the integer day column, no Habit, Checkpoint or datetime objects are built.
+
+    Args:
+        session (Session): The session used to load the habits.
+        frequency (Frequency): Only load habits with this frequency, if given.
+        habit_ids (Collection[int]): Only load the habits with these IDs, if given.
+        owner (str): Only load the habits of this owner, if given.
+
+    Returns:
+        List[HabitRecord]: The habit records ordered by their IDs.
+    """
+    habits = Habit.__table__
+    checkpoints = Checkpoint.__table__
+    habit_query = select([habits.c.id, habits.c.task, habits.c.frequency]).order_by(habits.c.id)
+    day = checkpoints.c.day
+    day_query = select([checkpoints.c.habit_id, day]).order_by(checkpoints.c.habit_id, day)
+    if frequency is not None or owner is not None:
+        day_query = day_query.select_from(checkpoints.join(habits))
+    if frequency is not None:
+        habit_query = habit_query.where(habits.c.frequency == frequency)
+        day_query = day_query.where(habits.c.frequency == frequency)
+    if owner is not None:
+        habit_query = habit_query.where(habits.c.owner == owner)
+        day_query = day_query.where(habits.c.owner == owner)
+    if habit_ids is not None:
+        habit_query = habit_query.where(habits.c.id.in_(habit_ids))
+        day_query = day_query.where(checkpoints.c.habit_id.in_(habit_ids))
+
+    records = {habit_id: HabitRecord(habit_id, task, habit_frequency)
+               for habit_id, task, habit_frequency in session.execute(habit_query)}
+    for habit_id, checkpoint_day in session.execute(day_query):
+        record = records.get(habit_id)
+        if record is not None:
+            record.days.append(checkpoint_day)
+    return list(records.values())
+
+
+def _replace_habit_rows(session, table, habit_ids, rows):
+    """Replace the rows of habits in a table keyed by habit_id.
+
+    Args:
+        session (Session or Connection): The session or connection used to write the rows.
+        table (Table): The table to write.
+        habit_ids (Collection[int]): The habits whose rows are replaced, all rows if None.
+        rows (List[dict]): The new rows.
+    """
+    if habit_ids is None:
+        session.execute(table.delete())
+    elif habit_ids:
+        session.execute(table.delete().where(table.c.habit_id.in_(habit_ids)))
+    if rows:
+        session.execute(table.insert(), rows)
+
+
+def _records_to_rebuild(session, habit_ids, records):
+    """Return the habit IDs to rebuild and their records, loading the records if needed."""
+    if habit_ids is not None and len(habit_ids) > MAX_FILTER_IDS:
+        habit_ids = None
+    if records is None:
+        records = load_habit_records(session, habit_ids=habit_ids)
+    return habit_ids, records
+
+
+def rebuild_habit_stats(session, habit_ids=None, records=None):
+    """Recompute the statistics rows of habits from their checkpoints.
+
+    Rows of habits that no longer exist are removed.
+
+    Args:
+        session (Session or Connection): The session or connection used to write the rows.
+        habit_ids (Collection[int]): The habits to rebuild, all habits if not given.
+        records (List[HabitRecord]): The records of these habits, loaded if not given.
+    """
+    habit_ids, records = _records_to_rebuild(session, habit_ids, records)
+    # with today before any checkpoint the last run of every habit counts as current
+    stats = compute_streaks(records, today=0)
+    _replace_habit_rows(session, HabitStats.__table__, habit_ids, [
+        {"habit_id": record.id, "longest_streak": habit_stats.longest, "last_run": habit_stats.current,
+         "last_day": habit_stats.last_day, "broken": habit_stats.broken}
+        for record, habit_stats in zip(records, stats)
+    ])
+
+
+def rebuild_habit_bitmaps(session, habit_ids=None, records=None):
+    """Recompute the completion bitmaps of habits from their checkpoints.
+
+    Rows of habits that no longer exist are removed.
+
+    Args:
+        session (Session or Connection): The session or connection used to write the rows.
+        habit_ids (Collection[int]): The habits to rebuild, all habits if not given.
+        records (List[HabitRecord]): The records of these habits, loaded if not given.
+    """
+    habit_ids, records = _records_to_rebuild(session, habit_ids, records)
+    rows = []
+    for record in records:
+        bitmap = CompletionBitmap.from_days(record.days)
+        rows.append({"habit_id": record.id, "first_day": bitmap.first_day, "bits": bitmap.to_bytes()})
+    _replace_habit_rows(session, HabitBitmap.__table__, habit_ids, rows)
+
+
+def segments_from_records(records):
+    """Split the checkpoints of habits into streak segments.
+
+    Args:
+        records (List[HabitRecord]): The habits and their checkpoint days.
+
+    Returns:
+        Dict[int, List[Tuple[int, int]]]: The first and last day of every run by habit ID,
+        ordered by day. Every habit is present, habits without runs with an empty list.
+    """
+    import numpy as np
+    day_arrays = [np.asarray(record.days, dtype=np.int64) for record in records]
+    owners = np.repeat(np.arange(len(records), dtype=np.int64), [len(days) for days in day_arrays])
+    days = np.concatenate(day_arrays) if day_arrays else np.empty(0, dtype=np.int64)
+    steps = [FREQUENCY_STEPS.get(record.frequency, 0) for record in records]
+    segments = {record.id: [] for record in records}
+    for owner, start_day, end_day in zip(*(array.tolist() for array in compute_runs_from_arrays(owners, days, steps))):
+        segments[records[owner].id].append((start_day, end_day))
+    return segments
+
+
+def rebuild_streak_segments(session, habit_ids=None, records=None):
+    """Recompute the streak segments of habits from their checkpoints.
+
+    Rows of habits that no longer exist are removed.
+
+    Args:
+        session (Session or Connection): The session or connection used to write the rows.
+        habit_ids (Collection[int]): The habits to rebuild, all habits if not given.
+        records (List[HabitRecord]): The records of these habits, loaded if not given.
+    """
+    habit_ids, records = _records_to_rebuild(session, habit_ids, records)
+    _replace_habit_rows(session, StreakSegment.__table__, habit_ids, [
+        {"habit_id": habit_id, "start_day": start_day, "end_day": end_day}
+        for habit_id, segments in segments_from_records(records).items() for start_day, end_day in segments
+    ])
+
+
+def rebuild_derived_tables(session, habit_ids=None):
+    """Recompute the statistics, bitmaps and streak segments of habits, loading their checkpoints once.
+
+    Args:
+        session (Session or Connection): The session or connection used to write the rows.
+        habit_ids (Collection[int]): The habits to rebuild, all habits if not given.
+    """
+    habit_ids, records = _records_to_rebuild(session, habit_ids, None)
+    rebuild_habit_stats(session, habit_ids, records)
+    rebuild_habit_bitmaps(session, habit_ids, records)
+    rebuild_streak_segments(session, habit_ids, records)
+
+
+def load_streak_segments(session, habit_ids=None):
+    """Load the streak segments of habits.
+
+    Args:
+        session (Session or Connection): The session or connection used to read the rows.
+        habit_ids (Collection[int]): Only load these habits, all habits if not given.
+
+    Returns:
+        Dict[int, List[Tuple[int, int]]]: The first and last day of every run by habit ID,
+        ordered by day. Habits without segments are missing.
+    """
+    table = StreakSegment.__table__
+    query = select([table.c.habit_id, table.c.start_day, table.c.end_day]) \
+        .order_by(table.c.habit_id, table.c.start_day)
+    if habit_ids is not None:
+        query = query.where(table.c.habit_id.in_(habit_ids))
+    segments = {}
+    for habit_id, start_day, end_day in session.execute(query):
+        segments.setdefault(habit_id, []).append((start_day, end_day))
+    return segments
+
+
+def check_streak_segments(session, habit_ids=None, repair=False):
+    """Compare the stored streak segments with segments rebuilt from the checkpoints.
+
+    Args:
+        session (Session or Connection): The session or connection used to read the rows.
+        habit_ids (Collection[int]): Only check these habits, all habits if not given.
+        repair (bool): Whether to rebuild the segments of the habits that differ.
+
+    Returns:
+        Dict[int, Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]]: The expected and the
+        stored segments of every habit that differs, empty if everything is consistent.
+    """
+    expected = segments_from_records(load_habit_records(session, habit_ids=habit_ids))
+    stored = load_streak_segments(session, habit_ids)
+    differences = {}
+    for habit_id in sorted(set(expected) | set(stored)):
+        if expected.get(habit_id, []) != stored.get(habit_id, []):
+            differences[habit_id] = (expected.get(habit_id, []), stored.get(habit_id, []))
+    if repair and differences:
+        rebuild_streak_segments(session, list(differences))
+    return differences
+
+
+def load_bitmaps(session, habit_ids=None):
+    """Load the completion bitmaps of habits.
+
+    Args:
+        session (Session): The session used to load the bitmaps.
+        habit_ids (Collection[int]): Only load these habits, all habits if not given.
+
+    Returns:
+        Dict[int, CompletionBitmap]: The bitmaps keyed by habit ID.
+    """
+    table = HabitBitmap.__table__
+    query = select([table.c.habit_id, table.c.first_day, table.c.bits])
+    if habit_ids is not None:
+        query = query.where(table.c.habit_id.in_(habit_ids))
+    return {habit_id: CompletionBitmap.from_bytes(first_day, bits)
+            for habit_id, first_day, bits in session.execute(query)}
+
+
+def _append_habit_bitmap(session, habit_id, day):
+    """Mark a day as completed in the stored bitmap of a habit.
+
+    Args:
+        session (Session): The session used to update the row.
+        habit_id (int): The habit that got a new checkpoint.
+        day (int): The day ordinal of the new checkpoint.
+    """
+    bitmap = load_bitmaps(session, [habit_id]).get(habit_id)
+    if bitmap is None:
+        rebuild_habit_bitmaps(session, [habit_id])
+        return
+    bitmap.add(day)
+    table = HabitBitmap.__table__
+    session.execute(table.update().where(table.c.habit_id == habit_id)
+                    .values(first_day=bitmap.first_day, bits=bitmap.to_bytes()))
+
+
+def _habit_step(session, habit_id):
+    """Return the streak step in days of a habit, 0 for unknown habits and frequencies."""
+    habits = Habit.__table__
+    return FREQUENCY_STEPS.get(session.execute(select([habits.c.frequency]).where(habits.c.id == habit_id)).scalar(), 0)
+
+
+def _neighbor_segment(session, habit_id, day, before):
+    """Return the last segment of a habit starting on or before a day, or the first one starting after it."""
+    table = StreakSegment.__table__
+    query = select([table.c.start_day, table.c.end_day]).where(table.c.habit_id == habit_id)
+    if before:
+        query = query.where(table.c.start_day <= day).order_by(table.c.start_day.desc())
+    else:
+        query = query.where(table.c.start_day > day).order_by(table.c.start_day)
+    return session.execute(query.limit(1)).first()
+
+
+def _segment_key(habit_id, start_day):
+    table = StreakSegment.__table__
+    return and_(table.c.habit_id == habit_id, table.c.start_day == start_day)
+
+
+def _add_streak_segment(session, habit_id, day):
+    """Add a completed day to the streak segments of a habit, merging it with the runs next to it.
+
+    Args:
+        session (Session): The session used to update the rows.
+        habit_id (int): The habit that got a new checkpoint.
+        day (int): The day ordinal of the new checkpoint.
+    """
+    step = _habit_step(session, habit_id)
+    if not step:
+        return
+    table = StreakSegment.__table__
+    before = _neighbor_segment(session, habit_id, day, before=True)
+    if before is not None and day <= before.end_day:
+        if (day - before.start_day) % step == 0:
+            return
+        # a day between two days of a weekly run ends the run before it and starts another after it
+        left_end = before.start_day + (day - before.start_day) // step * step
+        session.execute(table.update().where(_segment_key(habit_id, before.start_day)).values(end_day=left_end))
+        session.execute(table.insert(), [{"habit_id": habit_id, "start_day": day, "end_day": day},
+                                         {"habit_id": habit_id, "start_day": left_end + step,
+                                          "end_day": before.end_day}])
+        return
+    after = _neighbor_segment(session, habit_id, day, before=False)
+    end_day = day
+    if after is not None and after.start_day - day == step:
+        session.execute(table.delete().where(_segment_key(habit_id, after.start_day)))
+        end_day = after.end_day
+    if before is not None and day - before.end_day == step:
+        session.execute(table.update().where(_segment_key(habit_id, before.start_day)).values(end_day=end_day))
+    else:
+        session.execute(table.insert(), {"habit_id": habit_id, "start_day": day, "end_day": end_day})
+
+
+def _remove_streak_segment(session, habit_id, day):
+    """Remove a day from the streak segments of a habit, splitting the run that held it.
+
+    Args:
+        session (Session): The session used to update the rows.
+        habit_id (int): The habit that lost its last checkpoint on the day.
+        day (int): The day ordinal.
+    """
+    step = _habit_step(session, habit_id)
+    segment = _neighbor_segment(session, habit_id, day, before=True)
+    if not step or segment is None or day > segment.end_day or (day - segment.start_day) % step:
+        return
+    table = StreakSegment.__table__
+    session.execute(table.delete().where(_segment_key(habit_id, segment.start_day)))
+    rows = []
+    if day > segment.start_day:
+        rows.append({"habit_id": habit_id, "start_day": segment.start_day, "end_day": day - step})
+    if day < segment.end_day:
+        rows.append({"habit_id": habit_id, "start_day": day + step, "end_day": segment.end_day})
+    if rows:
+        session.execute(table.insert(), rows)
+        return
+    # a run of one day is gone, the runs around it may now be one step apart
+    before = _neighbor_segment(session, habit_id, day, before=True)
+    after = _neighbor_segment(session, habit_id, day, before=False)
+    if before is not None and after is not None and after.start_day - before.end_day == step:
+        session.execute(table.delete().where(_segment_key(habit_id, after.start_day)))
+        session.execute(table.update().where(_segment_key(habit_id, before.start_day)).values(end_day=after.end_day))
+
+
+def _refresh_habit_stats(session, habit_id):
+    """Recompute the statistics row of a habit from its streak segments."""
+    step = _habit_step(session, habit_id)
+    segments = load_streak_segments(session, [habit_id]).get(habit_id, []) if step else []
+    lengths = [(end_day - start_day) // step + 1 for start_day, end_day in segments]
+    _replace_habit_rows(session, HabitStats.__table__, [habit_id], [
+        {"habit_id": habit_id, "longest_streak": max(lengths, default=0), "last_run": lengths[-1] if lengths else 0,
+         "last_day": segments[-1][1] if segments else None, "broken": len(segments) > 1}
+    ])
+
+
+def _discard_habit_bitmap(session, habit_id, day):
+    """Mark a day as not completed in the stored bitmap of a habit."""
+    bitmap = load_bitmaps(session, [habit_id]).get(habit_id)
+    if bitmap is None:
+        rebuild_habit_bitmaps(session, [habit_id])
+        return
+    bitmap.discard(day)
+    table = HabitBitmap.__table__
+    session.execute(table.update().where(table.c.habit_id == habit_id)
+                    .values(first_day=bitmap.first_day, bits=bitmap.to_bytes()))
+
+
+def _append_habit_stats(session, habit_id, day):
+    """Update the statistics of a habit after a checkpoint was inserted.
+
+    Checkpoints after the last one extend or restart the last run in place, any
+    other checkpoint makes the statistics be recomputed from the streak segments.
+    Habits of unknown frequencies keep no streak, like in compute_streaks.
+
+    Args:
+        session (Session): The session used to update the row.
+        habit_id (int): The habit that got a new checkpoint.
+        day (int): The day ordinal of the new checkpoint.
+    """
+    table = HabitStats.__table__
+    habits = Habit.__table__
+    row = session.execute(
+        select([table.c.longest_streak, table.c.last_run, table.c.last_day, habits.c.frequency])
+        .select_from(table.join(habits, habits.c.id == table.c.habit_id))
+        .where(table.c.habit_id == habit_id)
+    ).first()
+    step = FREQUENCY_STEPS.get(row.frequency) if row is not None else None
+    if step is None or row.last_day is None or day < row.last_day:
+        _refresh_habit_stats(session, habit_id)
+        return
+    if day == row.last_day:
+        return
+    if day - row.last_day == step:
+        values = {"last_run": row.last_run + 1, "longest_streak": max(row.longest_streak, row.last_run + 1)}
+    else:
+        values = {"last_run": 1, "longest_streak": max(row.longest_streak, 1), "broken": True}
+    session.execute(table.update().where(table.c.habit_id == habit_id).values(last_day=day, **values))
+
+
+def _touch_habits(session, habit_ids):
+    """Invalidate the cached analytics of changed habits.
+
+    The habits are remembered until the transaction ends and are invalidated again then,
+    because results computed meanwhile may come from uncommitted or rolled back data.
+
+    Args:
+        session (Session): The session that changed the habits.
+        habit_ids (Iterable[int]): The IDs of the changed habits.
+    """
+    habit_ids = set(habit_ids)
+    analytics_cache.bump(session.get_bind(), habit_ids)
+    session.info.setdefault("changed_habit_ids", set()).update(habit_ids)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _refresh_derived_tables(session, flush_context):
+    """Rebuild the derived tables and invalidate the cached analytics of habits changed through the ORM.
+
+    Besides habits with changed checkpoints this covers deleted habits and habits whose
+    frequency changed, their stored streaks were computed with the old step.
+    """
+    habit_ids = set()
+    deleted_habit_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Checkpoint) and instance.habit_id is not None:
+            habit_ids.add(instance.habit_id)
+        elif isinstance(instance, Habit) and instance in session.deleted:
+            habit_ids.add(instance.id)
+            deleted_habit_ids.add(instance.id)
+        elif isinstance(instance, Habit) and instance in session.dirty \
+                and inspect(instance).attrs.frequency.history.has_changes():
+            habit_ids.add(instance.id)
+    if deleted_habit_ids and not foreign_keys_enabled(session.connection()):
+        # the checkpoints that were not loaded are not deleted by the ORM
+        _delete_habit_children(session.connection(), deleted_habit_ids)
+    if habit_ids:
+        _touch_habits(session, habit_ids)
+        rebuild_derived_tables(session.connection(), habit_ids)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_committed_habits(session):
+    """Invalidate the cached analytics of habits changed by the committed transaction.
+
+    Other sessions may have cached results from before the commit after the flush
+    already bumped the versions.
+    """
+    habit_ids = session.info.pop("changed_habit_ids", None)
+    if habit_ids:
+        analytics_cache.bump(session.get_bind(), habit_ids)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _invalidate_rolled_back_habits(session):
+    """Invalidate the cached analytics of habits changed by the rolled back transaction."""
+    habit_ids = session.info.pop("changed_habit_ids", None)
+    if habit_ids:
+        analytics_cache.bump(session.get_bind(), habit_ids)
+
+
+_engine = None
+
+
+def configure_database(config=None):
+    """Open the application database with the given settings, replacing the current engine.
+
+    Args:
+        config (DatabaseConfig): The settings, read with load_config if not given.
+
+    Returns:
+        Engine: The new engine, with the schema migrated.
+    """
+    global _engine
+    engine = create_configured_engine(config or load_config())
+    migrate_schema(engine)
+    if _engine is not None:
+        session.remove()
+        _engine.dispose()
+    _engine = engine
+    return engine
+
+
+def get_engine():
+    """Return the engine of the application database, creating and migrating it on first use.
+
+    The location and storage settings come from load_config, see config.py.
+
+    Returns:
+        Engine: The sqlite engine.
+    """
+    if _engine is None:
+        configure_database()
+    return _engine
+
+
+def _create_session():
+    """Create a session bound to the application database."""
+    return Session(bind=get_engine())
+
+
+# connect to the database to execute sql statements.
+# the session is created, and the database opened, the first time it is used
+Session = sessionmaker()
+session = scoped_session(_create_session)
@@ -0,0 +1,117 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, func, select
+from habit import Habit, Checkpoint, Frequency
+from analytics import FREQUENCY_STEPS
+from db import migrate_schema, rebuild_derived_tables
+from cache import analytics_cache
+
+
+def synthetic_habits(num_habits, daily_share=0.5, rng=None, first_id=1):
+    """Generate random habit rows.
+
+    Args:
+        num_habits (int): The number of habits.
+        daily_share (float): The share of daily habits between 0 and 1, the rest is weekly.
+        rng (random.Random): The random generator, a generator seeded with 0 if not given.
+        first_id (int): The ID of the first habit.
+
+    Returns:
+        List[dict]: The habit rows with id, task and frequency.
+    """
+    rng = rng or random.Random(0)
+    return [{"id": habit_id, "task": f"Habit {habit_id}",
+             "frequency": Frequency.DAILY if rng.random() < daily_share else Frequency.WEEKLY}
+            for habit_id in range(first_id, first_id + num_habits)]
+
+
+def synthetic_checkpoints(habits, num_days, probability=0.8, rng=None, today=None):
+    """Generate random checkpoint rows for habits, one habit after the other.
+
+    Every day (daily habits) or every seventh day (weekly habits) of the history is checked
+    off with the given probability, so the rows are produced lazily in constant memory.
+
+    Args:
+        habits (List[dict]): The habit rows from synthetic_habits.
+        num_days (int): The number of days of history, ending today.
+        probability (float): The chance that a habit is checked off on a due day.
+        rng (random.Random): The random generator, a generator seeded with 0 if not given.
+        today (datetime): The last day of the history, defaults to midnight today.
+
+    Yields:
+        dict: A checkpoint row with habit_id and checkpoint_date.
+    """
+    rng = rng or random.Random(0)
+    today = today or datetime.combine(datetime.now().date(), datetime.min.time())
+    for habit in habits:
+        for day in range(0, num_days, FREQUENCY_STEPS[habit["frequency"]]):
+            if rng.random() < probability:
+                yield {"habit_id": habit["id"], "checkpoint_date": today - timedelta(days=day)}
+
+
+def generate_dataset(engine, num_habits, num_days, probability=0.8, daily_share=0.5, seed=0, today=None,
+                     chunk_size=10000):
+    """Add a reproducible synthetic dataset to a database.
+
+    The same arguments always produce the same habits and checkpoints. The habit IDs
+    continue after the highest existing ID. The checkpoints are inserted in chunks
+    in one transaction and the derived tables are rebuilt at the end.
+
+    Args:
+        engine (Engine): The database to fill, its schema is created if needed.
+        num_habits (int): The number of habits.
+        num_days (int): The number of days of history per habit.
+        probability (float): The chance that a habit is checked off on a due day.
+        daily_share (float): The share of daily habits, the rest is weekly.
+        seed (int): The seed of the random generator.
+        today (datetime): The last day of the history, defaults to midnight today.
+        chunk_size (int): The number of checkpoint rows per executemany.
+
+    Returns:
+        Tuple[int, int]: The number of habits and checkpoints added.
+    """
+    migrate_schema(engine)
+    rng = random.Random(seed)
+    checkpoints = 0
+    with engine.begin() as connection:
+        first_id = (connection.execute(select([func.max(Habit.__table__.c.id)])).scalar() or 0) + 1
+        habits = synthetic_habits(num_habits, daily_share, rng, first_id)
+        if habits:
+            connection.execute(Habit.__table__.insert(), habits)
+        chunk = []
+        for row in synthetic_checkpoints(habits, num_days, probability, rng, today):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                connection.execute(Checkpoint.__table__.insert(), chunk)
+                checkpoints += len(chunk)
+                chunk = []
+        if chunk:
+            connection.execute(Checkpoint.__table__.insert(), chunk)
+            checkpoints += len(chunk)
+        rebuild_derived_tables(connection)
+    # the rows were written through Core, past the session events that invalidate the cache
+    analytics_cache.bump(engine, [habit["id"] for habit in habits])
+    return len(habits), checkpoints
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with reproducible synthetic habits.")
+    parser.add_argument("path", help="sqlite file to fill, created if missing")
+    parser.add_argument("--habits", type=int, default=1000, help="number of habits")
+    parser.add_argument("--days", type=int, default=365, help="days of history per habit")
+    parser.add_argument("--probability", type=float, default=0.8, help="chance that a due day is checked off")
+    parser.add_argument("--daily-share", type=float, default=0.5, help="share of daily habits")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.path}")
+    start = time.perf_counter()
+    habits, checkpoints = generate_dataset(engine, args.habits, args.days, args.probability, args.daily_share, args.seed)
+    engine.dispose()
+    print(f"Generated {habits} habits and {checkpoints} checkpoints in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
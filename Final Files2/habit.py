@@ -1,11 +1,16 @@
 import datetime
 from enum import Enum
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum as EnumColumn
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, LargeBinary, ForeignKey, Index, func, event, \
+    DDL, Enum as EnumColumn
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
+from bitmap import CompletionBitmap
 
 Base = declarative_base()
 
+# the owner of habits created without one, and of the habits of databases from before tenants
+DEFAULT_OWNER = "default"
+
 
 class Frequency(Enum):
     """An enumeration representing the frequency at which a habit is performed.
@@ -26,6 +31,7 @@ class Habit(Base):
         id (int): The unique identifier for the habit.
         task (str): The description of the habit's task.
         frequency (Frequency): The frequency at which the habit is performed, either daily or weekly.
+        owner (str): The user or tenant the habit belongs to.
         checkpoints (List[Checkpoint]): The checkpoints associated with the habit, specifying the date.
 
     """
@@ -35,26 +41,191 @@ class Habit(Base):
     id = Column(Integer, primary_key=True)
     task = Column(String)
     frequency = Column(EnumColumn(Frequency))
+    owner = Column(String, nullable=False, default=DEFAULT_OWNER, server_default=DEFAULT_OWNER, index=True)
     # checkpoints = relationship("Checkpoint", backref="habit", cascade="all, delete-orphan")
     # checkpoint class has the habit attribute that refers to the Habit object
     # delete checkpoints when habit is deleted, and also all orphaned checkpoints if any
     # the Habit class can access the associated Checkpoint objects through the checkpoints attribute,
     # and vice versa.It allows for convenient querying and
     # manipulation of related data between Habit and Checkpoint objects.
-    checkpoints = relationship("Checkpoint", back_populates="habit", cascade="all, delete-orphan")
+    # passive_deletes leaves the checkpoints that are not loaded to the ON DELETE CASCADE of the database
+    checkpoints = relationship("Checkpoint", back_populates="habit", cascade="all, delete-orphan",
+                               passive_deletes=True)
+
+
+def seconds_of_day(value):
+    """Return the seconds since midnight of a datetime, None for a plain date or None."""
+    if not isinstance(value, datetime.datetime):
+        return None
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _checkpoint_day_default(context):
+    """Fill the day column of inserted rows from their checkpoint_date."""
+    value = context.get_current_parameters().get("checkpoint_date")
+    return value.toordinal() if value is not None else None
+
+
+def _checkpoint_time_of_day_default(context):
+    """Fill the time_of_day column of inserted rows from their checkpoint_date."""
+    return seconds_of_day(context.get_current_parameters().get("checkpoint_date"))
 
 
 class Checkpoint(Base):
     """A class representing a checkpoint for a habit.
 
+        The day and time_of_day columns are derived from checkpoint_date on insert and
+        whenever checkpoint_date is assigned, so day-level analytics compare integers.
+
         Attributes:
             id (int): The unique identifier for the checkpoint.
             habit_id (int): The foreign key referencing the habit the checkpoint belongs to.
             date (datetime): The start date of the checkpoint.
+            day (int): The proleptic Gregorian ordinal of the checkpoint date.
+            time_of_day (int): The seconds since midnight, None if only a date was given.
 
     """
     __tablename__ = 'checkpoints'
     id = Column(Integer, primary_key=True)
-    habit_id = Column(Integer, ForeignKey('habits.id'))
+    habit_id = Column(Integer, ForeignKey('habits.id', ondelete='CASCADE'))
     checkpoint_date = Column(DateTime)
+    day = Column(Integer, default=_checkpoint_day_default)
+    time_of_day = Column(Integer, default=_checkpoint_time_of_day_default)
+    # one checkpoint per habit and second, compared as integers. A plain date has no time_of_day
+    # and counts as midnight, sqlite would never find two NULLs equal.
+    # the day indexes are what the analytics scan, they hold integers only. (day, habit_id)
+    # turns date ranges over all habits into index range scans
+    __table_args__ = (Index('ix_checkpoints_habit_id_day_time', habit_id, day, func.coalesce(time_of_day, 0),
+                            unique=True),
+                      Index('ix_checkpoints_habit_id_day', 'habit_id', 'day'),
+                      Index('ix_checkpoints_day_habit_id', 'day', 'habit_id'))
     habit = relationship("Habit", back_populates="checkpoints")
+
+    @validates("checkpoint_date")
+    def _derive_day(self, key, value):
+        self.day = value.toordinal() if value is not None else None
+        self.time_of_day = seconds_of_day(value)
+        return value
+
+
+class HabitStats(Base):
+    """A class holding the precomputed streak statistics of a habit.
+
+        The row is kept up to date whenever checkpoints are written, so streak queries
+        do not need to read the checkpoint history.
+
+        Attributes:
+            habit_id (int): The habit the statistics belong to.
+            longest_streak (int): The length of the longest streak.
+            last_run (int): The length of the run ending with the last checkpoint.
+            last_day (int): The day ordinal of the last checkpoint, None without checkpoints.
+            broken (bool): Whether the checkpoints contain a gap.
+    """
+    __tablename__ = 'habit_stats'
+    habit_id = Column(Integer, ForeignKey('habits.id', ondelete='CASCADE'), primary_key=True)
+    longest_streak = Column(Integer, nullable=False, default=0)
+    last_run = Column(Integer, nullable=False, default=0)
+    last_day = Column(Integer)
+    broken = Column(Boolean, nullable=False, default=False)
+
+
+class HabitBitmap(Base):
+    """A class storing the completed days of a habit as a bitset.
+
+        Attributes:
+            habit_id (int): The habit the bitmap belongs to.
+            first_day (int): The day ordinal of the first bit, None without checkpoints.
+            bits (bytes): The little endian bitset, see CompletionBitmap.
+    """
+    __tablename__ = 'habit_bitmaps'
+    habit_id = Column(Integer, ForeignKey('habits.id', ondelete='CASCADE'), primary_key=True)
+    first_day = Column(Integer)
+    bits = Column(LargeBinary, nullable=False, default=b'')
+
+    def to_bitmap(self):
+        """Return the stored bitset as a CompletionBitmap."""
+        return CompletionBitmap.from_bytes(self.first_day, self.bits)
+
+
+class StreakSegment(Base):
+    """A class storing one run of a habit, the days from start_day to end_day one step apart.
+
+        The segments of a habit are disjoint and together hold exactly its completed days,
+        they are kept up to date whenever checkpoints are written.
+
+        Attributes:
+            habit_id (int): The habit the run belongs to.
+            start_day (int): The day ordinal of the first checkpoint of the run.
+            end_day (int): The day ordinal of the last checkpoint of the run.
+    """
+    __tablename__ = 'streak_segments'
+    habit_id = Column(Integer, ForeignKey('habits.id', ondelete='CASCADE'), primary_key=True)
+    start_day = Column(Integer, primary_key=True)
+    end_day = Column(Integer, nullable=False)
+
+
+class ArchivedCheckpoint(Base):
+    """A class holding a checkpoint moved out of the checkpoints table by the retention policy.
+
+        Only the integer day columns are kept, one row per habit and day.
+
+        Attributes:
+            habit_id (int): The habit the checkpoint belonged to.
+            day (int): The proleptic Gregorian ordinal of the checkpoint date.
+            time_of_day (int): The seconds since midnight, None if only a date was given.
+    """
+    __tablename__ = 'checkpoint_archive'
+    habit_id = Column(Integer, ForeignKey('habits.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Integer, primary_key=True)
+    time_of_day = Column(Integer)
+
+
+class ChangeCounter(Base):
+    """A class holding the number of changes made to the habit statistics of the database.
+
+        Triggers on habit_stats increase the single row with every written statistics row,
+        whichever connection or process writes it, so cached analytics can tell that the
+        statistics changed since they were computed.
+
+        Attributes:
+            id (int): The row, always 1.
+            value (int): The number of changes so far.
+    """
+    __tablename__ = 'change_counter'
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+# the statements creating the counter row and the triggers that count the statistics changes
+CHANGE_COUNTER_DDL = ["INSERT OR IGNORE INTO change_counter (id, value) VALUES (1, 0)"] + [
+    f"CREATE TRIGGER IF NOT EXISTS habit_stats_{operation.lower()}_counter AFTER {operation} ON habit_stats "
+    "BEGIN UPDATE change_counter SET value = value + 1; END"
+    for operation in ("INSERT", "UPDATE", "DELETE")]
+
+# tables created from the models start with the row and the triggers
+event.listen(ChangeCounter.__table__, "after_create", DDL(CHANGE_COUNTER_DDL[0]))
+for _trigger in CHANGE_COUNTER_DDL[1:]:
+    event.listen(HabitStats.__table__, "after_create", DDL(_trigger))
+
+
+class HabitRecord:
+    """A lightweight read-only view of a habit and its checkpoint days.
+
+        Used by the analytics read path instead of full ORM instances.
+
+        Attributes:
+            id (int): The unique identifier of the habit.
+            task (str): The description of the habit's task.
+            frequency (Frequency): The frequency at which the habit is performed.
+            days (List[int]): The day ordinals of the habit's checkpoints, sorted.
+    """
+    __slots__ = ("id", "task", "frequency", "days")
+
+    def __init__(self, id, task, frequency, days=None):
+        self.id = id
+        self.task = task
+        self.frequency = frequency
+        self.days = days if days is not None else []
+
+    def __repr__(self):
+        return f"HabitRecord(id={self.id!r}, task={self.task!r}, frequency={self.frequency!r}, days={len(self.days)})"
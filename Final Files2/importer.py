@@ -0,0 +1,75 @@
+import argparse
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from db import session, insert_checkpoints
+
+
+def read_checkpoint_file(path):
+    """Stream the checkpoints of a CSV or JSONL file.
+
+    CSV files need a header with the columns ``habit_id`` and ``checkpoint_date``,
+    JSONL files hold one object with the same keys per line. Dates are ISO formatted,
+    e.g. ``2023-06-01`` or ``2023-06-01 08:30``.
+
+    Args:
+        path (str): The path of the file, the format is chosen by its extension.
+
+    Yields:
+        Tuple[int, datetime]: The habit ID and date of every checkpoint.
+
+    Raises:
+        ValueError: If the file extension is not supported.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in (".csv", ".jsonl"):
+        raise ValueError(f"Unsupported file type '{extension}', expected .csv or .jsonl")
+    with open(path, newline="") as file:
+        if extension == ".csv":
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for record in records:
+            yield int(record["habit_id"]), datetime.fromisoformat(record["checkpoint_date"])
+
+
+def import_checkpoints(session, path, chunk_size=1000):
+    """Import the checkpoints of a CSV or JSONL file in a single transaction.
+
+    Checkpoints that already exist are skipped.
+
+    Args:
+        session (Session): The session used to write the checkpoints.
+        path (str): The path of the file to import.
+        chunk_size (int): The number of rows written per executemany.
+
+    Returns:
+        Tuple[int, int, float]: The number of rows read, the number of rows inserted
+        and the elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        total, inserted = insert_checkpoints(session, read_checkpoint_file(path), chunk_size)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return total, inserted, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import checkpoints from CSV or JSONL files.")
+    parser.add_argument("paths", nargs="+", help="files with habit_id and checkpoint_date columns")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows written per executemany")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        total, inserted, seconds = import_checkpoints(session, path, args.chunk_size)
+        rate = total / seconds if seconds else float("inf")
+        print(f"{path}: {inserted} of {total} checkpoints imported in {seconds:.2f}s ({rate:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
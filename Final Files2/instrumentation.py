@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds in seconds of the histogram buckets, the last bucket is unbounded
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name, label and help text of every histogram family
+FAMILIES = {
+    "operation_seconds": ("operation", "Time spent in instrumented operations, without waiting for user input."),
+    "operation_sql_seconds": ("operation", "Time spent executing SQL statements per operation call."),
+    "sql_seconds": ("statement", "Time spent executing SQL statements by statement type."),
+}
+
+
+class Histogram:
+    """A histogram of durations with fixed buckets.
+
+    Attributes:
+        counts (List[int]): The number of observations per bucket, not cumulative. The last
+            entry counts the observations above the largest bound.
+        count (int): The number of observations.
+        sum (float): The sum of all observations in seconds.
+    """
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Add an observation.
+
+        Args:
+            seconds (float): The duration.
+        """
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """Return the cumulative count of every bucket bound, "+Inf" included, as Prometheus expects."""
+        total = 0
+        buckets = {}
+        for bound, count in zip(list(BUCKETS) + ["+Inf"], self.counts):
+            total += count
+            buckets[str(bound)] = total
+        return buckets
+
+
+class Metrics:
+    """The histograms and counters collected while instrumentation is enabled.
+
+    Attributes:
+        histograms (Dict[Tuple[str, str], Histogram]): The histograms by family and label value.
+        statements (Dict[str, int]): The number of SQL statements run by every operation.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def observe(self, family, label, seconds):
+        """Add an observation to the histogram of a family and label value."""
+        with self._lock:
+            histogram = self.histograms.get((family, label))
+            if histogram is None:
+                histogram = self.histograms[(family, label)] = Histogram()
+            histogram.observe(seconds)
+
+    def count_statements(self, operation, statements):
+        """Add to the number of SQL statements of an operation."""
+        with self._lock:
+            self.statements[operation] = self.statements.get(operation, 0) + statements
+
+    def reset(self):
+        """Remove all observations."""
+        with self._lock:
+            self.histograms.clear()
+            self.statements.clear()
+
+    def to_dict(self):
+        """Return the metrics as a JSON serializable dictionary.
+
+        Returns:
+            dict: The histograms by family and label value with their cumulative bucket
+            counts, count and sum, and the statement counts by operation.
+        """
+        with self._lock:
+            histograms = {family: {} for family in FAMILIES}
+            for (family, label), histogram in sorted(self.histograms.items()):
+                histograms[family][label] = {"buckets": histogram.cumulative(), "count": histogram.count,
+                                             "sum": histogram.sum}
+            return {"histograms": histograms, "operation_sql_statements": dict(sorted(self.statements.items()))}
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics, every family prefixed with "habits_".
+        """
+        data = self.to_dict()
+        lines = []
+        for family, (label, help_text) in FAMILIES.items():
+            name = f"habits_{family}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for value, histogram in data["histograms"][family].items():
+                value = value.replace("\\", "\\\\").replace('"', '\\"')
+                for bound, count in histogram["buckets"].items():
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {histogram["sum"]}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {histogram["count"]}')
+        lines += ["# HELP habits_operation_sql_statements_total SQL statements executed per operation.",
+                  "# TYPE habits_operation_sql_statements_total counter"]
+        for operation, statements in data["operation_sql_statements"].items():
+            lines.append(f'habits_operation_sql_statements_total{{operation="{operation}"}} {statements}')
+        return "\n".join(lines) + "\n"
+
+
+# the metrics of this process
+metrics = Metrics()
+
+_enabled = False
+# the operations running on the current thread, innermost last, as [name, start, idle, sql seconds, statements]
+_local = threading.local()
+
+
+def _active_operations():
+    operations = getattr(_local, "operations", None)
+    if operations is None:
+        operations = _local.operations = []
+    return operations
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("instrumentation_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("instrumentation_start")
+    if not starts:
+        # the statement started before instrumentation was enabled
+        return
+    _record_statement(statement, time.perf_counter() - starts.pop())
+
+
+def _record_statement(statement, elapsed):
+    """Add a SQL statement to the statement histogram and to the running operations."""
+    metrics.observe("sql_seconds", statement.lstrip().split(None, 1)[0].upper(), elapsed)
+    for frame in _active_operations():
+        frame[3] += elapsed
+        frame[4] += 1
+
+
+def fetch_raw(connection, statement, parameters=()):
+    """Run a query on the DBAPI cursor of a connection and return all rows as plain tuples.
+
+    Plain tuples are much cheaper to turn into arrays than result rows. The query bypasses
+    the SQLAlchemy cursor events, so it is timed here, including the fetch.
+
+    Args:
+        connection (Connection): The SQLAlchemy connection, e.g. session.connection().
+        statement (str): The SQL query with ? placeholders.
+        parameters (Sequence): The query parameters.
+
+    Returns:
+        List[tuple]: The rows.
+    """
+    cursor = connection.connection.cursor()
+    start = time.perf_counter()
+    try:
+        rows = cursor.execute(statement, parameters).fetchall()
+    finally:
+        cursor.close()
+    if _enabled:
+        _record_statement(statement, time.perf_counter() - start)
+    return rows
+
+
+def enable():
+    """Start collecting metrics, SQL statements of every engine are timed from now on."""
+    global _enabled
+    if not _enabled:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        _enabled = True
+
+
+def disable():
+    """Stop collecting metrics. The collected metrics are kept until metrics.reset()."""
+    global _enabled
+    if _enabled:
+        event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+        _enabled = False
+
+
+def is_enabled():
+    """Return whether metrics are being collected."""
+    return _enabled
+
+
+@contextmanager
+def operation(name):
+    """Time a block as an operation, together with the SQL statements it runs.
+
+    Does nothing while instrumentation is disabled.
+
+    Args:
+        name (str): The operation name, e.g. "analytics.get_longest_run_streak".
+    """
+    if not _enabled:
+        yield
+        return
+    frame = [name, time.perf_counter(), 0.0, 0.0, 0]
+    operations = _active_operations()
+    operations.append(frame)
+    try:
+        yield
+    finally:
+        operations.remove(frame)
+        metrics.observe("operation_seconds", name, time.perf_counter() - frame[1] - frame[2])
+        metrics.observe("operation_sql_seconds", name, frame[3])
+        metrics.count_statements(name, frame[4])
+
+
+@contextmanager
+def idle():
+    """Exclude a block, such as waiting for user input, from the time of the running operations."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for frame in _active_operations():
+            frame[2] += elapsed
+
+
+def instrumented(name):
+    """Decorate a function so that every call is timed as an operation.
+
+    While instrumentation is disabled the only overhead is one flag check per call.
+
+    Args:
+        name (str): The operation name.
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with operation(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def write_metrics(path):
+    """Write the metrics to a file, in the Prometheus text format for .prom and .txt files, as JSON otherwise.
+
+    Args:
+        path (str): The file to write.
+    """
+    with open(path, "w") as file:
+        if path.endswith((".prom", ".txt")):
+            file.write(metrics.to_prometheus())
+        else:
+            json.dump(metrics.to_dict(), file, indent=2)
@@ -0,0 +1,139 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from config import DatabaseConfig
+from service import create_server
+
+
+def percentile(values, fraction):
+    """Return the value below which the given fraction of the sorted values lies.
+
+    Args:
+        values (List[float]): The sorted values.
+        fraction (float): The fraction between 0 and 1, e.g. 0.99.
+
+    Returns:
+        float: The percentile, 0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_client(host, port, habit_ids, requests, write_ratio, seed, latencies, errors):
+    """Send requests over one keep-alive connection and record their latencies.
+
+    Args:
+        host (str): The host of the service.
+        port (int): The port of the service.
+        habit_ids (List[int]): The habits to read and check off.
+        requests (int): The number of requests to send.
+        write_ratio (float): The share of requests that post a checkpoint.
+        seed (int): The seed of the random generator of this client.
+        latencies (List[float]): Receives the latency of every successful request in seconds.
+        errors (List[int]): Receives the status of every failed request.
+    """
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port)
+    for _ in range(requests):
+        habit_id = rng.choice(habit_ids)
+        if rng.random() < write_ratio:
+            day = f"2020-01-01 {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}"
+            body = json.dumps({"date": day})
+            method, path = "POST", f"/habits/{habit_id}/checkpoints"
+        else:
+            body = None
+            method, path = "GET", rng.choice([f"/habits/{habit_id}", "/analytics/broken", "/analytics/longest"])
+        start = time.perf_counter()
+        connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        if response.status < 400:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(response.status)
+    connection.close()
+
+
+def load_test(url, clients, requests, write_ratio, habits):
+    """Create habits on a running service and hit it from several client threads.
+
+    Args:
+        url (str): The base URL of the service.
+        clients (int): The number of concurrent client threads.
+        requests (int): The number of requests per client.
+        write_ratio (float): The share of requests that post a checkpoint.
+        habits (int): The number of habits to create first.
+
+    Returns:
+        dict: The request count, errors, requests per second and latency percentiles in ms.
+    """
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    habit_ids = []
+    for number in range(habits):
+        connection.request("POST", "/habits", body=json.dumps({"task": f"Load test {number}", "frequency": "daily"}))
+        habit_ids.append(json.loads(connection.getresponse().read())["result"]["id"])
+    connection.close()
+
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=run_client, args=(parts.hostname, parts.port, habit_ids, requests,
+                                                         write_ratio, seed, latencies, errors))
+               for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies) + len(errors),
+        "errors": len(errors),
+        "requests_per_second": (len(latencies) + len(errors)) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the habit tracker service.")
+    parser.add_argument("--url", help="base URL of a running service, a local one is started if not given")
+    parser.add_argument("--profile", default="durable", help="storage profile of the local service")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of checkpoint posts")
+    parser.add_argument("--habits", type=int, default=50, help="habits to create")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        url = args.url
+        if url is None:
+            config = DatabaseConfig(path=os.path.join(directory, "loadtest.db"), profile=args.profile)
+            server = create_server(("127.0.0.1", 0), config, quiet=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            results = load_test(url, args.clients, args.requests, args.write_ratio, args.habits)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+                server.engine.dispose()
+
+    print(f"{results['requests']} requests, {results['errors']} errors, {args.clients} clients")
+    print(f"{results['requests_per_second']:.0f} requests/s, "
+          f"p50 {results['p50_ms']:.1f} ms, p99 {results['p99_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
+import argparse
 import datetime
+import json
 import random
+import sys
 from habit import Habit, Frequency, Checkpoint
 from analytics import plot_habits_with_checkpoints, get_broken_streak_habits, \
-    get_longest_streak_for_habit, get_longest_run_streak
+    get_longest_streak_for_habit, get_longest_run_streak, render_habits_with_checkpoints, get_habit_streaks
 from datetime import datetime, timedelta
-from db import session
+from db import session, load_habits, load_habit_records, insert_checkpoint, insert_checkpoints, delete_habits, \
+    delete_checkpoint, page_habits, page_checkpoints, PAGE_SIZE
+from instrumentation import operation, idle, enable as enable_instrumentation, write_metrics
+from reminders import notify_checkpoint
+
+# operation names of the menu options, used to label their timings
+MENU_OPERATIONS = {
+    "1": "create_habit", "2": "add_checkpoint", "3": "show_habits", "4": "habits_with_checkpoints",
+    "5": "daily_habits", "6": "weekly_habits", "7": "longest_run_streak", "8": "longest_streak_for_habit",
+    "9": "delete_habit", "10": "broken_streak_habits", "11": "plot_habits",
+}
 
 weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
@@ -26,27 +39,93 @@ def create_habit(task, frequency):
 def add_checkpoint(habit, date):
     """Add a new checkpoint to a habit.
 
+        A checkpoint for a date the habit already has is ignored.
+
         Args:
             habit (Habit): The Habit object to which the checkpoint will be added.
             date (datetime): The start date of the checkpoint.
+
+        Returns:
+            bool: True if the checkpoint was added, False if it already existed.
     """
-    checkpoint = Checkpoint(checkpoint_date=date)
-    habit.checkpoints.append(checkpoint)
+    if habit.id is None:
+        # the habit is not stored yet, the checkpoint is saved together with it
+        checkpoint = Checkpoint(checkpoint_date=date)
+        habit.checkpoints.append(checkpoint)
+        session.commit()
+        # a habit outside the session is still not stored and has no ID to be reminded of
+        if habit.id is not None:
+            notify_checkpoint(habit.id, habit.frequency, date)
+        return True
+    added = insert_checkpoint(session, habit.id, date)
     session.commit()
+    # the checkpoints are reloaded the next time they are accessed
+    session.expire(habit, ['checkpoints'])
+    if added:
+        notify_checkpoint(habit.id, habit.frequency, date)
+    return added
+
 
+def add_checkpoints(habit, dates, chunk_size=1000):
+    """Add many checkpoints to a habit with a single commit.
 
-def get_habits():
-    """Get all habits from the database and print them.
+        Dates the habit already has a checkpoint for are ignored.
 
-        This function retrieves all habits from the database, orders them by their IDs,
-        and prints their IDs, tasks, and frequencies.
+        Args:
+            habit (Habit): The Habit object to which the checkpoints will be added.
+            dates (Iterable[datetime]): The start dates of the checkpoints.
+            chunk_size (int): The number of rows written per executemany.
 
+        Returns:
+            int: The number of checkpoints added.
     """
-    habits = session.query(Habit).order_by(Habit.id).all()
-    print("Existing Habits:")
-    for habit in habits:
-        print(f"{habit.id}. {habit.task} ({habit.frequency.value})")
-    return habits
+    if habit.id is None:
+        # the habit is not stored yet, the checkpoints are saved together with it
+        habit.checkpoints.extend(Checkpoint(checkpoint_date=date) for date in dates)
+        session.commit()
+        if habit.id is not None and habit.checkpoints:
+            notify_checkpoint(habit.id, habit.frequency, max(checkpoint.checkpoint_date
+                                                              for checkpoint in habit.checkpoints))
+        return len(habit.checkpoints)
+    dates = list(dates)
+    _, added = insert_checkpoints(session, ((habit.id, date) for date in dates), chunk_size)
+    session.commit()
+    session.expire(habit, ['checkpoints'])
+    if added:
+        notify_checkpoint(habit.id, habit.frequency, max(dates))
+    return added
+
+
+def get_habits(frequency=None, after_id=None, limit=None, output=None):
+    """Get habits from the database and print them.
+
+        The habits are read in pages ordered by their IDs and every page is written to the
+        output at once, so the cost of a listing grows with its length, not with the table.
+
+        Args:
+            frequency (Frequency): Only print habits with this frequency, if given.
+            after_id (int): Continue after this habit ID, the cursor returned by an earlier call.
+            limit (int): The number of habits to print, all remaining habits if not given.
+            output (TextIO): Where the habits are written, defaults to sys.stdout.
+
+        Returns:
+            int: The cursor to continue the listing with, None if the last habit was printed.
+    """
+    output = output or sys.stdout
+    if after_id is None:
+        output.write("Existing Habits:\n")
+    remaining = limit
+    while remaining is None or remaining > 0:
+        rows, after_id = page_habits(session, after_id, PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining),
+                                     frequency)
+        output.write("".join(f"{habit_id}. {task} ({habit_frequency.value})\n"
+                             for habit_id, task, habit_frequency in rows))
+        if remaining is not None:
+            remaining -= len(rows)
+        if after_id is None:
+            break
+    output.flush()
+    return after_id
 
 
 def generate_random_habits():
@@ -73,18 +152,74 @@ def generate_random_habits():
             session.commit()
 
 
-def habits_with_checkpoints(habits):
+def habits_with_checkpoints(habits=None, frequency=None, start_date=None, end_date=None, after=None, limit=None,
+                            output=None):
     """Print habits and their associated checkpoints.
-    Retrieves habits from the database and prints each habit along with its associated checkpoints.
+    Prints the given habits along with their checkpoints. Without habits they are read from
+    the database in pages ordered by ID, every habit is listed even without checkpoints in
+    the date range, and every page is written to the output at once.
+
+    Args:
+        habits (List[Habit]): The habits to print, read page by page from the database if not given.
+        frequency (Frequency): Only print habits with this frequency, if given.
+        start_date (date or datetime): Only print checkpoints on or after this day, if given.
+        end_date (date or datetime): Only print checkpoints on or before this day, if given.
+        after (int): Continue after this habit ID, the cursor returned by an earlier call.
+        limit (int): The number of habits to print, all remaining habits if not given.
+        output (TextIO): Where the habits are written, defaults to sys.stdout.
+
+    Returns:
+        int: The cursor to continue the listing with, None if the last habit was printed.
     """
-    print("Habits and their checkpoints:")
+    output = output or sys.stdout
+    if after is None:
+        output.write("Habits and their checkpoints:\n")
+
+    if habits is not None:
+        for habit in habits:
+            checkpoints = sorted(habit.checkpoints, key=lambda x: x.checkpoint_date)
+            output.write(f"\nHabit: {habit.task} ({habit.frequency.value})\nCheckpoints:\n"
+                         + "".join(f"Start Date: {checkpoint.checkpoint_date}\n" for checkpoint in checkpoints))
+        output.flush()
+        return None
 
-    for habit in habits:
-        print(f"\nHabit: {habit.task} ({habit.frequency.value})")
-        checkpoints = sorted(habit.checkpoints, key=lambda x: (x.checkpoint_date.month, x.checkpoint_date.day))
-        print("Checkpoints:")
-        for checkpoint in checkpoints:
-            print(f"Start Date: {checkpoint.checkpoint_date}")
+    remaining = limit
+    while remaining is None or remaining > 0:
+        rows, after = page_habits(session, after, PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining),
+                                  frequency)
+        dates = {habit_id: [] for habit_id, _, _ in rows}
+        checkpoint_cursor = None
+        while rows:
+            checkpoints, checkpoint_cursor = page_checkpoints(session, checkpoint_cursor, habit_ids=list(dates),
+                                                              start_date=start_date, end_date=end_date)
+            for habit_id, _, _, checkpoint_date in checkpoints:
+                dates[habit_id].append(f"Start Date: {checkpoint_date}\n")
+            if checkpoint_cursor is None:
+                break
+        output.write("".join(f"\nHabit: {task} ({habit_frequency.value})\nCheckpoints:\n" + "".join(dates[habit_id])
+                             for habit_id, task, habit_frequency in rows))
+        if remaining is not None:
+            remaining -= len(rows)
+        if after is None:
+            break
+    output.flush()
+    return after
+
+
+def _page_through(show_page):
+    """Print a listing page by page until it ends or the user stops it.
+
+    Args:
+        show_page (Callable): Prints the page after a cursor, None for the first page, and
+            returns the cursor of the next page, None after the last page.
+    """
+    cursor = show_page(None)
+    while cursor is not None:
+        with idle():
+            answer = input("Press Enter for more, 'q' to stop: ")
+        if answer.lower() == "q":
+            break
+        cursor = show_page(cursor)
 
 
 def generate_fake_checkpoints():
@@ -93,11 +228,12 @@ def generate_fake_checkpoints():
         This function generates checkpoints for each existing habit based on its frequency.
         For habits with a daily frequency, random daily checkpoints within a range are generated.
         For habits with a weekly frequency, random weekly checkpoints within a range are generated.
-        The generated checkpoints are added to the respective habits using the add_checkpoint function.
+        The generated checkpoints are added to the respective habits using the add_checkpoints function.
 
     """
     # Generate fake checkpoints for the existing habits
-    habits = session.query(Habit).all()
+    habits = load_habits(session)
+    existing_habits = []
     for habit in habits:
         if not habit.checkpoints:
             print(f"Generating checkpoints for habit: {habit.task} ({habit.frequency.value})")
@@ -123,8 +259,8 @@ def generate_fake_checkpoints():
                 checkpoint_dates = valid_checkpoints
 
                 for start_date in checkpoint_dates:
-                    add_checkpoint(habit, start_date)
                     print(f"Generated checkpoint: {start_date}")
+                add_checkpoints(habit, checkpoint_dates)
 
                 print(f"Generated {len(checkpoint_dates)} daily checkpoints for habit: {habit.task}")
 
@@ -139,7 +275,7 @@ def generate_fake_checkpoints():
                     checkpoint_dates.add(start_date)
 
                 # Check if any future start_dates with the same date already exist
-                existing_start_dates = {checkpoint.start_date.date() for checkpoint in habit.checkpoints}
+                existing_start_dates = {checkpoint.checkpoint_date.date() for checkpoint in habit.checkpoints}
                 valid_checkpoints = []
                 for start_date in checkpoint_dates:
                     if start_date not in existing_start_dates:
@@ -147,33 +283,51 @@ def generate_fake_checkpoints():
                 checkpoint_dates = valid_checkpoints
 
                 for start_date in checkpoint_dates:
-                    add_checkpoint(habit, start_date)
                     print(f"Generated checkpoint: {start_date}")
+                add_checkpoints(habit, checkpoint_dates)
 
                 print(f"Generated {len(checkpoint_dates)} weekly checkpoints for habit: {habit.task}")
         else:
-            # if habits already exist, just show the habits with their checkpoints
-            habits_with_checkpoints(habits)
+            existing_habits.append(habit)
+    if existing_habits:
+        # if habits already exist, just show the habits with their checkpoints
+        habits_with_checkpoints(existing_habits)
 
 
 def delete_habit(habit_id):
     """Delete a habit based on the provided habit ID.
 
+    The habit is deleted with one statement, its checkpoints are removed by the database.
+
     Args:
         habit_id (int): The ID of the habit to be deleted.
 
     Returns:
         None
     """
-    habit = session.query(Habit).get(habit_id)
-    if habit:
-        session.delete(habit)
+    if delete_habits(session, [habit_id]):
         session.commit()
         print("Habit deleted successfully!")
     else:
         print("Invalid habit ID!")
 
 
+def save_habit_plot(habit_ids, output_path, db_session=None):
+    """Save a graph of the selected habits and their checkpoints to an image file.
+
+    Args:
+        habit_ids (List[int]): The IDs of the habits to draw, in order.
+        output_path (str): The PNG or SVG file to write.
+        db_session (Session): The session used to read the habits, defaults to the application session.
+
+    Returns:
+        List[int]: The IDs that did not match any habit.
+    """
+    records = {record.id: record for record in load_habit_records(db_session or session, habit_ids=habit_ids)}
+    render_habits_with_checkpoints([records[habit_id] for habit_id in habit_ids if habit_id in records], output_path)
+    return [habit_id for habit_id in habit_ids if habit_id not in records]
+
+
 def get_user_input(message):
     """Prompt the user for input and retrieve the entered value.
 
@@ -183,12 +337,334 @@ def get_user_input(message):
         Returns:
             str or None: The user input as a string, or None if the user enters 'q' to go back to the main menu.
     """
-    user_input = input(message + " (press 'q' to go back to the main menu): ")
+    with idle():
+        user_input = input(message + " (press 'q' to go back to the main menu): ")
     if user_input.lower() == "q":
         return None
     return user_input
 
 
+def _habit_to_json(habit):
+    """Convert a habit into a JSON serializable dictionary."""
+    return {"id": habit.id, "task": habit.task, "frequency": habit.frequency.value}
+
+
+def _get_habit(db_session, habit_id):
+    """Return the habit with the given ID or raise a ValueError."""
+    habit = db_session.query(Habit).get(int(habit_id))
+    if habit is None:
+        raise ValueError(f"Invalid habit ID: {habit_id}")
+    return habit
+
+
+def _parallel_analytics(db_session, workers):
+    """Run the analytics of parallel.py on the database file of a session."""
+    from parallel import parallel_analytics
+    path = db_session.get_bind().url.database
+    if not path or path == ":memory:":
+        raise ValueError("Parallel analytics need a database file")
+    return parallel_analytics(path, int(workers))
+
+
+def _habits_by_ids(db_session, habit_ids):
+    """Load habits by their IDs, keeping the order of the IDs."""
+    habits = {habit.id: habit for habit in db_session.query(Habit).filter(Habit.id.in_(habit_ids))} if habit_ids else {}
+    return [habits[habit_id] for habit_id in habit_ids]
+
+
+def _page_limit(command, default):
+    """Return the page size of a listing command or raise a ValueError."""
+    if command.get("limit") is None:
+        return default
+    limit = int(command["limit"])
+    if limit < 1:
+        raise ValueError("The limit must be at least 1")
+    return limit
+
+
+def _checkpoint_cursor(token):
+    """Parse the "habit_id/date" cursor of the checkpoints command, None for the first page."""
+    if token is None:
+        return None
+    habit_id, _, checkpoint_date = str(token).partition("/")
+    return int(habit_id), datetime.fromisoformat(checkpoint_date)
+
+
+def run_command(db_session, command):
+    """Run a single command of the non-interactive interface.
+
+    The changes are flushed but not committed, the caller decides when to commit.
+
+    Commands are dictionaries with a "command" key:
+        {"command": "create", "task": str, "frequency": "daily" | "weekly"}
+        {"command": "checkpoint", "habit_id": int, "date": "YYYY-MM-DD[ HH:MM]"}  (date defaults to now)
+        {"command": "uncheck", "habit_id": int, "date": "YYYY-MM-DD[ HH:MM]"}
+        {"command": "streak", "habit_id": int}  (without habit_id: the longest run streaks)
+        {"command": "broken"}
+        ("recompute": true on "broken" and "streak" computes the streaks from the checkpoints
+        inside SQLite instead of reading the precomputed statistics)
+        ("workers": int on "broken" and "streak" without habit_id scores the committed
+        habits in that many processes)
+        {"command": "list", "frequency": "daily" | "weekly", "limit": int, "after": int}
+        {"command": "checkpoints", "frequency": "daily" | "weekly", "start": "YYYY-MM-DD",
+         "end": "YYYY-MM-DD", "limit": int, "after": str}
+        (all arguments of "list" and "checkpoints" are optional, "after" continues a listing
+        at the "next" cursor of its previous page, "checkpoints" pages default to PAGE_SIZE)
+        {"command": "update", "habit_id": int, "task": str, "frequency": "daily" | "weekly"}
+        (task and frequency are optional, the streaks follow a new frequency)
+        {"command": "delete", "habit_id": int}
+        {"command": "purge", "habit_ids": [int, ...]}  (unknown IDs are ignored)
+        {"command": "plot", "habit_ids": [int, ...], "output": "habits.png" | "habits.svg"}
+
+    Args:
+        db_session (Session): The session used to run the command.
+        command (dict): The command and its arguments.
+
+    Returns:
+        dict: The JSON serializable result of the command.
+
+    Raises:
+        ValueError: If the command or its arguments are invalid.
+    """
+    if not isinstance(command, dict):
+        raise ValueError("A command must be a JSON object")
+    with operation(f"command.{command.get('command')}"):
+        return _run_command(db_session, command)
+
+
+def _run_command(db_session, command):
+    """Run a command of run_command without timing it."""
+    name = command.get("command")
+    if name == "create":
+        task = command.get("task")
+        if not task:
+            raise ValueError("A task is required")
+        habit = create_habit(task, Frequency(str(command.get("frequency", "")).lower()))
+        db_session.add(habit)
+        db_session.flush()
+        return _habit_to_json(habit)
+    if name == "checkpoint":
+        habit = _get_habit(db_session, command.get("habit_id"))
+        date = datetime.fromisoformat(command["date"]) if command.get("date") else datetime.now()
+        return {"habit_id": habit.id, "date": date.isoformat(sep=" "),
+                "added": insert_checkpoint(db_session, habit.id, date)}
+    if name == "uncheck":
+        habit = _get_habit(db_session, command.get("habit_id"))
+        if not command.get("date"):
+            raise ValueError("A date is required")
+        date = datetime.fromisoformat(command["date"])
+        db_session.expire(habit, ["checkpoints"])
+        return {"habit_id": habit.id, "date": date.isoformat(sep=" "),
+                "removed": delete_checkpoint(db_session, habit.id, date)}
+    if name == "streak":
+        if command.get("habit_id") is None:
+            if command.get("workers"):
+                result = _parallel_analytics(db_session, command["workers"])
+                weekly, daily = result.weekly_streak, result.daily_streak
+                weekly_habits = _habits_by_ids(db_session, result.weekly_ids)
+                daily_habits = _habits_by_ids(db_session, result.daily_ids)
+            else:
+                habits = db_session.query(Habit).order_by(Habit.id).all()
+                weekly, weekly_habits, daily, daily_habits = get_longest_run_streak(
+                    habits, session=db_session, recompute=bool(command.get("recompute")))
+            return {"weekly": {"streak": weekly, "habits": [_habit_to_json(habit) for habit in weekly_habits]},
+                    "daily": {"streak": daily, "habits": [_habit_to_json(habit) for habit in daily_habits]}}
+        habit = _get_habit(db_session, command["habit_id"])
+        streaks = get_habit_streaks([habit], session=db_session, recompute=bool(command.get("recompute")))[0]
+        return dict(_habit_to_json(habit), longest=streaks.longest, current=streaks.current, broken=streaks.broken)
+    if name == "broken":
+        if command.get("workers"):
+            broken = _habits_by_ids(db_session, _parallel_analytics(db_session, command["workers"]).broken_ids)
+        else:
+            habits = db_session.query(Habit).order_by(Habit.id).all()
+            broken = get_broken_streak_habits(habits, session=db_session, recompute=bool(command.get("recompute")))
+        return {"habits": [_habit_to_json(habit) for habit in broken]}
+    if name == "list":
+        frequency = Frequency(command["frequency"].lower()) if command.get("frequency") else None
+        limit = _page_limit(command, None)
+        after_id = int(command["after"]) if command.get("after") is not None else None
+        habits = []
+        while limit is None or len(habits) < limit:
+            rows, after_id = page_habits(db_session, after_id, PAGE_SIZE if limit is None
+                                         else min(PAGE_SIZE, limit - len(habits)), frequency)
+            habits.extend({"id": habit_id, "task": task, "frequency": habit_frequency.value}
+                          for habit_id, task, habit_frequency in rows)
+            if after_id is None:
+                break
+        return {"habits": habits, "next": after_id}
+    if name == "checkpoints":
+        rows, after = page_checkpoints(
+            db_session, _checkpoint_cursor(command.get("after")), _page_limit(command, PAGE_SIZE),
+            frequency=Frequency(command["frequency"].lower()) if command.get("frequency") else None,
+            start_date=datetime.fromisoformat(command["start"]) if command.get("start") else None,
+            end_date=datetime.fromisoformat(command["end"]) if command.get("end") else None)
+        return {"checkpoints": [{"habit_id": habit_id, "task": task, "frequency": habit_frequency.value,
+                                 "date": checkpoint_date.isoformat(sep=" ")}
+                                for habit_id, task, habit_frequency, checkpoint_date in rows],
+                "next": f"{after[0]}/{after[1].isoformat(sep=' ')}" if after is not None else None}
+    if name == "update":
+        habit = _get_habit(db_session, command.get("habit_id"))
+        if "task" in command:
+            if not command["task"]:
+                raise ValueError("A task is required")
+            habit.task = command["task"]
+        if "frequency" in command:
+            habit.frequency = Frequency(str(command["frequency"]).lower())
+        db_session.flush()
+        return _habit_to_json(habit)
+    if name == "delete":
+        habit = _get_habit(db_session, command.get("habit_id"))
+        result = _habit_to_json(habit)
+        delete_habits(db_session, [habit.id])
+        db_session.expunge(habit)
+        return result
+    if name == "purge":
+        habit_ids = command.get("habit_ids")
+        if not isinstance(habit_ids, list):
+            raise ValueError("A list of habit IDs is required")
+        return {"deleted": delete_habits(db_session, [int(habit_id) for habit_id in habit_ids])}
+    if name == "plot":
+        habit_ids = command.get("habit_ids")
+        if not isinstance(habit_ids, list) or not command.get("output"):
+            raise ValueError("A list of habit IDs and an output file are required")
+        habit_ids = [int(habit_id) for habit_id in habit_ids]
+        missing = save_habit_plot(habit_ids, command["output"], db_session)
+        return {"output": command["output"], "missing": missing}
+    raise ValueError(f"Unknown command: {name}")
+
+
+def run_batch(db_session, lines, output):
+    """Run newline delimited JSON commands and write one JSON result line per command.
+
+    All commands run in one transaction that is committed at the end. A command that
+    fails is reported with "ok": false and does not stop the batch. The results are
+    written after the commit, if the batch is rolled back instead every command is
+    reported with "ok": false and the error is raised.
+
+    Args:
+        db_session (Session): The session used to run the commands.
+        lines (Iterable[str]): The JSON encoded commands, blank lines are skipped.
+        output (TextIO): The stream the results are written to.
+
+    Returns:
+        int: The number of failed commands.
+    """
+    failures = 0
+    results = []
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                result = {"ok": True, "result": run_command(db_session, json.loads(line))}
+            except (ValueError, KeyError, TypeError) as error:
+                result = {"ok": False, "error": str(error)}
+                failures += 1
+            results.append(result)
+        db_session.commit()
+    except Exception as error:
+        db_session.rollback()
+        # nothing of the batch was stored, so no command is reported as done
+        output.write("".join(json.dumps({"ok": False, "error": f"The batch was rolled back: {error}"}) + "\n"
+                             for _ in results))
+        raise
+    output.write("".join(json.dumps(result) + "\n" for result in results))
+    return failures
+
+
+def build_parser():
+    """Create the parser of the command line interface.
+
+    Returns:
+        argparse.ArgumentParser: The parser, without a command the interactive menu is started.
+    """
+    parser = argparse.ArgumentParser(description="Track daily and weekly habits.")
+    parser.add_argument("--batch", action="store_true",
+                        help="read newline delimited JSON commands from stdin and write JSON results")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="time SQL statements, analytics and menu options and write the histograms to FILE "
+                             "(Prometheus text format for .prom and .txt, JSON otherwise)")
+    commands = parser.add_subparsers(dest="command")
+    create = commands.add_parser("create", help="create a habit")
+    create.add_argument("task")
+    create.add_argument("--frequency", choices=[frequency.value for frequency in Frequency], default="daily")
+    checkpoint = commands.add_parser("checkpoint", help="add a checkpoint to a habit")
+    checkpoint.add_argument("habit_id", type=int)
+    checkpoint.add_argument("date", nargs="?", help="YYYY-MM-DD[ HH:MM], defaults to now")
+    uncheck = commands.add_parser("uncheck", help="remove a checkpoint from a habit")
+    uncheck.add_argument("habit_id", type=int)
+    uncheck.add_argument("date", help="YYYY-MM-DD[ HH:MM], as it was checked off")
+    streak = commands.add_parser("streak", help="show the streaks of a habit or the longest run streaks")
+    streak.add_argument("habit_id", type=int, nargs="?")
+    streak.add_argument("--workers", type=int, help="processes scoring the longest run streaks in parallel")
+    streak.add_argument("--recompute", action="store_true",
+                        help="compute the streaks from the checkpoints instead of the precomputed statistics")
+    broken = commands.add_parser("broken", help="list the habits with broken streaks")
+    broken.add_argument("--workers", type=int, help="processes scoring the habits in parallel")
+    broken.add_argument("--recompute", action="store_true",
+                        help="compute the streaks from the checkpoints instead of the precomputed statistics")
+    habit_list = commands.add_parser("list", help="list the habits")
+    habit_list.add_argument("--frequency", choices=[frequency.value for frequency in Frequency])
+    habit_list.add_argument("--limit", type=int, help="habits to list, all if not given")
+    habit_list.add_argument("--after", type=int, help="continue after this habit ID, the next cursor of a listing")
+    checkpoint_list = commands.add_parser("checkpoints", help="list the checkpoints page by page")
+    checkpoint_list.add_argument("--frequency", choices=[frequency.value for frequency in Frequency])
+    checkpoint_list.add_argument("--start", help="YYYY-MM-DD, first day to list")
+    checkpoint_list.add_argument("--end", help="YYYY-MM-DD, last day to list")
+    checkpoint_list.add_argument("--limit", type=int, help=f"checkpoints per page, defaults to {PAGE_SIZE}")
+    checkpoint_list.add_argument("--after", help="the next cursor of the previous page")
+    update = commands.add_parser("update", help="change the task or frequency of a habit")
+    update.add_argument("habit_id", type=int)
+    update.add_argument("--task")
+    update.add_argument("--frequency", choices=[frequency.value for frequency in Frequency])
+    delete = commands.add_parser("delete", help="delete a habit and its checkpoints")
+    delete.add_argument("habit_id", type=int)
+    purge = commands.add_parser("purge", help="delete many habits and their checkpoints at once")
+    purge.add_argument("habit_ids", type=int, nargs="+")
+    plot = commands.add_parser("plot", help="save a graph of habits and their checkpoints without a display")
+    plot.add_argument("habit_ids", type=int, nargs="+")
+    plot.add_argument("--output", default="habits.png", help="PNG or SVG file to write")
+    return parser
+
+
+def cli(argv=None):
+    """Run the command line interface.
+
+    Args:
+        argv (List[str]): The command line arguments, defaults to sys.argv.
+
+    Returns:
+        int: The exit status.
+    """
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        enable_instrumentation()
+    try:
+        return _run_cli(args)
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+
+
+def _run_cli(args):
+    """Run the parsed command line arguments and return the exit status."""
+    if args.batch:
+        return 1 if run_batch(session, sys.stdin, sys.stdout) else 0
+    if args.command is None:
+        main()
+        return 0
+    command = {key: value for key, value in vars(args).items() if key not in ("batch", "metrics") and value is not None}
+    try:
+        result = run_command(session, command)
+        session.commit()
+    except ValueError as error:
+        session.rollback()
+        print(json.dumps({"ok": False, "error": str(error)}))
+        return 1
+    print(json.dumps({"ok": True, "result": result}))
+    return 0
+
+
 def main():
     # Generate random habits and checkpoints
     generate_random_habits()
@@ -209,117 +685,113 @@ def main():
         0. Quit
     """
     while (choice := input(menu + "Choose an option from the menu: ")) != '0':
-        if choice == "1":
-            task = get_user_input("Enter the habit task: ")
-            if task:
+        with operation(f"menu.{MENU_OPERATIONS.get(choice, 'invalid')}"):
+            if choice == "1":
+                task = get_user_input("Enter the habit task: ")
+                if task:
+                    while True:
+                        frequency_input = get_user_input("Enter the habit frequency (daily/weekly): ")
+                        try:
+                            frequency = Frequency(frequency_input.lower())
+                            break
+                        except ValueError:
+                            print("Invalid frequency. Please enter 'daily' or 'weekly'.")
+                    habit = create_habit(task, frequency)
+                    session.add(habit)
+                    session.commit()
+                    print("Habit added successfully!")
+                else:
+                    print("Invalid task! Habit not created.")
+                    continue
+            elif choice == "2":
+                habits = session.query(Habit).order_by(Habit.id).all()
+                print("Existing Habits:")
+                for habit in habits:
+                    print(f"{habit.id}. {habit.task} ({habit.frequency.value})")
                 while True:
-                    frequency_input = get_user_input("Enter the habit frequency (daily/weekly): ")
+                    habit_id = get_user_input("Enter the habit ID to add a checkpoint: ")
                     try:
-                        frequency = Frequency(frequency_input.lower())
-                        break
+                        habit_id = int(habit_id)
+                        habit = session.query(Habit).get(habit_id)
+                        if habit:
+                            break
+                        else:
+                            print("Invalid habit ID. Please enter a valid habit ID.")
                     except ValueError:
-                        print("Invalid frequency. Please enter 'daily' or 'weekly'.")
-                habit = create_habit(task, frequency)
-                session.add(habit)
-                session.commit()
-                print("Habit added successfully!")
-            else:
-                print("Invalid task! Habit not created.")
-                continue
-        elif choice == "2":
-            habits = session.query(Habit).order_by(Habit.id).all()
-            print("Existing Habits:")
-            for habit in habits:
-                print(f"{habit.id}. {habit.task} ({habit.frequency.value})")
-            while True:
-                habit_id = get_user_input("Enter the habit ID to add a checkpoint: ")
-                try:
-                    habit_id = int(habit_id)
-                    habit = session.query(Habit).get(habit_id)
-                    if habit:
-                        break
-                    else:
-                        print("Invalid habit ID. Please enter a valid habit ID.")
-                except ValueError:
-                    print("Invalid habit ID. Please enter a valid integer.")
-            while True:
-                start_date_str = input("Enter the start date (YYYY-MM-DD HH:MM): ")
-                try:
-                    start_date = datetime.strptime(start_date_str, "%Y-%m-%d %H:%M")
-                    existing_checkpoint = session.query(Checkpoint).filter_by(habit_id=habit_id,
-                                                                              checkpoint_date=start_date).first()
-                    if existing_checkpoint:
-                        print("Checkpoint already exists for this habit and start date.")
-                        break
-                    else:
-                        add_checkpoint(habit, start_date)
-                        print("Checkpoint added successfully!")
+                        print("Invalid habit ID. Please enter a valid integer.")
+                while True:
+                    with idle():
+                        start_date_str = input("Enter the start date (YYYY-MM-DD HH:MM): ")
+                    try:
+                        start_date = datetime.strptime(start_date_str, "%Y-%m-%d %H:%M")
+                        if add_checkpoint(habit, start_date):
+                            print("Checkpoint added successfully!")
+                        else:
+                            print("Checkpoint already exists for this habit and start date.")
                         break
-                except ValueError:
-                    print("Invalid date format. Please enter the date in the format YYYY-MM-DD HH:MM.")
-        elif choice == "3":
-            get_habits()
-        elif choice == "4":
-            habits = session.query(Habit).order_by(Habit.id).all()
-            habits_with_checkpoints(habits)
-        elif choice == "5":
-            daily_habits = session.query(Habit).filter_by(frequency=Frequency.DAILY).all()
-            print("Current daily habits:")
-            for habit in daily_habits:
-                print(f"- Habit: {habit.task}")
-
-        elif choice == "6":
-            weekly_habits = session.query(Habit).filter_by(frequency=Frequency.WEEKLY).all()
-            print("Current weekly habits:")
-            for habit in weekly_habits:
-                print(f"- Habit: {habit.task}")
-        elif choice == "7":
-            habits = session.query(Habit).all()
-            longest_weekly_streak, longest_weekly_streak_habits, longest_daily_streak, longest_daily_streak_habits = get_longest_run_streak(
-                habits)
-            print(f"Longest weekly streak: {longest_weekly_streak}")
-            print("Habits with the longest weekly streak:")
-            for habit in longest_weekly_streak_habits:
-                print(f"- Habit: {habit.task} ({habit.frequency.value})")
-
-            print(f"Longest daily streak: {longest_daily_streak}")
-            print("Habits with the longest daily streak:")
-            for habit in longest_daily_streak_habits:
-                print(f"- Habit: {habit.task} ({habit.frequency.value})")
-        elif choice == "8":
-            habits = session.query(Habit).order_by(Habit.id).all()
-            get_habits()
-            habit_id = get_user_input("Enter the habit ID to see the longest streak: ")
-            if not habit_id:
-                continue
-            habit_id = int(habit_id)
-            habit = session.query(Habit).get(habit_id)
-            if habit:
-                max_streak = get_longest_streak_for_habit(habit)
-                print(f"Longest streak for habit '{habit.task}' ({habit.frequency.value}): {max_streak}")
+                    except ValueError:
+                        print("Invalid date format. Please enter the date in the format YYYY-MM-DD HH:MM.")
+            elif choice == "3":
+                _page_through(lambda cursor: get_habits(after_id=cursor, limit=PAGE_SIZE))
+            elif choice == "4":
+                _page_through(lambda cursor: habits_with_checkpoints(after=cursor, limit=PAGE_SIZE))
+            elif choice == "5":
+                daily_habits = session.query(Habit).filter_by(frequency=Frequency.DAILY).all()
+                print("Current daily habits:")
+                for habit in daily_habits:
+                    print(f"- Habit: {habit.task}")
+
+            elif choice == "6":
+                weekly_habits = session.query(Habit).filter_by(frequency=Frequency.WEEKLY).all()
+                print("Current weekly habits:")
+                for habit in weekly_habits:
+                    print(f"- Habit: {habit.task}")
+            elif choice == "7":
+                habits = session.query(Habit).all()
+                longest_weekly_streak, longest_weekly_streak_habits, longest_daily_streak, longest_daily_streak_habits = get_longest_run_streak(
+                    habits, session=session)
+                print(f"Longest weekly streak: {longest_weekly_streak}")
+                print("Habits with the longest weekly streak:")
+                for habit in longest_weekly_streak_habits:
+                    print(f"- Habit: {habit.task} ({habit.frequency.value})")
+
+                print(f"Longest daily streak: {longest_daily_streak}")
+                print("Habits with the longest daily streak:")
+                for habit in longest_daily_streak_habits:
+                    print(f"- Habit: {habit.task} ({habit.frequency.value})")
+            elif choice == "8":
+                get_habits()
+                habit_id = get_user_input("Enter the habit ID to see the longest streak: ")
+                if not habit_id:
+                    continue
+                habit_id = int(habit_id)
+                habit = session.query(Habit).get(habit_id)
+                if habit:
+                    max_streak = get_longest_streak_for_habit(habit, session=session)
+                    print(f"Longest streak for habit '{habit.task}' ({habit.frequency.value}): {max_streak}")
+                else:
+                    print("Invalid habit ID!")
+            elif choice == "9":
+                get_habits()
+                habit_id = get_user_input("Enter the habit ID to delete: ")
+                if not habit_id:
+                    continue
+                habit_id = int(habit_id)
+                delete_habit(habit_id)
+            elif choice == "10":
+                habits = session.query(Habit).all()
+                broken_streak_habits = get_broken_streak_habits(habits, session=session)
+                print("Habits with broken streaks:")
+                for habit in broken_streak_habits:
+                    print(f"- Habit: {habit.task} ({habit.frequency.value})")
+            elif choice == "11":
+                habits = load_habits(session)
+                plot_habits_with_checkpoints(habits)
             else:
-                print("Invalid habit ID!")
-        elif choice == "9":
-            get_habits()
-            habit_id = get_user_input("Enter the habit ID to delete: ")
-            if not habit_id:
-                continue
-            habit_id = int(habit_id)
-            delete_habit(habit_id)
-        elif choice == "10":
-            habits = session.query(Habit).all()
-            broken_streak_habits = get_broken_streak_habits(habits)
-            print("Habits with broken streaks:")
-            for habit in broken_streak_habits:
-                print(f"- Habit: {habit.task} ({habit.frequency.value})")
-        elif choice == "11":
-            habits = session.query(Habit).order_by(Habit.id).all()
-            plot_habits_with_checkpoints(habits)
-        else:
-            print("Invalid choice! Please try again.")
+                print("Invalid choice! Please try again.")
 
     exit("Bye!")
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
@@ -0,0 +1,65 @@
+import argparse
+import os
+import time
+from sqlalchemy import create_engine
+from db import migrate_schema, fill_checkpoint_days, check_streak_segments
+
+
+def upgrade_database(path, batch_size=50000, vacuum=False, progress=None):
+    """Upgrade a database file in place to the current schema, filling new columns in batches.
+
+    The integer day columns of the checkpoints are filled in separate transactions of
+    ``batch_size`` rows, so a large database is never locked for long and an interrupted
+    upgrade continues where it stopped. The remaining migration steps run afterwards.
+
+    Args:
+        path (str): The sqlite file.
+        batch_size (int): The number of checkpoint IDs per transaction.
+        vacuum (bool): Whether to rebuild the file afterwards to release unused pages.
+        progress (Callable): Called with the number of filled rows after every batch.
+
+    Returns:
+        dict: The number of filled rows, the seconds taken and the file size before and after.
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"No database at {path}")
+    size_before = os.path.getsize(path)
+    start = time.perf_counter()
+    engine = create_engine(f"sqlite:///{path}")
+    filled = fill_checkpoint_days(engine, batch_size, progress)
+    migrate_schema(engine)
+    if vacuum:
+        engine.execute("VACUUM")
+    engine.dispose()
+    return {"filled": filled, "seconds": time.perf_counter() - start,
+            "size_before": size_before, "size_after": os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade habit tracker databases to the current schema in place.")
+    parser.add_argument("paths", nargs="+", help="sqlite files to upgrade")
+    parser.add_argument("--batch-size", type=int, default=50000, help="checkpoints per transaction")
+    parser.add_argument("--vacuum", action="store_true", help="rebuild the files afterwards to release unused pages")
+    parser.add_argument("--check-segments", action="store_true",
+                        help="rebuild the streak segments from the checkpoints and report the habits that differ")
+    parser.add_argument("--repair", action="store_true", help="with --check-segments, fix the differing segments")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        result = upgrade_database(path, args.batch_size, args.vacuum,
+                                  progress=lambda filled: print(f"\r{path}: {filled} checkpoints filled", end=""))
+        print(f"\r{path}: {result['filled']} checkpoints filled in {result['seconds']:.1f} s, "
+              f"{result['size_before'] // 1024} KiB -> {result['size_after'] // 1024} KiB")
+        if args.check_segments:
+            engine = create_engine(f"sqlite:///{path}")
+            with engine.begin() as connection:
+                differences = check_streak_segments(connection, repair=args.repair)
+            engine.dispose()
+            for habit_id, (expected, stored) in differences.items():
+                print(f"{path}: habit {habit_id} has segments {stored}, expected {expected}")
+            print(f"{path}: {len(differences)} habits with inconsistent streak segments"
+                  + (", repaired" if args.repair and differences else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from urllib.request import pathname2url
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import NullPool
+from habit import Frequency, Habit
+from analytics import FREQUENCY_STEPS, compute_streaks_from_arrays
+from instrumentation import fetch_raw
+
+# the compact result of one shard: the longest streak and the habit IDs reaching it per
+# frequency, and the IDs of the habits with a broken streak
+ShardResult = namedtuple("ShardResult", ["weekly_streak", "weekly_ids", "daily_streak", "daily_ids", "broken_ids"])
+
+# run on the raw sqlite3 cursor, plain tuples are much cheaper to turn into arrays than result rows.
+# The join drops checkpoints of deleted habits, foreign keys are not enforced on these connections
+SHARD_DAYS_SQL = """
+SELECT checkpoints.habit_id, checkpoints.day
+FROM checkpoints
+JOIN habits ON habits.id = checkpoints.habit_id
+WHERE checkpoints.habit_id BETWEEN ? AND ? AND checkpoints.day IS NOT NULL
+"""
+
+
+def read_only_engine(path):
+    """Create an engine that opens a sqlite file in read-only mode.
+
+    Args:
+        path (str): The sqlite file.
+
+    Returns:
+        Engine: The engine, connections are not pooled.
+    """
+    uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+    return create_engine("sqlite://", creator=lambda: sqlite3.connect(uri, uri=True), poolclass=NullPool)
+
+
+def shard_ranges(engine, shards):
+    """Split the habit IDs into ranges holding about the same number of habits.
+
+    Args:
+        engine (Engine): The engine of the database.
+        shards (int): The number of ranges.
+
+    Returns:
+        List[Tuple[int, int]]: The inclusive (low, high) ID ranges in ascending order, fewer
+        than ``shards`` if there are fewer habits.
+    """
+    habit_ids = [habit_id for habit_id, in engine.execute(select([Habit.__table__.c.id]).order_by(Habit.__table__.c.id))]
+    if not habit_ids:
+        return []
+    shards = max(1, min(shards, len(habit_ids)))
+    bounds = [len(habit_ids) * number // shards for number in range(shards + 1)]
+    return [(habit_ids[bounds[number]], habit_ids[bounds[number + 1] - 1]) for number in range(shards)]
+
+
+def score_shard(path, low, high, today=None):
+    """Calculate the streaks of the habits in an ID range and reduce them to a ShardResult.
+
+    Runs in a worker process with its own read-only engine.
+
+    Args:
+        path (str): The sqlite file.
+        low (int): The lowest habit ID of the shard.
+        high (int): The highest habit ID of the shard.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+
+    Returns:
+        ShardResult: The longest streaks with their habit IDs and the broken habit IDs.
+    """
+    import numpy as np
+    habits = Habit.__table__
+    engine = read_only_engine(path)
+    with engine.connect() as connection:
+        rows = connection.execute(select([habits.c.id, habits.c.frequency])
+                                  .where(habits.c.id.between(low, high)).order_by(habits.c.id)).fetchall()
+        checkpoints = fetch_raw(connection, SHARD_DAYS_SQL, (low, high))
+    engine.dispose()
+
+    habit_ids = np.array([habit_id for habit_id, _ in rows], dtype=np.int64)
+    steps = [FREQUENCY_STEPS.get(frequency, 0) for _, frequency in rows]
+    checkpoints = np.fromiter(chain.from_iterable(checkpoints), dtype=np.int64,
+                              count=2 * len(checkpoints)).reshape(-1, 2)
+    owners = np.searchsorted(habit_ids, checkpoints[:, 0])
+    stats = compute_streaks_from_arrays(owners, checkpoints[:, 1], steps, today)
+
+    best = {Frequency.WEEKLY: (0, []), Frequency.DAILY: (0, [])}
+    broken_ids = []
+    for (habit_id, frequency), habit_stats in zip(rows, stats):
+        if habit_stats.broken:
+            broken_ids.append(habit_id)
+        if frequency in best:
+            streak, ids = best[frequency]
+            if habit_stats.longest > streak:
+                best[frequency] = (habit_stats.longest, [habit_id])
+            elif habit_stats.longest == streak:
+                ids.append(habit_id)
+    return ShardResult(best[Frequency.WEEKLY][0], best[Frequency.WEEKLY][1],
+                       best[Frequency.DAILY][0], best[Frequency.DAILY][1], broken_ids)
+
+
+def merge_shard_results(results):
+    """Merge the results of shards in ascending ID order into the result of all habits.
+
+    Ties are kept: every habit reaching the longest streak of its frequency is listed.
+
+    Args:
+        results (Iterable[ShardResult]): The shard results.
+
+    Returns:
+        ShardResult: The merged result, the IDs are in ascending order.
+    """
+    weekly_streak, weekly_ids, daily_streak, daily_ids, broken_ids = 0, [], 0, [], []
+    for result in results:
+        if result.weekly_streak > weekly_streak:
+            weekly_streak, weekly_ids = result.weekly_streak, list(result.weekly_ids)
+        elif result.weekly_streak == weekly_streak:
+            weekly_ids.extend(result.weekly_ids)
+        if result.daily_streak > daily_streak:
+            daily_streak, daily_ids = result.daily_streak, list(result.daily_ids)
+        elif result.daily_streak == daily_streak:
+            daily_ids.extend(result.daily_ids)
+        broken_ids.extend(result.broken_ids)
+    return ShardResult(weekly_streak, weekly_ids, daily_streak, daily_ids, broken_ids)
+
+
+def parallel_analytics(path, workers=None, shards=None, today=None):
+    """Calculate the longest run streaks and the broken habits of a database in worker processes.
+
+    The habit IDs are split into ranges, every worker loads and scores its ranges on its
+    own read-only connection and sends back a ShardResult. Only committed data is seen.
+
+    Args:
+        path (str): The sqlite file.
+        workers (int): The number of worker processes, defaults to the number of CPUs.
+            With 1 the shards are scored in this process.
+        shards (int): The number of ID ranges, defaults to ``workers``.
+        today (int): Day ordinal used for the current streak. Defaults to today.
+
+    Returns:
+        ShardResult: The longest weekly and daily streaks with the IDs of the habits reaching
+        them, and the IDs of the habits with a broken streak.
+    """
+    workers = workers or os.cpu_count() or 1
+    engine = read_only_engine(path)
+    ranges = shard_ranges(engine, shards or workers)
+    engine.dispose()
+    if workers == 1:
+        return merge_shard_results(score_shard(path, low, high, today) for low, high in ranges)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(score_shard, path, low, high, today) for low, high in ranges]
+        return merge_shard_results(future.result() for future in futures)
@@ -0,0 +1,310 @@
+import argparse
+import heapq
+import sys
+import threading
+import weakref
+from collections import namedtuple
+from datetime import date, datetime, time
+from time import sleep
+from sqlalchemy import create_engine, select
+from habit import Habit, HabitStats
+from analytics import FREQUENCY_STEPS, MAX_FILTER_IDS
+from db import migrate_schema
+
+# the time of day reminders are sent at
+REMIND_AT = time(9)
+
+# the checkpoints written since the last refresh, found through the primary key
+NEW_CHECKPOINTS_SQL = "SELECT id, habit_id, day FROM checkpoints WHERE id > ? ORDER BY id"
+
+# a reminder that a habit is due and not checked off yet
+Reminder = namedtuple("Reminder", ["habit_id", "task", "frequency", "due"])
+
+# the schedulers of this process, told about checkpoints by notify_checkpoint
+_schedulers = weakref.WeakSet()
+
+
+def format_reminder(reminder):
+    """Return the one line text of a reminder."""
+    return f"{reminder.due:%Y-%m-%d %H:%M} {reminder.task} ({reminder.frequency.value}) is due, habit {reminder.habit_id}"
+
+
+class StreamSink:
+    """Write reminders as lines to a text stream.
+
+    Attributes:
+        stream (TextIO): The stream, sys.stdout at the time of writing if not given.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def __call__(self, reminder):
+        stream = self.stream or sys.stdout
+        stream.write(format_reminder(reminder) + "\n")
+        stream.flush()
+
+
+class FileSink:
+    """Append reminders as lines to a file, opened for every reminder so it can be rotated.
+
+    Attributes:
+        path (str): The file the reminders are appended to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, reminder):
+        with open(self.path, "a") as file:
+            file.write(format_reminder(reminder) + "\n")
+
+
+class ReminderScheduler:
+    """Send reminders for the habits that are due and not checked off, kept in a min-heap.
+
+    Every habit has one live heap entry, the time its next reminder is due: one step after
+    its last checked off day, or today for habits never checked off. A tick pops the due
+    entries only, so its cost is logarithmic in the number of habits for every reminder
+    sent. A sent reminder is repeated one step later until the habit is checked off.
+    Entries moved by a checkpoint are left in the heap and skipped when they come up.
+
+    Checkpoints added through main.add_checkpoint reach the schedulers of the same process
+    at once, refresh picks up the habits and checkpoints written by other processes.
+    Checkpoints removed later are only seen after load is called again.
+
+    Attributes:
+        engine (Engine): The database of the habits.
+        sink (Callable): Called with every Reminder sent.
+        remind_at (datetime.time): The time of day reminders are due at.
+    """
+
+    def __init__(self, engine, sink=None, remind_at=REMIND_AT):
+        self.engine = engine
+        self.sink = sink if sink is not None else StreamSink()
+        self.remind_at = remind_at
+        self._heap = []
+        # habit ID -> due time of its live heap entry
+        self._due = {}
+        # habit ID -> (step, last checked off day)
+        self._habits = {}
+        self._last_habit_id = 0
+        self._last_checkpoint_id = 0
+        self._lock = threading.Lock()
+        _schedulers.add(self)
+
+    def __len__(self):
+        return len(self._due)
+
+    def _due_time(self, day):
+        return datetime.combine(date.fromordinal(day), self.remind_at)
+
+    def _schedule(self, habit_id, due):
+        """Move the live entry of a habit, compacting the heap when skipped entries pile up."""
+        self._due[habit_id] = due
+        heapq.heappush(self._heap, (due, habit_id))
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, habit_id) for habit_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def next_due(self):
+        """Return the time the next reminder is due, None if no habit is tracked."""
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def add_habit(self, habit_id, frequency, last_day=None, today=None):
+        """Start tracking a habit, habits that are tracked already are left as they are.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            frequency (Frequency): The frequency of the habit, habits of other frequencies are ignored.
+            last_day (int): The day ordinal of the last checkpoint, None if there is none.
+            today (int): The day ordinal a habit without checkpoints is due at, defaults to today.
+        """
+        step = FREQUENCY_STEPS.get(frequency)
+        if step is None:
+            return
+        with self._lock:
+            if habit_id in self._habits:
+                return
+            self._habits[habit_id] = (step, last_day)
+            day = last_day + step if last_day is not None else today or date.today().toordinal()
+            self._schedule(habit_id, self._due_time(day))
+
+    def remove_habit(self, habit_id):
+        """Stop tracking a habit."""
+        with self._lock:
+            self._habits.pop(habit_id, None)
+            self._due.pop(habit_id, None)
+
+    def checked_off(self, habit_id, day):
+        """Move the next reminder of a habit to one step after a checked off day.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            day (int): The day ordinal of the checkpoint.
+
+        Returns:
+            bool: True if the day is the new last day of a tracked habit.
+        """
+        with self._lock:
+            state = self._habits.get(habit_id)
+            if state is None or state[1] is not None and day <= state[1]:
+                return False
+            step = state[0]
+            self._habits[habit_id] = (step, day)
+            due = self._due_time(day + step)
+            if due > self._due[habit_id]:
+                self._schedule(habit_id, due)
+            return True
+
+    def load(self, today=None):
+        """Read every habit with its last checked off day from the habit statistics.
+
+        Args:
+            today (int): The day ordinal habits without checkpoints are due at, defaults to today.
+
+        Returns:
+            int: The number of habits tracked.
+        """
+        migrate_schema(self.engine)
+        habits, stats = Habit.__table__, HabitStats.__table__
+        query = select([habits.c.id, habits.c.frequency, stats.c.last_day]) \
+            .select_from(habits.outerjoin(stats, stats.c.habit_id == habits.c.id))
+        with self.engine.connect() as connection:
+            # read before the habits, so checkpoints written in between are seen again by refresh
+            last_checkpoint_id = connection.execute("SELECT MAX(id) FROM checkpoints").scalar()
+            rows = connection.execute(query).fetchall()
+        today = today or date.today().toordinal()
+        with self._lock:
+            self._heap, self._due, self._habits = [], {}, {}
+            for habit_id, frequency, last_day in rows:
+                step = FREQUENCY_STEPS.get(frequency)
+                if step is not None:
+                    self._habits[habit_id] = (step, last_day)
+                    self._due[habit_id] = self._due_time(last_day + step if last_day is not None else today)
+            self._heap = [(due, habit_id) for habit_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+            self._last_habit_id = max((habit_id for habit_id, _, _ in rows), default=0)
+            self._last_checkpoint_id = last_checkpoint_id or 0
+        return len(self._due)
+
+    def refresh(self, today=None):
+        """Track the habits and checkpoints written since the last load or refresh.
+
+        Args:
+            today (int): The day ordinal new habits without checkpoints are due at, defaults to today.
+        """
+        habits = Habit.__table__
+        with self.engine.connect() as connection:
+            new_habits = connection.execute(select([habits.c.id, habits.c.frequency])
+                                            .where(habits.c.id > self._last_habit_id)).fetchall()
+            new_checkpoints = connection.execute(NEW_CHECKPOINTS_SQL, self._last_checkpoint_id).fetchall()
+        for habit_id, frequency in new_habits:
+            self.add_habit(habit_id, frequency, today=today)
+            self._last_habit_id = max(self._last_habit_id, habit_id)
+        for checkpoint_id, habit_id, day in new_checkpoints:
+            if habit_id is not None and day is not None:
+                self.checked_off(habit_id, day)
+            self._last_checkpoint_id = checkpoint_id
+
+    def _tasks(self, habit_ids):
+        """Return the task and frequency of the habits that still exist by habit ID."""
+        habits = Habit.__table__
+        tasks = {}
+        with self.engine.connect() as connection:
+            for start in range(0, len(habit_ids), MAX_FILTER_IDS):
+                query = select([habits.c.id, habits.c.task, habits.c.frequency]) \
+                    .where(habits.c.id.in_(habit_ids[start:start + MAX_FILTER_IDS]))
+                tasks.update((habit_id, (task, frequency)) for habit_id, task, frequency in connection.execute(query))
+        return tasks
+
+    def tick(self, now=None):
+        """Send the reminders that are due and schedule each one again one step later.
+
+        Args:
+            now (datetime): The time the reminders are due by, defaults to now.
+
+        Returns:
+            List[Reminder]: The reminders sent, habits deleted in the meantime are dropped.
+        """
+        now = now or datetime.now()
+        self.refresh(now.toordinal())
+        fired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, habit_id = heapq.heappop(self._heap)
+                if self._due.get(habit_id) != due:
+                    continue
+                fired.append((habit_id, due))
+                self._schedule(habit_id, self._due_time(now.toordinal() + self._habits[habit_id][0]))
+        if not fired:
+            return []
+        tasks = self._tasks([habit_id for habit_id, _ in fired])
+        reminders = []
+        for habit_id, due in fired:
+            if habit_id not in tasks:
+                self.remove_habit(habit_id)
+                continue
+            task, frequency = tasks[habit_id]
+            reminder = Reminder(habit_id, task, frequency, due)
+            self.sink(reminder)
+            reminders.append(reminder)
+        return reminders
+
+
+def notify_checkpoint(habit_id, frequency, checkpoint_date):
+    """Tell the reminder schedulers of this process that a habit was checked off.
+
+    Args:
+        habit_id (int): The ID of the habit, habits that are not stored yet (None) are ignored.
+        frequency (Frequency): The frequency of the habit.
+        checkpoint_date (date or datetime): The date of the checkpoint.
+    """
+    if habit_id is None:
+        return
+    for scheduler in list(_schedulers):
+        scheduler.add_habit(habit_id, frequency)
+        scheduler.checked_off(habit_id, checkpoint_date.toordinal())
+
+
+def run_daemon(scheduler, interval=60):
+    """Tick a scheduler every ``interval`` seconds with the schedule library until interrupted.
+
+    Args:
+        scheduler (ReminderScheduler): The loaded scheduler.
+        interval (int): The seconds between two ticks.
+    """
+    import schedule
+    jobs = schedule.Scheduler()
+    jobs.every(interval).seconds.do(scheduler.tick)
+    scheduler.tick()
+    while True:
+        jobs.run_pending()
+        sleep(max(jobs.idle_seconds or 0, 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send reminders for habits that are due and not checked off.")
+    parser.add_argument("path", help="sqlite file of the habits")
+    parser.add_argument("--output", metavar="FILE", help="append the reminders to FILE instead of printing them")
+    parser.add_argument("--interval", type=int, default=60, help="seconds between two checks")
+    parser.add_argument("--at", default=REMIND_AT.strftime("%H:%M"), help="HH:MM, time of day reminders are due")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.path}")
+    sink = FileSink(args.output) if args.output else StreamSink()
+    scheduler = ReminderScheduler(engine, sink, datetime.strptime(args.at, "%H:%M").time())
+    print(f"{scheduler.load()} habits scheduled, next reminder at {scheduler.next_due()}", file=sys.stderr)
+    try:
+        run_daemon(scheduler, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import time
+from datetime import date
+from sqlalchemy import create_engine
+from cache import analytics_cache
+from db import migrate_schema, rebuild_derived_tables
+
+# the checkpoints of one batch, read once and then copied and deleted by ID, so the
+# archive and the delete always cover the same rows
+BATCH_SQL = "SELECT id, habit_id FROM checkpoints WHERE day < ? ORDER BY id LIMIT ?"
+ARCHIVE_SQL = "INSERT OR IGNORE INTO checkpoint_archive (habit_id, day, time_of_day) " \
+              "SELECT habit_id, day, time_of_day FROM checkpoints WHERE id = ? AND habit_id IS NOT NULL"
+DELETE_SQL = "DELETE FROM checkpoints WHERE id = ?"
+
+
+def archive_checkpoints(engine, retention_days, today=None, batch_size=10000, progress=None):
+    """Move the checkpoints older than the retention period into the checkpoint_archive table.
+
+    Every batch of ``batch_size`` checkpoints is copied and deleted in its own transaction,
+    so the checkpoints table is never locked for long. The archive keeps one row per habit
+    and day with the integer day columns only. Analytics only see the checkpoints that
+    remain, the statistics and bitmaps of the affected habits are rebuilt at the end.
+
+    Args:
+        engine (Engine): The database to clean up.
+        retention_days (int): The checkpoints of the last ``retention_days`` days are kept.
+        today (int): The day ordinal the retention period ends at, defaults to today.
+        batch_size (int): The number of checkpoints moved per transaction.
+        progress (Callable): Called with the number of archived checkpoints after every batch.
+
+    Returns:
+        dict: The number of archived checkpoints and habits, and the seconds taken.
+
+    Raises:
+        ValueError: If retention_days is negative.
+    """
+    if retention_days < 0:
+        raise ValueError("The retention period cannot be negative")
+    start = time.perf_counter()
+    migrate_schema(engine)
+    cutoff = (today if today is not None else date.today().toordinal()) - retention_days + 1
+    archived = 0
+    habit_ids = set()
+    while True:
+        with engine.begin() as connection:
+            batch = connection.execute(BATCH_SQL, cutoff, batch_size).fetchall()
+            if batch:
+                ids = [(checkpoint_id,) for checkpoint_id, _ in batch]
+                connection.execute(ARCHIVE_SQL, ids)
+                connection.execute(DELETE_SQL, ids)
+        if not batch:
+            break
+        habit_ids.update(habit_id for _, habit_id in batch)
+        archived += len(batch)
+        if progress is not None:
+            progress(archived)
+    habit_ids.discard(None)
+    if habit_ids:
+        with engine.begin() as connection:
+            rebuild_derived_tables(connection, habit_ids)
+        analytics_cache.bump(engine, habit_ids)
+    return {"archived": archived, "habits": len(habit_ids), "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old checkpoints into the archive table.")
+    parser.add_argument("path", help="sqlite file to clean up")
+    parser.add_argument("--days", type=int, required=True, help="days of checkpoints to keep")
+    parser.add_argument("--batch-size", type=int, default=10000, help="checkpoints per transaction")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.path}")
+    result = archive_checkpoints(engine, args.days, batch_size=args.batch_size,
+                                 progress=lambda archived: print(f"\r{archived} checkpoints archived", end=""))
+    engine.dispose()
+    print(f"\r{result['archived']} checkpoints of {result['habits']} habits archived in {result['seconds']:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from datetime import date
+from itertools import chain
+from sqlalchemy import select
+from habit import Habit
+from analytics import FREQUENCY_STEPS, compute_streaks_from_arrays
+from instrumentation import fetch_raw
+
+# the default completion rate windows in days
+WINDOWS = (7, 30, 90)
+
+# one range scan over the (day, habit_id) index, run on the raw cursor like parallel.SHARD_DAYS_SQL
+RANGE_DAYS_SQL = "SELECT habit_id, day FROM checkpoints WHERE day BETWEEN ? AND ?"
+RANGE_COUNTS_SQL = "SELECT habit_id, COUNT(DISTINCT day) FROM checkpoints WHERE day BETWEEN ? AND ? GROUP BY habit_id"
+
+# per-habit result of CompletionMatrix.summary
+HabitCompletion = namedtuple("HabitCompletion", ["habit_id", "rates", "current_streak", "trend"])
+
+
+def _ordinal(day):
+    """Return the day ordinal of a date, datetime or ordinal."""
+    return day if isinstance(day, int) else day.toordinal()
+
+
+def _fetch_pairs(session, sql, start_day, end_day):
+    """Run a query returning integer pairs and return them as an n x 2 int64 array."""
+    import numpy as np
+    rows = fetch_raw(session.connection(), sql, (start_day, end_day))
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2)
+
+
+class CompletionMatrix:
+    """The completed days of many habits as a dense habits x days boolean matrix.
+
+    Window counts are differences of per-habit cumulative sums, so every rolling statistic
+    is a handful of vectorized operations over all habits at once.
+
+    Attributes:
+        habit_ids (numpy.ndarray): The habit ID of every row, ascending.
+        steps (numpy.ndarray): The streak step in days of every row, 0 for unknown frequencies.
+        first_day (int): The day ordinal of column 0.
+        done (numpy.ndarray): ``done[i, j]`` is True if habit ``i`` was done on day ``first_day + j``.
+    """
+
+    def __init__(self, habit_ids, steps, first_day, done):
+        import numpy as np
+        self.habit_ids = np.asarray(habit_ids, dtype=np.int64)
+        self.steps = np.asarray(steps, dtype=np.int64)
+        self.first_day = first_day
+        self.done = done
+        # cumulative completions, column j counts the days before first_day + j
+        self.counts = np.zeros((done.shape[0], done.shape[1] + 1), dtype=np.int32)
+        np.cumsum(done, axis=1, out=self.counts[:, 1:])
+
+    @property
+    def last_day(self):
+        """int: The day ordinal of the last column."""
+        return self.first_day + self.done.shape[1] - 1
+
+    def completions(self, start_day, end_day):
+        """Count the completed days of every habit in a range, clipped to the matrix.
+
+        Args:
+            start_day (int or date): The first day of the range, inclusive.
+            end_day (int or date): The last day of the range, inclusive.
+
+        Returns:
+            numpy.ndarray: The number of completed days per habit.
+        """
+        start = min(max(_ordinal(start_day) - self.first_day, 0), self.done.shape[1])
+        end = min(max(_ordinal(end_day) - self.first_day + 1, start), self.done.shape[1])
+        return self.counts[:, end] - self.counts[:, start]
+
+    def completion_rates(self, window, as_of=None):
+        """Calculate the share of due completions done in the ``window`` days up to a day.
+
+        A daily habit is due every day and a weekly habit once every seven days, a rate
+        never exceeds 1.
+
+        Args:
+            window (int): The window length in days.
+            as_of (int or date): The last day of the window, defaults to the last day of the matrix.
+
+        Returns:
+            numpy.ndarray: The completion rate per habit, 0 for habits of unknown frequency.
+        """
+        import numpy as np
+        as_of = self.last_day if as_of is None else _ordinal(as_of)
+        done = self.completions(as_of - window + 1, as_of)
+        expected = np.where(self.steps > 0, window / np.maximum(self.steps, 1), np.inf)
+        return np.minimum(done / expected, 1.0)
+
+    def rolling_rates(self, window):
+        """Calculate the completion rate of every habit for the window ending at every day.
+
+        Args:
+            window (int): The window length in days.
+
+        Returns:
+            numpy.ndarray: A habits x days float array, NaN for days with less than a full window before them.
+        """
+        import numpy as np
+        rates = np.full(self.done.shape, np.nan)
+        if window <= self.done.shape[1]:
+            expected = np.where(self.steps > 0, window / np.maximum(self.steps, 1), np.inf)[:, None]
+            rates[:, window - 1:] = np.minimum((self.counts[:, window:] - self.counts[:, :-window]) / expected, 1.0)
+        return rates
+
+    def trends(self, window, as_of=None):
+        """Compare the completion rate of the last window with the window before it.
+
+        Args:
+            window (int): The window length in days.
+            as_of (int or date): The last day of the recent window, defaults to the last day of the matrix.
+
+        Returns:
+            numpy.ndarray: The change of the completion rate per habit, positive when improving.
+        """
+        as_of = self.last_day if as_of is None else _ordinal(as_of)
+        return self.completion_rates(window, as_of) - self.completion_rates(window, as_of - window)
+
+    def current_streaks(self, as_of=None):
+        """Calculate the current streak of every habit as of a day, ignoring later checkpoints.
+
+        Only the days in the matrix are seen, load enough history for long streaks.
+
+        Args:
+            as_of (int or date): The day the streaks are evaluated at, defaults to the last day of the matrix.
+
+        Returns:
+            numpy.ndarray: The current streak per habit.
+        """
+        import numpy as np
+        as_of = self.last_day if as_of is None else _ordinal(as_of)
+        owners, columns = np.nonzero(self.done[:, :max(as_of - self.first_day + 1, 0)])
+        stats = compute_streaks_from_arrays(owners, columns + self.first_day, self.steps, as_of)
+        return np.array([habit_stats.current for habit_stats in stats], dtype=np.int64)
+
+    def summary(self, as_of=None, windows=WINDOWS, trend_window=30):
+        """Collect the completion rates, current streak and trend of every habit.
+
+        Args:
+            as_of (int or date): The day the statistics are evaluated at, defaults to the last day of the matrix.
+            windows (Iterable[int]): The completion rate windows in days.
+            trend_window (int): The window of the trend in days.
+
+        Returns:
+            List[HabitCompletion]: One result per habit, ordered by habit ID.
+        """
+        rates = {window: self.completion_rates(window, as_of).tolist() for window in windows}
+        streaks = self.current_streaks(as_of).tolist()
+        trends = self.trends(trend_window, as_of).tolist()
+        return [HabitCompletion(habit_id, {window: rates[window][row] for window in windows}, streaks[row], trends[row])
+                for row, habit_id in enumerate(self.habit_ids.tolist())]
+
+
+def load_completion_matrix(session, start_day, end_day=None, habit_ids=None):
+    """Build the completion matrix of a day range in one range scan over the checkpoints.
+
+    Args:
+        session (Session): The session used to run the queries.
+        start_day (int or date): The first day of the matrix.
+        end_day (int or date): The last day of the matrix, defaults to today.
+        habit_ids (Collection[int]): Only include these habits, all habits if not given.
+
+    Returns:
+        CompletionMatrix: The matrix, one row per habit ordered by ID.
+    """
+    import numpy as np
+    start_day = _ordinal(start_day)
+    end_day = date.today().toordinal() if end_day is None else _ordinal(end_day)
+    habits = Habit.__table__
+    query = select([habits.c.id, habits.c.frequency]).order_by(habits.c.id)
+    if habit_ids is not None:
+        query = query.where(habits.c.id.in_(list(habit_ids)))
+    rows = session.execute(query).fetchall()
+    ids = np.array([habit_id for habit_id, _ in rows], dtype=np.int64)
+    steps = [FREQUENCY_STEPS.get(frequency, 0) for _, frequency in rows]
+
+    done = np.zeros((len(ids), max(end_day - start_day + 1, 0)), dtype=bool)
+    pairs = _fetch_pairs(session, RANGE_DAYS_SQL, start_day, end_day)
+    if len(ids) and len(pairs):
+        positions = np.minimum(np.searchsorted(ids, pairs[:, 0]), len(ids) - 1)
+        known = ids[positions] == pairs[:, 0]
+        done[positions[known], pairs[known, 1] - start_day] = True
+    return CompletionMatrix(ids, steps, start_day, done)
+
+
+def completed_days_between(session, start_day, end_day):
+    """Count the completed days of every habit in a date range with an index range scan.
+
+    Args:
+        session (Session): The session used to run the query.
+        start_day (int or date): The first day of the range, inclusive.
+        end_day (int or date): The last day of the range, inclusive.
+
+    Returns:
+        Dict[int, int]: The number of days with a checkpoint by habit ID, habits without any are missing.
+    """
+    pairs = _fetch_pairs(session, RANGE_COUNTS_SQL, _ordinal(start_day), _ordinal(end_day))
+    return dict(pairs.tolist())
@@ -0,0 +1,193 @@
+import argparse
+import json
+import re
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
+from config import load_config, create_configured_engine
+from db import migrate_schema
+from main import run_command
+
+
+
+def _parse_bool(value):
+    """Parse a boolean parameter given as JSON boolean or as true/false/1/0 string."""
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1"):
+        return True
+    if str(value).lower() in ("false", "0"):
+        return False
+    raise ValueError(f"Expected true or false, got {value!r}")
+
+
+def _parse_str(value):
+    """Parse a text parameter, other JSON values are rejected."""
+    if not isinstance(value, str):
+        raise ValueError(f"Expected a string, got {value!r}")
+    return value
+
+
+def _parse_int(value):
+    """Parse an integer parameter, booleans and fractions are rejected."""
+    if isinstance(value, bool) or isinstance(value, float):
+        raise ValueError(f"Expected an integer, got {value!r}")
+    return int(value)
+
+
+# (method, path pattern, command, parameters) of every route. Named groups of the path become
+# command arguments, the query string and JSON body may only set the listed parameters
+ROUTES = [
+    ("GET", r"/habits", "list", {"frequency": _parse_str, "limit": _parse_int, "after": _parse_int}),
+    ("GET", r"/checkpoints", "checkpoints",
+     {"frequency": _parse_str, "start": _parse_str, "end": _parse_str, "limit": _parse_int, "after": _parse_str}),
+    ("POST", r"/habits", "create", {"task": _parse_str, "frequency": _parse_str}),
+    ("GET", r"/habits/(?P<habit_id>\d+)", "streak", {"recompute": _parse_bool}),
+    ("PATCH", r"/habits/(?P<habit_id>\d+)", "update", {"task": _parse_str, "frequency": _parse_str}),
+    ("DELETE", r"/habits/(?P<habit_id>\d+)", "delete", {}),
+    ("POST", r"/habits/(?P<habit_id>\d+)/checkpoints", "checkpoint", {"date": _parse_str}),
+    ("GET", r"/analytics/longest", "streak", {"recompute": _parse_bool}),
+    ("GET", r"/analytics/broken", "broken", {"recompute": _parse_bool}),
+]
+
+
+class HabitRequestHandler(BaseHTTPRequestHandler):
+    """Serve the habit tracker commands of main.run_command as a JSON API.
+
+    Every request runs in its own thread with its own session from the scoped
+    session registry of the server, committed when the command succeeds.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _handle(self, method):
+        """Route a request to its command and write the JSON response."""
+        url = urlsplit(self.path)
+        route = None
+        for route_method, pattern, name, parameters in ROUTES:
+            match = re.fullmatch(pattern, url.path)
+            if match and route_method == method:
+                route = (name, parameters, match)
+                break
+        length = int(self.headers.get("Content-Length") or 0)
+        # the body is read even for unknown routes, so the connection can be reused
+        data = self.rfile.read(length) if length else b""
+        if route is None:
+            self._respond(404, {"ok": False, "error": f"No route for {method} {url.path}"})
+            return
+        name, parameters, match = route
+        try:
+            arguments = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            if data:
+                body = json.loads(data)
+                if not isinstance(body, dict):
+                    raise ValueError("The request body must be a JSON object")
+                arguments.update(body)
+            unknown = sorted(set(arguments) - set(parameters))
+            if unknown:
+                raise ValueError(f"Unknown parameters for {method} {url.path}: {', '.join(unknown)}")
+            command = {key: parameters[key](value) for key, value in arguments.items()}
+            # the route decides the command and the path IDs, nothing sent by the client can replace them
+            command.update({key: int(value) for key, value in match.groupdict().items()}, command=name)
+            status, result = self._run(command)
+        except ValueError as error:
+            status, result = 400, {"ok": False, "error": str(error)}
+        self._respond(status, result)
+
+    def _run(self, command):
+        """Run a command in a session of this thread and return the status and response."""
+        db_session = self.server.sessions()
+        try:
+            result = run_command(db_session, command)
+            db_session.commit()
+            return (201 if self.command == "POST" else 200), {"ok": True, "result": result}
+        except (ValueError, KeyError, TypeError) as error:
+            db_session.rollback()
+            return 400, {"ok": False, "error": str(error)}
+        except OperationalError as error:
+            db_session.rollback()
+            return 503, {"ok": False, "error": str(error.orig)}
+        except Exception:
+            # any other failure still gets a response, the client would otherwise see a dropped connection
+            db_session.rollback()
+            self.log_error("%s failed:\n%s", command.get("command"), traceback.format_exc())
+            return 500, {"ok": False, "error": "Internal server error"}
+        finally:
+            self.server.sessions.remove()
+
+    def _respond(self, status, body):
+        """Write a JSON response."""
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_server(address, config=None, quiet=False):
+    """Create the HTTP server of the habit tracker.
+
+    Unless the config chooses a pool, connections are pooled with a queue pool so that
+    concurrent requests reuse them, and sqlite waits for locks held by other writers.
+
+    Args:
+        address (Tuple[str, int]): The host and port to listen on, port 0 picks a free port.
+        config (DatabaseConfig): The database settings, read with load_config if not given.
+        quiet (bool): Whether to suppress the request log.
+
+    Returns:
+        ThreadingHTTPServer: The server, call serve_forever() to start it.
+    """
+    config = config or load_config()
+    if config.pool is None:
+        config.pool = "queue"
+    config.pragmas.setdefault("busy_timeout", 5000)
+    engine = create_configured_engine(config)
+    migrate_schema(engine)
+
+    server = ThreadingHTTPServer(address, HabitRequestHandler)
+    server.daemon_threads = True
+    server.engine = engine
+    server.sessions = scoped_session(sessionmaker(bind=engine))
+    server.quiet = quiet
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the habit tracker as a JSON API.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--quiet", action="store_true", help="do not log requests")
+    args = parser.parse_args()
+
+    server = create_server((args.host, args.port), quiet=args.quiet)
+    print(f"Serving habits on http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import copy
+import heapq
+import os
+import threading
+import zlib
+from collections import namedtuple
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+from config import load_config, create_configured_engine
+from habit import Habit, HabitStats
+from analytics import get_longest_run_streak, get_broken_streak_habits
+from db import migrate_schema, load_habits
+
+# one row of the cross-shard leaderboard
+LeaderboardEntry = namedtuple("LeaderboardEntry", ["longest_streak", "owner", "habit_id", "task", "frequency", "shard"])
+
+
+class ShardRouter:
+    """Route every tenant to one of several sqlite files.
+
+    A tenant always maps to the same shard, chosen by a stable hash of its name, so the
+    writes of different tenants are spread over several database write locks. Habit IDs
+    are only unique within a shard. The engines are created and migrated on first use.
+
+    Attributes:
+        paths (List[str]): The sqlite file of every shard.
+        config (DatabaseConfig): The storage settings shared by all shards, the path is ignored.
+    """
+
+    def __init__(self, paths, config=None):
+        if not paths:
+            raise ValueError("A shard router needs at least one database")
+        self.paths = list(paths)
+        self.config = config or load_config()
+        self._engines = {}
+        self._sessionmakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_directory(cls, directory, shards, config=None):
+        """Create a router over the files habits-0.db to habits-<shards - 1>.db of a directory.
+
+        Args:
+            directory (str): The directory of the shard files.
+            shards (int): The number of shards.
+            config (DatabaseConfig): The storage settings shared by all shards.
+
+        Returns:
+            ShardRouter: The router.
+        """
+        return cls([os.path.join(directory, f"habits-{shard}.db") for shard in range(shards)], config)
+
+    def shard_for(self, tenant):
+        """Return the shard number of a tenant.
+
+        Args:
+            tenant (str): The tenant name.
+
+        Returns:
+            int: The shard number, the same in every process.
+        """
+        return zlib.crc32(tenant.encode("utf-8")) % len(self.paths)
+
+    def engine(self, shard):
+        """Return the engine of a shard, creating and migrating it on first use.
+
+        Args:
+            shard (int): The shard number.
+
+        Returns:
+            Engine: The engine.
+        """
+        with self._lock:
+            if shard not in self._engines:
+                config = copy.deepcopy(self.config)
+                config.path = self.paths[shard]
+                engine = create_configured_engine(config)
+                migrate_schema(engine)
+                self._engines[shard] = engine
+                self._sessionmakers[shard] = sessionmaker(bind=engine)
+            return self._engines[shard]
+
+    def session(self, tenant):
+        """Open a session on the shard of a tenant.
+
+        The tenant is stored in ``session.info["tenant"]``, the tenant functions of this
+        module only read and write habits of that owner.
+
+        Args:
+            tenant (str): The tenant name.
+
+        Returns:
+            Session: A new session, the caller closes it.
+        """
+        shard = self.shard_for(tenant)
+        self.engine(shard)
+        db_session = self._sessionmakers[shard]()
+        db_session.info["tenant"] = tenant
+        return db_session
+
+    def dispose(self):
+        """Close the connections of all shards."""
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._sessionmakers.clear()
+
+
+def create_tenant_habit(db_session, task, frequency):
+    """Create a habit owned by the tenant of a session opened with ShardRouter.session.
+
+    Args:
+        db_session (Session): The tenant session.
+        task (str): The description of the habit's task.
+        frequency (Frequency): The frequency of the habit.
+
+    Returns:
+        Habit: The added habit, the caller commits the session.
+    """
+    habit = Habit(task=task, frequency=frequency, owner=db_session.info["tenant"])
+    db_session.add(habit)
+    return habit
+
+
+def tenant_habits(db_session, frequency=None):
+    """Load the habits of the tenant of a session together with their checkpoints.
+
+    Args:
+        db_session (Session): The tenant session.
+        frequency (Frequency): Only load habits with this frequency, if given.
+
+    Returns:
+        List[Habit]: The habits of the tenant ordered by their IDs.
+    """
+    return load_habits(db_session, frequency, owner=db_session.info["tenant"])
+
+
+def tenant_longest_run_streak(db_session):
+    """Calculate the longest run streaks among the habits of the tenant of a session.
+
+    Args:
+        db_session (Session): The tenant session.
+
+    Returns:
+        Tuple[int, List[Habit], int, List[Habit]]: Same as analytics.get_longest_run_streak.
+    """
+    habits = db_session.query(Habit).filter_by(owner=db_session.info["tenant"]).order_by(Habit.id).all()
+    return get_longest_run_streak(habits, session=db_session)
+
+
+def tenant_broken_streak_habits(db_session):
+    """Return the habits of the tenant of a session with broken streaks.
+
+    Args:
+        db_session (Session): The tenant session.
+
+    Returns:
+        List[Habit]: The habits with broken streaks.
+    """
+    habits = db_session.query(Habit).filter_by(owner=db_session.info["tenant"]).order_by(Habit.id).all()
+    return get_broken_streak_habits(habits, session=db_session)
+
+
+def leaderboard(router, limit=10, frequency=None):
+    """Rank the habits of all tenants of all shards by their longest streak.
+
+    Every shard returns its own top rows from the habit_stats table, which are merged.
+
+    Args:
+        router (ShardRouter): The shards.
+        limit (int): The number of entries.
+        frequency (Frequency): Only rank habits with this frequency, if given.
+
+    Returns:
+        List[LeaderboardEntry]: The entries with the longest streaks first, ties by owner and habit ID.
+    """
+    habits = Habit.__table__
+    stats = HabitStats.__table__
+    query = (select([stats.c.longest_streak, habits.c.owner, habits.c.id, habits.c.task, habits.c.frequency])
+             .select_from(stats.join(habits, stats.c.habit_id == habits.c.id))
+             .where(stats.c.longest_streak > 0)
+             .order_by(stats.c.longest_streak.desc(), habits.c.owner, habits.c.id)
+             .limit(limit))
+    if frequency is not None:
+        query = query.where(habits.c.frequency == frequency)
+    entries = []
+    for shard in range(len(router.paths)):
+        entries.extend(LeaderboardEntry(*row, shard) for row in router.engine(shard).execute(query))
+    return heapq.nsmallest(limit, entries, key=lambda entry: (-entry.longest_streak, entry.owner, entry.habit_id))
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import time
+from itertools import chain
+from sqlalchemy import create_engine, select
+from habit import Habit
+from analytics import FREQUENCY_STEPS, NO_STREAK, compute_streaks_from_arrays
+from db import migrate_schema
+from instrumentation import fetch_raw
+
+# the arrays of a snapshot, every one stored as <name>.npy in the snapshot directory
+COLUMNS = ("habit_ids", "steps", "offsets", "days")
+META_FILE = "snapshot.json"
+
+CHECKPOINTS_SQL = "SELECT habit_id, day, id FROM checkpoints WHERE id > ? AND habit_id IS NOT NULL"
+# the row count and column sums tell whether rows were deleted or ids reused since the last export,
+# sqlite hands out a deleted highest id again
+COUNT_SQL = "SELECT COUNT(*), MAX(id), SUM(id), SUM(habit_id), SUM(day) FROM checkpoints WHERE habit_id IS NOT NULL"
+
+
+def _fetch_columns(connection, sql, parameters=(), width=3):
+    """Run a query returning integer rows on the raw cursor and return them as a rows x width int64 array."""
+    import numpy as np
+    rows = fetch_raw(connection, sql, parameters)
+    return np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=width * len(rows)).reshape(-1, width)
+
+
+def _save(directory, name, array):
+    """Write an array next to its final name and move it into place, so open readers keep the old file."""
+    import numpy as np
+    path = os.path.join(directory, f"{name}.npy")
+    np.save(path + ".tmp.npy", array)
+    os.replace(path + ".tmp.npy", path)
+
+
+class Snapshot:
+    """Read-only columnar copy of the checkpoints, memory-mapped from .npy files.
+
+    The checkpoints are stored in CSR layout: the days of the habit ``habit_ids[i]`` are
+    ``days[offsets[i]:offsets[i + 1]]``, sorted. The arrays are opened with np.memmap, so
+    the scans read the files directly and nothing is copied into Python objects.
+
+    Attributes:
+        habit_ids (numpy.ndarray): The habit IDs, ascending.
+        steps (numpy.ndarray): The streak step in days of every habit, 0 for unknown frequencies.
+        offsets (numpy.ndarray): The start of every habit in ``days``, one entry more than habits.
+        days (numpy.ndarray): The day ordinals of all checkpoints, grouped by habit.
+        last_checkpoint_id (int): The highest checkpoint ID contained.
+        exported (int): The number of checkpoint rows read into the snapshot so far, including
+            rows of deleted habits that were left out.
+        checksum (List[int]): The sums of the id, habit_id and day columns of the exported rows.
+    """
+
+    def __init__(self, directory):
+        import numpy as np
+        with open(os.path.join(directory, META_FILE)) as file:
+            meta = json.load(file)
+        self.directory = directory
+        self.last_checkpoint_id = meta["last_checkpoint_id"]
+        self.exported = meta["exported"]
+        self.checksum = meta.get("checksum")
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.habit_ids)
+
+    def owners(self):
+        """Return the habit position of every checkpoint, the expanded form of ``offsets``."""
+        import numpy as np
+        return np.repeat(np.arange(len(self.habit_ids), dtype=np.int64), np.diff(self.offsets))
+
+    def streaks(self, today=None):
+        """Calculate the streaks of every habit in the snapshot.
+
+        Args:
+            today (int): Day ordinal used for the current streak. Defaults to today.
+
+        Returns:
+            List[StreakStats]: One result per habit, in the order of ``habit_ids``.
+        """
+        return compute_streaks_from_arrays(self.owners(), self.days, self.steps, today)
+
+    def habit_streaks(self, habit_ids, today=None):
+        """Calculate the streaks of some habits, reading only their slices of the arrays.
+
+        Args:
+            habit_ids (List[int]): The habits to evaluate.
+            today (int): Day ordinal used for the current streak. Defaults to today.
+
+        Returns:
+            List[StreakStats]: One result per habit in the order of ``habit_ids``, no streak for
+            habits the snapshot does not contain.
+        """
+        import numpy as np
+        habit_ids = np.asarray(habit_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.habit_ids, habit_ids), max(len(self.habit_ids) - 1, 0))
+        found = np.flatnonzero(self.habit_ids[positions] == habit_ids) if len(self.habit_ids) else []
+        stats = [NO_STREAK] * len(habit_ids)
+        if len(found) * 2 > len(self.habit_ids):
+            all_stats = self.streaks(today)
+            for index in found:
+                stats[index] = all_stats[positions[index]]
+        elif len(found):
+            starts, ends = self.offsets[positions[found]], self.offsets[positions[found] + 1]
+            days = np.concatenate([self.days[start:end] for start, end in zip(starts, ends)])
+            owners = np.repeat(np.arange(len(found), dtype=np.int64), ends - starts)
+            for index, habit_stats in zip(found, compute_streaks_from_arrays(
+                    owners, days, self.steps[positions[found]], today)):
+                stats[index] = habit_stats
+        return stats
+
+    def broken_habit_ids(self, today=None):
+        """Return the IDs of the habits whose streak was broken at least once."""
+        return [habit_id for habit_id, habit_stats in zip(self.habit_ids.tolist(), self.streaks(today))
+                if habit_stats.broken]
+
+
+def _checksum(rows):
+    """Return the sums of the id, habit_id and day columns of exported checkpoint rows."""
+    return [int(rows[:, 2].sum()), int(rows[:, 0].sum()), int(rows[:, 1].sum())]
+
+
+def _write_snapshot(directory, habit_ids, steps, owner_ids, days, last_checkpoint_id, exported, checksum):
+    """Sort checkpoint columns into CSR layout and write them, the metadata last."""
+    import numpy as np
+    known = np.isin(owner_ids, habit_ids)
+    owner_ids, days = owner_ids[known], days[known]
+    order = np.lexsort((days, owner_ids))
+    owner_ids, days = owner_ids[order], days[order]
+    offsets = np.append(np.searchsorted(owner_ids, habit_ids), len(days)).astype(np.int64)
+    os.makedirs(directory, exist_ok=True)
+    for name, array in zip(COLUMNS, (habit_ids, steps, offsets, days)):
+        _save(directory, name, np.ascontiguousarray(array, dtype=np.int64))
+    meta_path = os.path.join(directory, META_FILE)
+    with open(meta_path + ".tmp", "w") as file:
+        json.dump({"last_checkpoint_id": last_checkpoint_id, "exported": exported, "checksum": checksum,
+                   "habits": len(habit_ids),
+                   "checkpoints": len(days), "created": time.time()}, file)
+    os.replace(meta_path + ".tmp", meta_path)
+    return len(days)
+
+
+def export_snapshot(engine, directory, full=False):
+    """Write or refresh the columnar snapshot of a database.
+
+    Only the checkpoints with an ID above the highest exported one are read from the
+    database. When checkpoints were deleted since the last export, which a mismatch of
+    the row count or of the column sums reveals, or when ``full`` is set, the whole
+    table is exported again.
+    The habits are always read again so that new and deleted habits are picked up.
+
+    Args:
+        engine (Engine): The database to export.
+        directory (str): The snapshot directory, created if missing.
+        full (bool): Whether to ignore an existing snapshot.
+
+    Returns:
+        dict: The number of checkpoints read from the database, the total and whether the export was full.
+    """
+    import numpy as np
+    migrate_schema(engine)
+    previous = None
+    if not full and os.path.exists(os.path.join(directory, META_FILE)):
+        previous = Snapshot(directory)
+    with engine.connect() as connection:
+        table = Habit.__table__
+        habits = connection.execute(select([table.c.id, table.c.frequency]).order_by(table.c.id)).fetchall()
+        total, last_id, *sums = connection.execute(COUNT_SQL).fetchone()
+        sums = [value or 0 for value in sums]
+        after = previous.last_checkpoint_id if previous is not None else 0
+        rows = _fetch_columns(connection, CHECKPOINTS_SQL, (after,))
+        if previous is not None and (previous.exported + len(rows) != total or previous.checksum is None or [
+                old + new for old, new in zip(previous.checksum, _checksum(rows))] != sums):
+            previous, after = None, 0
+            rows = _fetch_columns(connection, CHECKPOINTS_SQL, (after,))
+    habit_ids = np.array([habit_id for habit_id, _ in habits], dtype=np.int64)
+    steps = np.array([FREQUENCY_STEPS.get(frequency, 0) for _, frequency in habits], dtype=np.int64)
+    owner_ids, days = rows[:, 0], rows[:, 1]
+    if previous is not None:
+        # the old rows are sorted already, lexsort merges them with the new ones
+        owner_ids = np.concatenate([np.repeat(previous.habit_ids, np.diff(previous.offsets)), owner_ids])
+        days = np.concatenate([previous.days, days])
+    exported = len(rows) + (previous.exported if previous is not None else 0)
+    checksum = _checksum(rows)
+    if previous is not None:
+        checksum = [old + new for old, new in zip(previous.checksum, checksum)]
+    written = _write_snapshot(directory, habit_ids, steps, owner_ids, days, last_id if last_id is not None else after,
+                              exported, checksum)
+    return {"read": len(rows), "checkpoints": written, "full": previous is None}
+
+
+def open_snapshot(directory):
+    """Open a snapshot written by export_snapshot.
+
+    Args:
+        directory (str): The snapshot directory.
+
+    Returns:
+        Snapshot: The memory-mapped snapshot.
+    """
+    return Snapshot(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the checkpoints as memory-mappable columnar files.")
+    parser.add_argument("path", help="sqlite file to export")
+    parser.add_argument("directory", help="snapshot directory, refreshed if it exists")
+    parser.add_argument("--full", action="store_true", help="export everything instead of only new checkpoints")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.path}")
+    start = time.perf_counter()
+    result = export_snapshot(engine, args.directory, args.full)
+    engine.dispose()
+    kind = "full" if result["full"] else "incremental"
+    print(f"{kind} export: {result['read']} checkpoints read, {result['checkpoints']} in snapshot, "
+          f"{time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
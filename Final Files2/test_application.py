@@ -1,11 +1,43 @@
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
-from habit import Base, Habit, Frequency, Checkpoint
-from main import create_habit, add_checkpoint, generate_random_habits, generate_fake_checkpoints, habits_with_checkpoints
-from analytics import get_broken_streak_habits, get_longest_streak_for_habit, get_longest_run_streak
+from datetime import datetime, timedelta
+from habit import Base, Habit, Frequency, Checkpoint, HabitRecord, DEFAULT_OWNER
+from main import create_habit, add_checkpoint, generate_random_habits, generate_fake_checkpoints, habits_with_checkpoints, \
+    run_batch, build_parser, run_command
+import service
+from service import create_server
+from parallel import parallel_analytics, shard_ranges, ShardResult
+from shards import ShardRouter, create_tenant_habit, tenant_habits, tenant_broken_streak_habits, \
+    tenant_longest_run_streak, leaderboard
+from generator import generate_dataset
+from bench_suite import compare_results, parse_scales
+from instrumentation import metrics, enable, disable, operation, idle, write_metrics
+from migrate import upgrade_database
+from snapshot import export_snapshot, open_snapshot
+from retention import archive_checkpoints
+from reminders import ReminderScheduler, Reminder, StreamSink, FileSink, notify_checkpoint
+from rolling import CompletionMatrix, load_completion_matrix, completed_days_between
+from analytics import get_broken_streak_habits, get_longest_streak_for_habit, get_longest_run_streak, \
+    compute_streaks, query_streaks, query_habit_stats, StreakStats, render_habits_with_checkpoints, \
+    iter_habit_streaks, iter_broken_streak_habits, stream_longest_run_streak, query_segment_streaks
+from db import load_habits, load_habit_records, insert_checkpoint, insert_checkpoints, migrate_schema, MIGRATIONS, \
+    load_bitmaps, delete_habits, delete_checkpoint, load_streak_segments, check_streak_segments, \
+    page_checkpoints, rebuild_derived_tables
+from bitmap import CompletionBitmap
+from config import DatabaseConfig, load_config, create_configured_engine
+from importer import import_checkpoints, read_checkpoint_file
+from cache import AnalyticsCache, CacheInfo, analytics_cache
+import db
 from io import StringIO
+import json
+import os
+import subprocess
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
 import sys
 
 
@@ -29,6 +61,17 @@ def session(database):
     session.rollback()
     session.close()
 
+@pytest.fixture(autouse=True)
+def app_database(tmp_path, monkeypatch):
+    # Point the application session at a temporary database, tests never write habits.db
+    monkeypatch.setenv("HABITS_DB_PATH", str(tmp_path / "habits.db"))
+    monkeypatch.setattr(db, "_engine", None)
+    yield db.session
+    # Teardown: Close the sessions and the engine opened by the test
+    db.session.remove()
+    if db._engine is not None:
+        db._engine.dispose()
+
 def test_create_habit(session):
     # Create a habit
     habit = create_habit("Exercise", Frequency.DAILY)
@@ -61,14 +104,16 @@ def test_add_checkpoint(session):
     assert habit.checkpoints[0].checkpoint_date == checkpoint_date
 
 
-def test_generate_random_habits(session):
+def test_generate_random_habits(app_database):
     # Generate random habits
     print("Generating random habits...")
     generate_random_habits()
 
     # Verify if five habits are added to the session
+    session = app_database
     habits = session.query(Habit).all()
     print(f"Number of habits in session: {len(habits)}")
+    assert len(habits) == 5
 
     # Verify if each habit has the correct task and frequency
     for habit in habits:
@@ -82,10 +127,12 @@ def test_generate_random_habits(session):
     assert all(session.query(Habit).get(habit.id) is not None for habit in habits)
 
 
-def test_generate_fake_checkpoints(session):
+def test_generate_fake_checkpoints(app_database):
     # Generate fake checkpoints
-    generate_fake_checkpoints()  # Pass the session object as a parameter
-    habits = session.query(Habit).all()
+    generate_random_habits()
+    generate_fake_checkpoints()
+    habits = app_database.query(Habit).all()
+    assert all(habit.checkpoints for habit in habits)
     # Verify if the generated checkpoints have the correct dates
     for habit in habits:
         assert all(isinstance(checkpoint.checkpoint_date, datetime) for checkpoint in habit.checkpoints)
@@ -118,6 +165,13 @@ def test_habits_with_checkpoints(session):
     expected_output = "Habits and their checkpoints:\n\nHabit: Exercise (daily)\nCheckpoints:\nStart Date: 2023-06-01 00:00:00\nStart Date: 2023-06-03 00:00:00\n"
     assert output == expected_output
 
+    # histories across a year boundary are listed in date order
+    habit = Habit(task='Winter', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 1, 1)), Checkpoint(checkpoint_date=datetime(2022, 12, 31))]
+    output = StringIO()
+    habits_with_checkpoints([habit], output=output)
+    assert output.getvalue().endswith("Start Date: 2022-12-31 00:00:00\nStart Date: 2023-01-01 00:00:00\n")
+
 
 # Unit test for get_longest_streak_for_habit
 def test_get_longest_streak_for_habit():
@@ -200,4 +254,1103 @@ def test_get_broken_streak_habits():
     broken_streak_habits = get_broken_streak_habits([habit1, habit2])
 
     # Assert the result
-    assert broken_streak_habits == [habit1]
\ No newline at end of file
+    assert broken_streak_habits == [habit1]
+
+# Unit test for the vectorized streak engine
+def test_compute_streaks_across_year_boundary():
+    # Create a daily habit whose streak spans new year
+    habit1 = Habit(task='Exercise', frequency=Frequency.DAILY)
+    habit1.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 1, 2)),
+                          Checkpoint(checkpoint_date=datetime(2022, 12, 30)),
+                          Checkpoint(checkpoint_date=datetime(2022, 12, 31)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 1))]
+    # Create a weekly habit with a gap and a habit without checkpoints
+    habit2 = Habit(task='Read a book', frequency=Frequency.WEEKLY)
+    habit2.checkpoints = [Checkpoint(checkpoint_date=datetime(2022, 12, 19)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 2)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 9))]
+    habit3 = Habit(task='Meditate', frequency=Frequency.DAILY)
+
+    today = datetime(2023, 1, 3).toordinal()
+    stats1, stats2, stats3 = compute_streaks([habit1, habit2, habit3], today=today)
+
+    assert stats1 == StreakStats(4, 4, False, datetime(2023, 1, 2).toordinal())
+    assert stats2.longest == 2
+    assert stats2.current == 2
+    assert stats2.broken
+    assert stats3 == StreakStats(0, 0, False, None)
+
+    # The streak is no longer current once a step has been missed
+    assert compute_streaks([habit1], today=today + 1)[0].current == 0
+    assert get_longest_streak_for_habit(habit1) == 4
+
+
+# Unit test for the SQL streak computation
+def test_query_streaks_matches_python_engine(session):
+    habit1 = Habit(task='Exercise', frequency=Frequency.DAILY)
+    habit1.checkpoints = [Checkpoint(checkpoint_date=datetime(2022, 12, 30, 8, 15)),
+                          Checkpoint(checkpoint_date=datetime(2022, 12, 31)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 1)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 3))]
+    habit2 = Habit(task='Read a book', frequency=Frequency.WEEKLY)
+    habit2.checkpoints = [Checkpoint(checkpoint_date=datetime(2022, 12, 20)),
+                          Checkpoint(checkpoint_date=datetime(2022, 12, 23)),
+                          Checkpoint(checkpoint_date=datetime(2023, 1, 3))]
+    habit3 = Habit(task='Meditate', frequency=Frequency.DAILY)
+    session.add_all([habit1, habit2, habit3])
+    session.flush()
+
+    today = datetime(2023, 1, 4).toordinal()
+    stats = query_streaks(session, today=today)
+    expected = compute_streaks([habit1, habit2, habit3], today=today)
+
+    assert stats[habit1.id] == expected[0] == StreakStats(3, 1, True, datetime(2023, 1, 3).toordinal())
+    assert stats[habit2.id] == expected[1]
+    assert habit3.id not in stats
+    assert get_broken_streak_habits([habit1, habit2, habit3], session=session) == [habit1, habit2]
+
+
+def test_query_streaks_weekly_and_same_day_duplicates(session):
+    weekly = Habit(task='Weekly duplicates', frequency=Frequency.WEEKLY)
+    weekly.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 3, 1, 8)),
+                          Checkpoint(checkpoint_date=datetime(2023, 3, 1, 20)),
+                          Checkpoint(checkpoint_date=datetime(2023, 3, 8)),
+                          Checkpoint(checkpoint_date=datetime(2023, 3, 14)),
+                          Checkpoint(checkpoint_date=datetime(2023, 3, 21, 7)),
+                          Checkpoint(checkpoint_date=datetime(2023, 3, 21, 9))]
+    daily = Habit(task='Daily duplicates', frequency=Frequency.DAILY)
+    daily.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 3, 20, hour)) for hour in (6, 12, 18)] + \
+                        [Checkpoint(checkpoint_date=datetime(2023, 3, 21))]
+    session.add_all([weekly, daily])
+    session.flush()
+
+    today = datetime(2023, 3, 22).toordinal()
+    stats = query_streaks(session, today=today)
+    expected = compute_streaks([weekly, daily], today=today)
+    assert [stats[weekly.id], stats[daily.id]] == expected
+    assert expected == [StreakStats(2, 2, True, datetime(2023, 3, 21).toordinal()),
+                        StreakStats(2, 2, False, datetime(2023, 3, 21).toordinal())]
+    # the window function path is selectable by the analytics functions and commands
+    assert weekly in get_broken_streak_habits([weekly, daily], session=session, recompute=True)
+    assert run_command(session, {"command": "streak", "habit_id": daily.id, "recompute": True})["longest"] == 2
+
+
+# Unit test for the bulk loading layer
+def test_load_habits_without_lazy_loads(database, session):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 6, 2)),
+                         Checkpoint(checkpoint_date=datetime(2023, 6, 1))]
+    session.add(habit)
+    session.commit()
+    habit_id = habit.id
+    session.expunge_all()
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database, "before_cursor_execute", count_statement)
+    try:
+        habits = load_habits(session)
+        days = {h.id: [c.checkpoint_date for c in h.checkpoints] for h in habits}
+        records = load_habit_records(session, frequency=Frequency.DAILY)
+    finally:
+        event.remove(database, "before_cursor_execute", count_statement)
+
+    # two queries for the habits, two for the records, none per habit
+    assert len(statements) == 4
+    assert sorted(days[habit_id]) == [datetime(2023, 6, 1), datetime(2023, 6, 2)]
+    record = next(r for r in records if r.id == habit_id)
+    assert record.days == [datetime(2023, 6, 1).toordinal(), datetime(2023, 6, 2).toordinal()]
+    assert all(r.frequency == Frequency.DAILY for r in records)
+    assert compute_streaks([record])[0].longest == 2
+
+
+# Unit test for the checkpoint uniqueness and the schema migration
+def test_insert_checkpoint_ignores_duplicates(session):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    session.add(habit)
+    session.flush()
+
+    assert insert_checkpoint(session, habit.id, datetime(2023, 6, 1))
+    assert not insert_checkpoint(session, habit.id, datetime(2023, 6, 1))
+    assert insert_checkpoint(session, habit.id, datetime(2023, 6, 1, 18, 30))
+    assert session.query(Checkpoint).filter_by(habit_id=habit.id).count() == 2
+
+    # a second checkpoint on the same day neither breaks nor extends the streak
+    session.expire(habit, ['checkpoints'])
+    assert compute_streaks([habit])[0].longest == 1
+    assert get_broken_streak_habits([habit]) == []
+    assert query_streaks(session)[habit.id].broken is False
+
+
+def test_migrate_schema_deduplicates_old_database():
+    engine = create_engine("sqlite:///:memory:")
+    # the checkpoints table as created before the unique index existed
+    engine.execute("CREATE TABLE checkpoints (id INTEGER PRIMARY KEY, habit_id INTEGER, checkpoint_date DATETIME)")
+    engine.execute("INSERT INTO checkpoints (habit_id, checkpoint_date) VALUES "
+                   "(1, '2023-06-01 00:00:00.000000'), (1, '2023-06-01 00:00:00.000000'), "
+                   "(1, '2023-06-02 00:00:00.000000'), (1, '2023-06-02 00:00:00.500000')")
+
+    migrate_schema(engine)
+    migrate_schema(engine)
+
+    # checkpoints less than a second apart are duplicates under the integer day and time index
+    assert engine.execute("SELECT id, day FROM checkpoints ORDER BY id").fetchall() == \
+        [(1, datetime(2023, 6, 1).toordinal()), (3, datetime(2023, 6, 2).toordinal())]
+    indexes = [name for name, in engine.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'checkpoints'")]
+    assert 'ix_checkpoints_habit_id_day_time' in indexes
+    assert 'ix_checkpoints_habit_id_checkpoint_date' not in indexes
+    assert engine.execute("PRAGMA user_version").scalar() == len(MIGRATIONS)
+    engine.dispose()
+
+
+# Unit test for the bulk checkpoint import
+def test_import_checkpoints(session, tmp_path):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    session.add(habit)
+    session.commit()
+
+    csv_file = tmp_path / "checkpoints.csv"
+    csv_file.write_text("habit_id,checkpoint_date\n"
+                        f"{habit.id},2023-06-01\n{habit.id},2023-06-02 08:30\n{habit.id},2023-06-01\n")
+    jsonl_file = tmp_path / "checkpoints.jsonl"
+    jsonl_file.write_text(f'{{"habit_id": {habit.id}, "checkpoint_date": "2023-06-03"}}\n\n'
+                          f'{{"habit_id": {habit.id}, "checkpoint_date": "2023-06-02 08:30"}}\n')
+
+    total, inserted, seconds = import_checkpoints(session, str(csv_file), chunk_size=2)
+    assert (total, inserted) == (3, 2)
+    total, inserted, seconds = import_checkpoints(session, str(jsonl_file))
+    assert (total, inserted) == (2, 1)
+
+    dates = [c.checkpoint_date for c in session.query(Checkpoint).filter_by(habit_id=habit.id)
+             .order_by(Checkpoint.checkpoint_date)]
+    assert dates == [datetime(2023, 6, 1), datetime(2023, 6, 2, 8, 30), datetime(2023, 6, 3)]
+
+    with pytest.raises(ValueError):
+        list(read_checkpoint_file(str(tmp_path / "checkpoints.txt")))
+
+
+# Unit test for the incrementally maintained habit statistics
+def test_habit_stats_maintained_on_writes(session):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 6, 1))]
+    session.add(habit)
+    session.flush()
+    today = datetime(2023, 6, 5).toordinal()
+
+    def stats():
+        return query_habit_stats(session, [habit.id], today=today)[habit.id]
+
+    # the ORM insert builds the row
+    assert stats() == StreakStats(1, 0, False, datetime(2023, 6, 1).toordinal())
+
+    # appends update the row in place
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 2))
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 4))
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 5, 9, 0))
+    assert stats() == StreakStats(2, 2, True, today)
+
+    # an out of order insert rebuilds the row
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 3))
+    assert stats() == StreakStats(5, 5, False, today)
+
+    # deleting a checkpoint rebuilds the row
+    session.expire(habit, ['checkpoints'])
+    last = next(c for c in habit.checkpoints if c.checkpoint_date == datetime(2023, 6, 5, 9, 0))
+    habit.checkpoints.remove(last)
+    session.flush()
+    assert stats().longest == 4
+    assert get_longest_streak_for_habit(habit, session=session) == 4
+
+    # deleting the habit removes the row
+    session.delete(habit)
+    session.flush()
+    assert query_habit_stats(session, [habit.id]) == {}
+
+
+# Unit test for the analytics cache
+def test_habit_stats_follow_frequency_changes(session):
+    habit = Habit(task='Changing pace', frequency=Frequency.DAILY)
+    session.add(habit)
+    session.commit()
+    insert_checkpoints(session, [(habit.id, datetime(2023, 6, day)) for day in (1, 8, 15)])
+    session.commit()
+    today = datetime(2023, 6, 16).toordinal()
+    assert query_habit_stats(session, [habit.id], today)[habit.id] == StreakStats(1, 1, True, datetime(2023, 6, 15).toordinal())
+
+    habit.frequency = Frequency.WEEKLY
+    session.commit()
+    expected = compute_streaks(load_habit_records(session, habit_ids=[habit.id]), today)[0]
+    assert query_habit_stats(session, [habit.id], today)[habit.id] == expected == \
+        StreakStats(3, 3, False, datetime(2023, 6, 15).toordinal())
+    assert check_streak_segments(session, [habit.id]) == {}
+
+
+def test_analytics_cache_lru_and_versions():
+    cache = AnalyticsCache(maxsize=2)
+    calls = []
+
+    def compute(habit_ids):
+        calls.append(list(habit_ids))
+        return {habit_id: habit_id * 10 for habit_id in habit_ids}
+
+    assert cache.get_many("f", "db", [1, 2], compute) == [10, 20]
+    assert cache.get_many("f", "db", [1, 2], compute) == [10, 20]
+    assert calls == [[1, 2]]
+
+    # a new version invalidates only the bumped habit
+    cache.bump("db", [2])
+    cache.get_many("f", "db", [1, 2], compute)
+    assert calls[-1] == [2]
+
+    # a third habit evicts the least recently used one
+    cache.get_many("f", "db", [3], compute)
+    cache.get_many("f", "db", [2, 3], compute)
+    cache.get_many("f", "db", [1], compute)
+    assert calls[-1] == [1]
+    assert cache.info() == CacheInfo(hits=5, misses=5, maxsize=2, currsize=2)
+
+    # uncached habits are neither served from nor stored in the cache
+    computed = len(calls)
+    cache.get_many("f", "db", [1], compute, uncached={1})
+    assert calls[computed:] == [[1]]
+    cache.bump("db", [1])
+    cache.get_many("f", "db", [1], compute, uncached={1})
+    cache.get_many("f", "db", [1], compute)
+    assert calls[computed:] == [[1], [1], [1]]
+    assert cache.info().hits == 5
+
+    # forgotten versions fall back to a stamp that is never older than the habit's own
+    cache = AnalyticsCache(maxsize=8, max_versions=2)
+    cache.get_many("f", "db", [1, 2, 3], compute)
+    cache.bump("db", [1, 2, 3])
+    assert len(cache._versions) == 2
+    cached = len(calls)
+    cache.get_many("f", "db", [1, 2, 3], compute)
+    assert calls[cached:] == [[1, 2, 3]]
+    cache.get_many("f", "db", [1, 2, 3], compute)
+    assert len(calls) == cached + 1
+
+
+def test_cached_streaks_are_never_stale(session):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    session.add(habit)
+    session.commit()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    assert get_longest_streak_for_habit(habit, session=session) == 0
+    hits = analytics_cache.hits
+    assert get_longest_streak_for_habit(habit, session=session) == 0
+    assert analytics_cache.hits == hits + 1
+
+    # a new checkpoint is visible right away
+    for checkpoint_date in [today - timedelta(days=1), today]:
+        insert_checkpoint(session, habit.id, checkpoint_date)
+    assert get_longest_run_streak([habit], session=session)[2] == 2
+
+    # results of the uncommitted checkpoints are not cached for other sessions
+    hits, size = analytics_cache.hits, analytics_cache.info().currsize
+    assert get_longest_streak_for_habit(habit, session=session) == 2
+    assert (analytics_cache.hits, analytics_cache.info().currsize) == (hits, size)
+
+    # and so is its rollback
+    session.rollback()
+    assert get_longest_streak_for_habit(habit, session=session) == 0
+
+
+def test_cached_streaks_see_writes_of_other_engines(tmp_path):
+    path = tmp_path / "shared.db"
+    engine, other_engine = create_engine(f"sqlite:///{path}"), create_engine(f"sqlite:///{path}")
+    migrate_schema(engine)
+    db_session, other_session = sessionmaker(bind=engine)(), sessionmaker(bind=other_engine)()
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    db_session.add(habit)
+    db_session.commit()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    assert get_longest_streak_for_habit(habit, session=db_session) == 0
+    db_session.commit()
+
+    # another process writes the checkpoints, this process never bumps the version of the habit
+    for checkpoint_date in [today - timedelta(days=1), today]:
+        insert_checkpoint(other_session, habit.id, checkpoint_date)
+    other_session.commit()
+    assert get_longest_streak_for_habit(habit, session=db_session) == 2
+
+    # and through Core, like the retention policy and the generator
+    with other_engine.begin() as connection:
+        connection.execute("DELETE FROM checkpoints WHERE habit_id = ? AND day = ?", habit.id, today.toordinal())
+        rebuild_derived_tables(connection, [habit.id])
+    db_session.commit()
+    assert get_longest_streak_for_habit(habit, session=db_session) == 1
+    for closing in (db_session, other_session):
+        closing.close()
+    engine.dispose()
+    other_engine.dispose()
+
+
+# Unit test for the headless plot renderer
+def test_render_habits_with_checkpoints(tmp_path, session):
+    habit1 = HabitRecord(1, 'Exercise', Frequency.DAILY,
+                         [datetime(2023, 6, 1).toordinal(), datetime(2023, 6, 3).toordinal()])
+    habit2 = Habit(task='Read a book', frequency=Frequency.WEEKLY)
+    habit2.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 5, 29))]
+    habit3 = HabitRecord(3, 'Meditate', Frequency.DAILY)
+
+    render_habits_with_checkpoints([habit1, habit2, habit3], str(tmp_path / "habits.png"))
+    render_habits_with_checkpoints([habit1, habit2, habit3], str(tmp_path / "habits.svg"))
+
+    assert (tmp_path / "habits.png").read_bytes().startswith(b"\x89PNG")
+    assert b"<svg" in (tmp_path / "habits.svg").read_bytes()
+    with pytest.raises(ValueError):
+        render_habits_with_checkpoints([habit1], str(tmp_path / "habits.gif"))
+
+    # the plot command renders stored habits
+    session.add(habit2)
+    session.commit()
+    result = run_command(session, {"command": "plot", "habit_ids": [habit2.id, 10 ** 6],
+                                   "output": str(tmp_path / "command.svg")})
+    assert result["missing"] == [10 ** 6]
+    assert b"<svg" in (tmp_path / "command.svg").read_bytes()
+    assert build_parser().parse_args(["plot", "1", "2", "--output", "a.svg"]).habit_ids == [1, 2]
+
+
+# Unit test for the completion bitmap
+def test_completion_bitmap_queries():
+    day = datetime(2023, 6, 1).toordinal()
+    bitmap = CompletionBitmap.from_days([day + 2, day, day + 1, day + 1, day + 5, day + 6])
+
+    assert bitmap.days() == [day, day + 1, day + 2, day + 5, day + 6]
+    assert bitmap.done_on(day + 1) and not bitmap.done_on(day + 3) and not bitmap.done_on(day - 1)
+    assert bitmap.count() == 5 and bitmap.count(day + 2, day + 5) == 2
+    assert bitmap.longest_streak() == 3
+    assert bitmap.current_streak(day + 7) == 2 and bitmap.current_streak(day + 8) == 0
+    assert bitmap.is_broken() and bitmap.gaps() == [(day + 2, day + 5)]
+    assert len(bitmap.to_bytes()) == 1
+
+    # weekly runs only count checkpoints that are exactly a week apart
+    weekly = CompletionBitmap.from_days([day, day + 3, day + 7, day + 14])
+    assert weekly.longest_streak(7) == 2
+    assert weekly.gaps(7) == [(day, day + 3), (day + 3, day + 7)]
+
+    # adding an earlier day moves the anchor
+    bitmap.add(day - 3)
+    assert bitmap.first_day == day - 3 and bitmap.done_on(day) and bitmap.count() == 6
+    assert CompletionBitmap.from_bytes(bitmap.first_day, bitmap.to_bytes()) == bitmap
+
+
+def test_habit_bitmaps_kept_in_sync(session):
+    habit = Habit(task='Exercise', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 6, 2))]
+    session.add(habit)
+    session.flush()
+    day = datetime(2023, 6, 1).toordinal()
+
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 3))
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 1))
+    assert load_bitmaps(session, [habit.id])[habit.id].days() == [day, day + 1, day + 2]
+
+    insert_checkpoints(session, [(habit.id, datetime(2023, 6, 10))])
+    session.expire(habit, ['checkpoints'])
+    habit.checkpoints.remove(next(c for c in habit.checkpoints if c.checkpoint_date == datetime(2023, 6, 2)))
+    session.flush()
+    assert load_bitmaps(session, [habit.id])[habit.id].days() == [day, day + 2, day + 9]
+
+
+# Unit test for the startup cost
+def test_import_main_is_lazy(tmp_path):
+    # import main in a fresh interpreter, from a directory without a database
+    code = "import sys, main; print(sorted(m for m in ('numpy', 'matplotlib') if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+
+    assert result.stdout.strip() == "[]"
+    assert not (tmp_path / "habits.db").exists()
+
+
+# Unit test for the batch command mode
+def test_run_batch(session):
+    commands = [
+        '{"command": "create", "task": "Stretch", "frequency": "daily"}',
+        '',
+        '{"command": "create", "task": "Stretch", "frequency": "hourly"}',
+        '{"command": "unknown"}',
+        '[1]',
+        '"create"',
+    ]
+    output = StringIO()
+    assert run_batch(session, commands, output) == 4
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    habit_id = results[0]["result"]["id"]
+    assert results[0] == {"ok": True, "result": {"id": habit_id, "task": "Stretch", "frequency": "daily"}}
+    assert [result["ok"] for result in results] == [True, False, False, False, False]
+
+    # a failed commit reports no command as done
+    class FailingCommit:
+        def __getattr__(self, name):
+            return getattr(session, name)
+
+        def commit(self):
+            raise RuntimeError("disk full")
+
+    output = StringIO()
+    with pytest.raises(RuntimeError):
+        run_batch(FailingCommit(), ['{"command": "create", "task": "Lost", "frequency": "daily"}'], output)
+    assert [json.loads(line)["ok"] for line in output.getvalue().splitlines()] == [False]
+
+    today = datetime.now().date()
+    commands = [json.dumps({"command": "checkpoint", "habit_id": habit_id, "date": str(today - timedelta(days=2))}),
+                json.dumps({"command": "checkpoint", "habit_id": habit_id, "date": str(today)}),
+                json.dumps({"command": "checkpoint", "habit_id": habit_id, "date": str(today)}),
+                json.dumps({"command": "streak", "habit_id": habit_id}),
+                json.dumps({"command": "broken"}),
+                json.dumps({"command": "list", "frequency": "daily"})]
+    output = StringIO()
+    assert run_batch(session, commands, output) == 0
+    added, _, duplicate, streak, broken, listed = [json.loads(line)["result"] for line in output.getvalue().splitlines()]
+    assert added["added"] and not duplicate["added"]
+    assert (streak["longest"], streak["current"], streak["broken"]) == (1, 1, True)
+    assert habit_id in [habit["id"] for habit in broken["habits"]]
+    assert habit_id in [habit["id"] for habit in listed["habits"]]
+
+
+def test_build_parser():
+    args = build_parser().parse_args(["checkpoint", "3", "2023-06-01 08:30"])
+    assert (args.command, args.habit_id, args.date, args.batch) == ("checkpoint", 3, "2023-06-01 08:30", False)
+    assert build_parser().parse_args(["--batch"]).batch
+
+
+# Unit test for the storage configuration
+def test_load_config_and_pragmas(tmp_path):
+    config_file = tmp_path / "habits.json"
+    config_file.write_text(json.dumps({"path": str(tmp_path / "tuned.db"), "profile": "durable", "cache_size": -2000}))
+
+    config = load_config(str(config_file), environ={"HABITS_DB_SYNCHRONOUS": "normal"})
+    assert config.path == str(tmp_path / "tuned.db")
+    assert config.pragmas == {"journal_mode": "wal", "synchronous": "normal", "cache_size": -2000, "busy_timeout": 5000}
+
+    engine = create_configured_engine(config)
+    assert engine.execute("PRAGMA journal_mode").scalar() == "wal"
+    assert engine.execute("PRAGMA synchronous").scalar() == 1
+    assert engine.execute("PRAGMA cache_size").scalar() == -2000
+    engine.dispose()
+
+    with pytest.raises(ValueError):
+        DatabaseConfig(profile="reckless")
+    with pytest.raises(ValueError):
+        DatabaseConfig(synchronous="off; DROP TABLE habits")
+
+
+# Integration test for the HTTP service
+def test_service(tmp_path, monkeypatch):
+    server = create_server(("127.0.0.1", 0), DatabaseConfig(path=str(tmp_path / "service.db")), quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def call(method, path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(url + path, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    try:
+        status, body = call("POST", "/habits", {"task": "Read", "frequency": "daily"})
+        assert status == 201
+        habit_id = body["result"]["id"]
+        today = datetime.now().date()
+        for day in [today - timedelta(days=3), today - timedelta(days=1), today]:
+            assert call("POST", f"/habits/{habit_id}/checkpoints", {"date": str(day)})[0] == 201
+
+        status, body = call("GET", f"/habits/{habit_id}")
+        assert (body["result"]["longest"], body["result"]["current"], body["result"]["broken"]) == (2, 2, True)
+        assert habit_id in [habit["id"] for habit in call("GET", "/analytics/broken")[1]["result"]["habits"]]
+        assert [habit["id"] for habit in call("GET", "/habits?frequency=daily")[1]["result"]["habits"]] == [habit_id]
+
+        status, body = call("GET", f"/habits/{habit_id}?recompute=false")
+        assert (status, body["result"]["longest"]) == (200, 2)
+        assert call("GET", f"/habits/{habit_id}?recompute=maybe")[0] == 400
+
+        # the route alone picks the command, clients cannot override it or pass other parameters
+        assert call("POST", "/habits", {"command": "purge", "habit_ids": [habit_id]})[0] == 400
+        assert call("GET", f"/habits/{habit_id}?command=delete")[0] == 400
+        assert call("GET", "/analytics/broken?workers=64")[0] == 400
+        assert call("GET", "/analytics/longest", {"output": "habits.png"})[0] == 400
+        assert call("POST", "/habits", {"task": ["Read"], "frequency": "daily"})[0] == 400
+        assert [habit["id"] for habit in call("GET", "/habits")[1]["result"]["habits"]] == [habit_id]
+
+        status, body = call("PATCH", f"/habits/{habit_id}", {"task": "Read a book", "frequency": "weekly"})
+        assert (status, body["result"]["task"], body["result"]["frequency"]) == (200, "Read a book", "weekly")
+        assert call("GET", f"/habits/{habit_id}")[1]["result"]["current"] == 1
+
+        assert call("POST", "/habits", {"task": "Read", "frequency": "hourly"})[0] == 400
+        assert call("GET", "/nowhere")[0] == 404
+        assert call("DELETE", f"/habits/{habit_id}")[0] == 200
+        assert call("GET", "/habits")[1]["result"]["habits"] == []
+
+        # unexpected errors are answered with a 500 and the session is rolled back
+        def fail(db_session, command):
+            db_session.add(Habit(task="Never stored", frequency=Frequency.DAILY))
+            db_session.flush()
+            raise RuntimeError("boom")
+
+        monkeypatch.setattr(service, "run_command", fail)
+        assert call("GET", "/analytics/broken") == (500, {"ok": False, "error": "Internal server error"})
+        monkeypatch.undo()
+        assert call("GET", "/habits")[1]["result"]["habits"] == []
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.engine.dispose()
+
+
+# Unit test for the process pool analytics
+def test_parallel_analytics(tmp_path):
+    path = str(tmp_path / "parallel.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    db_session = Session()
+    today = datetime.now()
+    # two daily habits tie with a streak of 3 in different shards, one weekly habit is broken
+    patterns = [(Frequency.DAILY, [0, 1, 2]), (Frequency.DAILY, [0, 2]), (Frequency.WEEKLY, [0, 14]),
+                (Frequency.WEEKLY, []), (Frequency.DAILY, [5, 6, 7, 9])]
+    for number, (frequency, days) in enumerate(patterns):
+        habit = Habit(task=f"Habit {number}", frequency=frequency)
+        habit.checkpoints = [Checkpoint(checkpoint_date=today - timedelta(days=day)) for day in days]
+        db_session.add(habit)
+    db_session.commit()
+    habits = db_session.query(Habit).order_by(Habit.id).all()
+    weekly, weekly_habits, daily, daily_habits = get_longest_run_streak(habits)
+    expected = ShardResult(weekly, [habit.id for habit in weekly_habits], daily, [habit.id for habit in daily_habits],
+                           [habit.id for habit in get_broken_streak_habits(habits)])
+    assert (expected.daily_streak, len(expected.daily_ids)) == (3, 2)
+
+    assert shard_ranges(engine, 2) == [(habits[0].id, habits[1].id), (habits[2].id, habits[4].id)]
+    assert parallel_analytics(path, workers=1, shards=5) == expected
+    assert parallel_analytics(path, workers=2) == expected
+
+    # checkpoints of a habit deleted without foreign keys and rows without a day are skipped
+    engine.execute("DELETE FROM habits WHERE id = ?", habits[1].id)
+    engine.execute("INSERT INTO checkpoints (habit_id, checkpoint_date) VALUES (?, ?)",
+                   habits[0].id, today - timedelta(days=30))
+    expected = expected._replace(broken_ids=[habit_id for habit_id in expected.broken_ids if habit_id != habits[1].id])
+    assert parallel_analytics(path, workers=1, shards=2) == expected
+    db_session.close()
+    engine.dispose()
+
+
+# Unit test for the tenant shards
+def test_shard_router_and_leaderboard(tmp_path):
+    router = ShardRouter.from_directory(str(tmp_path), 3, DatabaseConfig())
+    tenants = ["alice", "bob", "carol", "dave"]
+    assert [router.shard_for(tenant) for tenant in tenants] == [router.shard_for(tenant) for tenant in tenants]
+    assert all(0 <= router.shard_for(tenant) < 3 for tenant in tenants)
+
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    for streak, tenant in enumerate(tenants, start=1):
+        db_session = router.session(tenant)
+        habit = create_tenant_habit(db_session, f"{tenant}'s walk", Frequency.DAILY)
+        db_session.flush()
+        for day in range(streak):
+            insert_checkpoint(db_session, habit.id, today - timedelta(days=day))
+        # a broken habit with a single-day streak
+        broken = create_tenant_habit(db_session, f"{tenant}'s run", Frequency.DAILY)
+        db_session.flush()
+        insert_checkpoint(db_session, broken.id, today - timedelta(days=10))
+        insert_checkpoint(db_session, broken.id, today - timedelta(days=20))
+        db_session.commit()
+        db_session.close()
+
+    db_session = router.session("carol")
+    assert {habit.owner for habit in tenant_habits(db_session)} == {"carol"}
+    assert [habit.task for habit in tenant_broken_streak_habits(db_session)] == ["carol's run"]
+    _, _, daily, daily_habits = tenant_longest_run_streak(db_session)
+    assert (daily, [habit.task for habit in daily_habits]) == (3, ["carol's walk"])
+    db_session.close()
+
+    board = leaderboard(router, limit=3)
+    assert [(entry.owner, entry.longest_streak) for entry in board] == [("dave", 4), ("carol", 3), ("bob", 2)]
+    assert board[0].shard == router.shard_for("dave")
+    router.dispose()
+
+
+def test_migrate_schema_adds_habit_owner():
+    engine = create_engine("sqlite:///:memory:")
+    # the habits table as created before habits had an owner
+    engine.execute("CREATE TABLE habits (id INTEGER PRIMARY KEY, task VARCHAR, frequency VARCHAR(6))")
+    engine.execute("INSERT INTO habits (task, frequency) VALUES ('Read', 'DAILY')")
+    migrate_schema(engine)
+    assert engine.execute("SELECT owner FROM habits").scalar() == DEFAULT_OWNER
+    engine.dispose()
+
+
+# Unit test for the streaming analytics
+def test_streaming_analytics_memory_is_bounded():
+    def build(num_habits):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        engine.execute(Habit.__table__.insert(), [
+            {"id": habit_id, "task": f"Habit {habit_id}", "frequency": Frequency.DAILY if habit_id % 2 else Frequency.WEEKLY}
+            for habit_id in range(1, num_habits + 1)])
+        engine.execute(Checkpoint.__table__.insert(), [
+            {"habit_id": habit_id, "checkpoint_date": datetime(2023, 1, 1) + timedelta(days=day)}
+            for habit_id in range(1, num_habits + 1) for day in range(100) if (habit_id + day) % 9])
+        return sessionmaker(bind=engine)()
+
+    def peak_memory(db_session):
+        tracemalloc.start()
+        for _ in iter_habit_streaks(db_session, chunk_size=200):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    small, large = build(20), build(400)
+    peak_memory(small)
+    # twenty times the rows must not need noticeably more memory
+    assert peak_memory(large) < 1.5 * peak_memory(small)
+
+    today = datetime(2023, 4, 11).toordinal()
+    records = load_habit_records(large)
+    assert [stats for _, _, stats in iter_habit_streaks(large, today=today)] == compute_streaks(records, today)
+    weekly, weekly_habits, daily, daily_habits = get_longest_run_streak(records)
+    assert stream_longest_run_streak(large) == (weekly, [habit.id for habit in weekly_habits],
+                                                daily, [habit.id for habit in daily_habits])
+    assert list(iter_broken_streak_habits(large)) == [record.id for record in get_broken_streak_habits(records)]
+    small.close()
+    large.close()
+
+
+# Unit test for the synthetic data generator and the benchmark suite
+def test_generate_dataset_is_reproducible(tmp_path):
+    today = datetime(2023, 6, 30)
+    counts = []
+    rows = []
+    for name in ["first.db", "second.db"]:
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        counts.append(generate_dataset(engine, 40, 28, probability=0.5, daily_share=0.75, seed=7, today=today))
+        rows.append(engine.execute("SELECT h.id, h.frequency, c.checkpoint_date FROM habits h "
+                                   "JOIN checkpoints c ON c.habit_id = h.id ORDER BY c.id").fetchall())
+        frequencies = [frequency for frequency, in engine.execute("SELECT frequency FROM habits")]
+        assert engine.execute("SELECT COUNT(*) FROM habit_stats").scalar() == 40
+        engine.dispose()
+    assert counts[0] == counts[1] and counts[0][0] == 40
+    assert rows[0] == rows[1]
+    assert 20 < frequencies.count("DAILY") < 40
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'first.db'}")
+    # a second run appends habits after the existing ones
+    assert generate_dataset(engine, 5, 7, seed=1)[0] == 5
+    assert engine.execute("SELECT MAX(id) FROM habits").scalar() == 45
+    engine.dispose()
+
+
+def test_compare_results():
+    baseline = {"results": [{"scale": "10x10", "benchmark": "query_streaks", "seconds": 0.100},
+                            {"scale": "10x10", "benchmark": "compute_streaks", "seconds": 0.0001}]}
+    report = {"results": [{"scale": "10x10", "benchmark": "query_streaks", "seconds": 0.200},
+                          {"scale": "10x10", "benchmark": "compute_streaks", "seconds": 0.0004},
+                          {"scale": "20x10", "benchmark": "query_streaks", "seconds": 1.0}]}
+    # tiny absolute differences and benchmarks without a baseline are not regressions
+    assert compare_results(baseline, report) == [("10x10", "query_streaks", 0.100, 0.200)]
+    assert parse_scales("100x90, 5x7") == [(100, 90), (5, 7)]
+    with pytest.raises(ValueError):
+        parse_scales("100")
+
+
+# Unit test for the instrumentation
+def test_instrumentation(session, tmp_path):
+    habit = Habit(task='Instrumented', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 6, day)) for day in (1, 2, 4)]
+    session.add(habit)
+    session.commit()
+    metrics.reset()
+
+    get_longest_run_streak([habit], session=session)
+    assert metrics.histograms == {}
+
+    enable()
+    try:
+        analytics_cache.clear()
+        get_longest_run_streak([habit], session=session)
+        with operation("menu.test"):
+            with idle():
+                time.sleep(0.05)
+        # queries run on the raw cursor are counted too
+        with operation("segments.test"):
+            query_segment_streaks(session, [habit.id])
+    finally:
+        disable()
+    data = metrics.to_dict()
+    assert data["operation_sql_statements"]["segments.test"] == 2
+    operations = data["histograms"]["operation_seconds"]
+    assert operations["analytics.get_longest_run_streak"]["count"] == 1
+    assert operations["analytics.query_habit_stats"]["count"] == 1
+    assert data["operation_sql_statements"]["analytics.query_habit_stats"] >= 1
+    assert data["histograms"]["sql_seconds"]["SELECT"]["count"] >= 1
+    # waiting for input is not counted
+    assert operations["menu.test"]["sum"] < 0.05
+    assert operations["menu.test"]["buckets"]["+Inf"] == 1
+
+    path = tmp_path / "metrics.prom"
+    write_metrics(str(path))
+    text = path.read_text()
+    assert "# TYPE habits_operation_seconds histogram" in text
+    assert 'habits_operation_seconds_count{operation="analytics.get_longest_run_streak"} 1' in text
+    write_metrics(str(tmp_path / "metrics.json"))
+    assert json.loads((tmp_path / "metrics.json").read_text()) == data
+    metrics.reset()
+
+
+# Unit test for the integer day columns
+def test_checkpoint_day_columns(session):
+    habit = Habit(task='Day columns', frequency=Frequency.DAILY)
+    habit.checkpoints = [Checkpoint(checkpoint_date=datetime(2023, 6, 1, 8, 30, 15))]
+    session.add(habit)
+    session.commit()
+    insert_checkpoint(session, habit.id, datetime(2023, 6, 2, 23, 59))
+    insert_checkpoints(session, [(habit.id, datetime(2023, 6, 3)), (habit.id, datetime(2023, 6, 4, 12))])
+    session.commit()
+    rows = session.query(Checkpoint.day, Checkpoint.time_of_day).filter_by(habit_id=habit.id) \
+        .order_by(Checkpoint.day).all()
+    assert rows == [(datetime(2023, 6, 1).toordinal(), 30615), (datetime(2023, 6, 2).toordinal(), 86340),
+                    (datetime(2023, 6, 3).toordinal(), 0), (datetime(2023, 6, 4).toordinal(), 43200)]
+    checkpoint = Checkpoint(checkpoint_date=datetime(2023, 6, 1))
+    checkpoint.checkpoint_date = datetime(2023, 7, 1, 0, 1)
+    assert (checkpoint.day, checkpoint.time_of_day) == (datetime(2023, 7, 1).toordinal(), 60)
+
+
+def test_upgrade_database_in_batches(tmp_path):
+    path = str(tmp_path / "old.db")
+    engine = create_engine(f"sqlite:///{path}")
+    # the tables as created before checkpoints had day columns
+    engine.execute("CREATE TABLE habits (id INTEGER PRIMARY KEY, task VARCHAR, frequency VARCHAR(6))")
+    engine.execute("CREATE TABLE checkpoints (id INTEGER PRIMARY KEY, habit_id INTEGER, checkpoint_date DATETIME)")
+    engine.execute("INSERT INTO habits (task, frequency) VALUES ('Read', 'DAILY')")
+    for day in range(1, 11):
+        engine.execute("INSERT INTO checkpoints (habit_id, checkpoint_date) VALUES (1, ?)",
+                       f"2023-06-{day:02d} 07:00:00.000000")
+    engine.dispose()
+
+    batches = []
+    result = upgrade_database(path, batch_size=3, progress=batches.append)
+    assert result["filled"] == 10 and batches == [3, 6, 9, 10]
+
+    engine = create_engine(f"sqlite:///{path}")
+    assert engine.execute("SELECT MIN(day), MAX(day), MIN(time_of_day) FROM checkpoints").fetchone() == \
+        (datetime(2023, 6, 1).toordinal(), datetime(2023, 6, 10).toordinal(), 7 * 3600)
+    assert engine.execute("PRAGMA user_version").scalar() == len(MIGRATIONS)
+    indexes = [name for name, in engine.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert "ix_checkpoints_habit_id_day" in indexes
+    assert engine.execute("SELECT longest_streak FROM habit_stats WHERE habit_id = 1").scalar() == 10
+    assert [key[6] for key in engine.execute("PRAGMA foreign_key_list(checkpoints)")] == ["CASCADE"]
+    engine.dispose()
+    # upgrading again has nothing left to do
+    assert upgrade_database(path)["filled"] == 0
+
+
+def test_completion_matrix_rates_and_trends():
+    import numpy as np
+    done = np.zeros((2, 14), dtype=bool)
+    done[0, 7:] = True  # daily habit, done every day of the second week only
+    done[1, [0, 7, 13]] = True  # weekly habit
+    matrix = CompletionMatrix([1, 2], [1, 7], 1000, done)
+    assert matrix.last_day == 1013
+    assert matrix.completions(1007, 1013).tolist() == [7, 2]
+    assert matrix.completion_rates(7).tolist() == [1.0, 1.0]
+    assert matrix.completion_rates(7, as_of=1006).tolist() == [0.0, 1.0]
+    assert matrix.trends(7).tolist() == [1.0, 0.0]
+    assert matrix.current_streaks().tolist() == [7, 1]
+    assert matrix.current_streaks(as_of=1008).tolist() == [2, 2]
+    rolling = matrix.rolling_rates(7)
+    assert np.isnan(rolling[:, :6]).all() and rolling[0, 6:].tolist() == [i / 7 for i in range(8)]
+
+
+def test_load_completion_matrix_matches_streaks(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'rolling.db'}")
+    today = datetime(2023, 6, 30)
+    generate_dataset(engine, 50, 60, seed=3, today=today)
+    db_session = sessionmaker(bind=engine)()
+    matrix = load_completion_matrix(db_session, today - timedelta(days=59), today)
+    records = load_habit_records(db_session)
+    expected = compute_streaks(records, today=today.toordinal())
+    assert matrix.habit_ids.tolist() == [record.id for record in records]
+    assert matrix.current_streaks().tolist() == [stats.current for stats in expected]
+    counts = completed_days_between(db_session, today - timedelta(days=29), today)
+    assert matrix.completions(today - timedelta(days=29), today).tolist() == \
+        [counts.get(record.id, 0) for record in records]
+    plan = engine.execute("EXPLAIN QUERY PLAN SELECT habit_id, day FROM checkpoints WHERE day BETWEEN 1 AND 2")
+    assert "ix_checkpoints_day_habit_id" in " ".join(str(row) for row in plan)
+    summary = matrix.summary()
+    assert set(summary[0].rates) == {7, 30, 90} and 0 <= summary[0].rates[30] <= 1
+    db_session.close()
+    engine.dispose()
+
+
+def test_snapshot_backend_and_incremental_refresh(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'snapshot.db'}")
+    today = datetime(2023, 6, 30)
+    generate_dataset(engine, 40, 45, seed=5, today=today)
+    directory = str(tmp_path / "snapshot")
+    first = export_snapshot(engine, directory)
+    assert first["full"] and first["read"] == first["checkpoints"]
+
+    db_session = sessionmaker(bind=engine)()
+    habits = db_session.query(Habit).order_by(Habit.id).all()
+    insert_checkpoint(db_session, habits[0].id, today + timedelta(days=1))
+    db_session.commit()
+    refresh = export_snapshot(engine, directory)
+    assert refresh == {"read": 1, "checkpoints": first["checkpoints"] + 1, "full": False}
+
+    snapshot = open_snapshot(directory)
+    records = load_habit_records(db_session)
+    assert snapshot.streaks(today.toordinal()) == compute_streaks(records, today.toordinal())
+    assert [habit.id for habit in get_broken_streak_habits(habits, snapshot=snapshot)] == \
+        [record.id for record in get_broken_streak_habits(records)]
+    assert get_longest_streak_for_habit(habits[3], snapshot=snapshot) == get_longest_streak_for_habit(records[3])
+    assert snapshot.habit_streaks([10 ** 6]) == [StreakStats(0, 0, False, None)]
+
+    # a deleted checkpoint no longer matches the count, the next refresh exports everything
+    db_session.delete(habits[1].checkpoints[0])
+    db_session.commit()
+    assert export_snapshot(engine, directory)["full"]
+    assert open_snapshot(directory).streaks() == compute_streaks(load_habit_records(db_session))
+
+    # sqlite reuses the id of a deleted newest checkpoint, the count and highest id stay the same
+    newest = db_session.query(Checkpoint).order_by(Checkpoint.id.desc()).first()
+    newest_id = newest.id
+    db_session.delete(newest)
+    db_session.commit()
+    insert_checkpoint(db_session, habits[2].id, today + timedelta(days=5))
+    db_session.commit()
+    assert db_session.query(Checkpoint).order_by(Checkpoint.id.desc()).first().id == newest_id
+    assert export_snapshot(engine, directory)["full"]
+    assert open_snapshot(directory).streaks() == compute_streaks(load_habit_records(db_session))
+    assert not export_snapshot(engine, directory)["full"]
+    db_session.close()
+    engine.dispose()
+
+
+def test_delete_habits_cascades(tmp_path, session):
+    engine = create_configured_engine(DatabaseConfig(path=str(tmp_path / "cascade.db")))
+    generate_dataset(engine, 20, 30, seed=2)
+    db_session = sessionmaker(bind=engine)()
+    assert db_session.execute("PRAGMA foreign_keys").scalar() == 1
+
+    assert delete_habits(db_session, list(range(1, 11)) + [999]) == 10
+    habit = db_session.query(Habit).get(11)
+    db_session.delete(habit)
+    db_session.commit()
+    for table in ("checkpoints", "habit_stats", "habit_bitmaps"):
+        assert db_session.execute(f"SELECT COUNT(*) FROM {table} WHERE habit_id <= 11").scalar() == 0
+        assert db_session.execute(f"SELECT COUNT(DISTINCT habit_id) FROM {table}").scalar() == 9
+    db_session.close()
+    engine.dispose()
+
+    # without foreign keys the rows are deleted explicitly
+    habit = Habit(task="Purge", frequency=Frequency.DAILY)
+    session.add(habit)
+    session.commit()
+    habit_id = habit.id
+    insert_checkpoint(session, habit_id, datetime(2023, 6, 1))
+    assert delete_habits(session, [habit_id]) == 1
+    session.commit()
+    assert session.query(Checkpoint).filter_by(habit_id=habit_id).count() == 0
+    assert query_habit_stats(session, [habit_id]) == {}
+
+
+def test_archive_checkpoints(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'archive.db'}")
+    today = datetime(2023, 6, 30)
+    generate_dataset(engine, 10, 60, seed=4, today=today)
+    total = engine.execute("SELECT COUNT(*) FROM checkpoints").scalar()
+    batches = []
+    result = archive_checkpoints(engine, 30, today=today.toordinal(), batch_size=50, progress=batches.append)
+
+    cutoff = today.toordinal() - 29
+    assert engine.execute("SELECT MIN(day) FROM checkpoints").scalar() >= cutoff
+    assert engine.execute("SELECT MAX(day) FROM checkpoint_archive").scalar() < cutoff
+    kept = engine.execute("SELECT COUNT(*) FROM checkpoints").scalar()
+    assert result["archived"] == total - kept == engine.execute("SELECT COUNT(*) FROM checkpoint_archive").scalar()
+    assert batches[-1] == result["archived"] and len(batches) == -(-result["archived"] // 50)
+    db_session = sessionmaker(bind=engine)()
+    records = load_habit_records(db_session)
+    assert [stats.longest for stats in compute_streaks(records)] == \
+        [query_habit_stats(db_session)[record.id].longest for record in records]
+    db_session.close()
+    assert archive_checkpoints(engine, 30, today=today.toordinal())["archived"] == 0
+    engine.dispose()
+
+
+def test_streak_segments_follow_inserts_and_deletes(session):
+    import random
+    rng = random.Random(7)
+    daily = Habit(task="Segments daily", frequency=Frequency.DAILY)
+    weekly = Habit(task="Segments weekly", frequency=Frequency.WEEKLY)
+    session.add_all([daily, weekly])
+    session.commit()
+    first = datetime(2023, 1, 1)
+    for _ in range(150):
+        habit = rng.choice([daily, weekly])
+        date = first + timedelta(days=rng.randrange(40), hours=rng.choice([0, 0, 9]))
+        if rng.random() < 0.65:
+            insert_checkpoint(session, habit.id, date)
+        else:
+            delete_checkpoint(session, habit.id, date)
+        assert check_streak_segments(session, [daily.id, weekly.id]) == {}
+    session.commit()
+
+    records = load_habit_records(session, habit_ids=[daily.id, weekly.id])
+    assert [query_habit_stats(session, today=0)[record.id] for record in records] == compute_streaks(records, today=0)
+    assert load_bitmaps(session, [daily.id])[daily.id] == CompletionBitmap.from_days(records[0].days)
+    # as of an earlier day only the checkpoints until then count
+    as_of = first.toordinal() + 20
+    earlier = [HabitRecord(record.id, record.task, record.frequency, [day for day in record.days if day <= as_of])
+               for record in records]
+    assert [query_segment_streaks(session, today=as_of).get(record.id, StreakStats(0, 0, False, None))
+            for record in records] == compute_streaks(earlier, today=as_of)
+
+
+def test_check_streak_segments_repairs(session):
+    habit = Habit(task="Repair", frequency=Frequency.DAILY)
+    session.add(habit)
+    session.commit()
+    insert_checkpoints(session, [(habit.id, datetime(2023, 6, day)) for day in (1, 2, 3, 5)])
+    session.commit()
+    assert load_streak_segments(session, [habit.id]) == {habit.id: [(738672, 738674), (738676, 738676)]}
+    session.execute("UPDATE streak_segments SET end_day = end_day + 1 WHERE habit_id = :id", {"id": habit.id})
+    differences = check_streak_segments(session, [habit.id], repair=True)
+    assert differences == {habit.id: ([(738672, 738674), (738676, 738676)], [(738672, 738675), (738676, 738677)])}
+    assert check_streak_segments(session, [habit.id]) == {}
+
+
+def test_keyset_pagination_resumes_without_gaps(session):
+    daily = Habit(task="Paged daily", frequency=Frequency.DAILY)
+    weekly = Habit(task="Paged weekly", frequency=Frequency.WEEKLY)
+    session.add_all([daily, weekly])
+    session.commit()
+    insert_checkpoints(session, [(habit.id, datetime(2019, 3, day, hour)) for habit in (daily, weekly)
+                                 for day in range(1, 11) for hour in (8, 20)])
+    session.commit()
+
+    everything = run_command(session, {"command": "list"})
+    assert everything["next"] is None
+    habits, after = [], None
+    while True:
+        page = run_command(session, {"command": "list", "limit": 3, "after": after})
+        habits.extend(page["habits"])
+        after = page["next"]
+        if after is None:
+            break
+    assert habits == everything["habits"]
+
+    # paging through a date range visits every checkpoint once, in (habit_id, date) order
+    listed, after = [], None
+    while True:
+        page = run_command(session, {"command": "checkpoints", "start": "2019-03-03", "end": "2019-03-07",
+                                     "limit": 7, "after": after})
+        assert len(page["checkpoints"]) <= 7
+        listed.extend((checkpoint["habit_id"], checkpoint["date"]) for checkpoint in page["checkpoints"])
+        after = page["next"]
+        if after is None:
+            break
+    expected = [(habit.id, f"2019-03-{day:02d} {hour:02d}:00:00") for habit in (daily, weekly)
+                for day in range(3, 8) for hour in (8, 20)]
+    assert listed == expected
+
+    rows, _ = page_checkpoints(session, frequency=Frequency.WEEKLY, start_date=datetime(2019, 3, 10),
+                               end_date=datetime(2019, 3, 10))
+    assert [(row.habit_id, row.checkpoint_date.hour) for row in rows] == [(weekly.id, 8), (weekly.id, 20)]
+    with pytest.raises(ValueError):
+        run_command(session, {"command": "list", "limit": 0})
+
+
+def test_habits_with_checkpoints_writes_pages(tmp_path, monkeypatch):
+    import main
+    engine = create_engine(f"sqlite:///{tmp_path / 'listing.db'}")
+    migrate_schema(engine)
+    db_session = sessionmaker(bind=engine)()
+    streamed = Habit(task="Streamed", frequency=Frequency.DAILY)
+    db_session.add_all([streamed, Habit(task="Not started", frequency=Frequency.WEEKLY),
+                        Habit(task="Later", frequency=Frequency.DAILY)])
+    db_session.commit()
+    insert_checkpoints(db_session, [(streamed.id, datetime(2018, 5, day)) for day in (1, 2, 3)]
+                       + [(streamed.id, datetime(2018, 6, 1))])
+    db_session.commit()
+    monkeypatch.setattr(main, "session", db_session)
+
+    class Output(StringIO):
+        writes = 0
+
+        def write(self, text):
+            self.writes += 1
+            return super().write(text)
+
+    output = Output()
+    after = main.habits_with_checkpoints(start_date=datetime(2018, 5, 1), end_date=datetime(2018, 5, 31),
+                                         limit=2, output=output)
+    assert main.habits_with_checkpoints(start_date=datetime(2018, 5, 1), end_date=datetime(2018, 5, 31),
+                                        after=after, output=output) is None
+    # habits without checkpoints in the range are listed too
+    assert output.getvalue() == ("Habits and their checkpoints:\n\nHabit: Streamed (daily)\nCheckpoints:\n"
+                                 "Start Date: 2018-05-01 00:00:00\nStart Date: 2018-05-02 00:00:00\n"
+                                 "Start Date: 2018-05-03 00:00:00\n\nHabit: Not started (weekly)\nCheckpoints:\n"
+                                 "\nHabit: Later (daily)\nCheckpoints:\n")
+    # the heading and one write per page
+    assert output.writes == 3
+    db_session.close()
+    engine.dispose()
+
+
+def test_reminder_scheduler(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reminders.db'}")
+    migrate_schema(engine)
+    db_session = sessionmaker(bind=engine)()
+    daily = Habit(task="Stretch", frequency=Frequency.DAILY)
+    weekly = Habit(task="Call home", frequency=Frequency.WEEKLY)
+    db_session.add_all([daily, weekly])
+    db_session.commit()
+    today = datetime(2023, 6, 10)
+    insert_checkpoints(db_session, [(daily.id, today - timedelta(days=1)), (weekly.id, today - timedelta(days=3))])
+    db_session.commit()
+
+    sent = []
+    scheduler = ReminderScheduler(engine, sent.append)
+    assert scheduler.load(today.toordinal()) == 2
+    assert scheduler.next_due() == datetime(2023, 6, 10, 9)
+    assert scheduler.tick(datetime(2023, 6, 10, 8)) == []
+    assert scheduler.tick(datetime(2023, 6, 10, 9, 30)) == [Reminder(daily.id, "Stretch", Frequency.DAILY,
+                                                                     datetime(2023, 6, 10, 9))]
+    # checking off the habit in this process moves its reminder, repeated reminders come once a step
+    notify_checkpoint(daily.id, Frequency.DAILY, datetime(2023, 6, 11, 7))
+    # a habit outside the session is not stored, there is no ID to schedule
+    add_checkpoint(create_habit("Unsaved", Frequency.DAILY), datetime(2023, 6, 11, 8))
+    notify_checkpoint(None, Frequency.DAILY, datetime(2023, 6, 11, 8))
+    assert len(scheduler) == 2
+    assert scheduler.tick(datetime(2023, 6, 11, 12)) == []
+    # checkpoints and habits written elsewhere are picked up by the next tick
+    insert_checkpoint(db_session, weekly.id, datetime(2023, 6, 13))
+    new = Habit(task="Water plants", frequency=Frequency.WEEKLY)
+    db_session.add(new)
+    db_session.commit()
+    assert [(reminder.habit_id, reminder.due) for reminder in scheduler.tick(datetime(2023, 6, 13, 10))] == \
+        [(daily.id, datetime(2023, 6, 12, 9)), (new.id, datetime(2023, 6, 13, 9))]
+    assert scheduler.next_due() == datetime(2023, 6, 14, 9)
+    delete_habits(db_session, [daily.id])
+    db_session.commit()
+    assert [reminder.habit_id for reminder in scheduler.tick(datetime(2023, 6, 20, 10))] == [weekly.id, new.id]
+    assert len(scheduler) == 2 and len(sent) == 5
+
+    output = StringIO()
+    StreamSink(output)(sent[0])
+    FileSink(str(tmp_path / "reminders.log"))(sent[0])
+    assert output.getvalue() == (tmp_path / "reminders.log").read_text() == \
+        f"2023-06-10 09:00 Stretch (daily) is due, habit {sent[0].habit_id}\n"
+    db_session.close()
+    engine.dispose()